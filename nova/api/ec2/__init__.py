@@ -154,7 +154,8 @@ class NoAuth(wsgi.Middleware):
         ctx = context.RequestContext(user_id,
                                      project_id,
                                      is_admin=True,
-                                     remote_address=remote_address)
+                                     remote_address=remote_address,
+                                     cache=True)
 
         req.environ['nova.context'] = ctx
         return self.application
@@ -202,7 +203,8 @@ class Authenticate(wsgi.Middleware):
                                       project_id=project.id,
                                       is_admin=user.is_admin(),
                                       roles=roles,
-                                      remote_address=remote_address)
+                                      remote_address=remote_address,
+                                      cache=True)
         req.environ['nova.context'] = ctxt
         uname = user.name
         pname = project.name
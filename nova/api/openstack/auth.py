@@ -69,7 +69,8 @@ class NoAuthMiddleware(wsgi.Middleware):
         ctx = context.RequestContext(user_id,
                                      project_id,
                                      is_admin=True,
-                                     remote_address=remote_address)
+                                     remote_address=remote_address,
+                                     cache=True)
 
         req.environ['nova.context'] = ctx
         return self.application
@@ -131,7 +132,8 @@ class AuthMiddleware(wsgi.Middleware):
         ctx = context.RequestContext(user_id,
                                      project_id,
                                      is_admin=is_admin,
-                                     remote_address=remote_address)
+                                     remote_address=remote_address,
+                                     cache=True)
         req.environ['nova.context'] = ctx
 
         if not is_admin and not self.auth.is_project_member(user_id,
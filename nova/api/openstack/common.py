@@ -124,18 +124,17 @@ def get_pagination_params(request):
     return params
 
 
-def limited(items, request, max_limit=FLAGS.osapi_max_limit):
+def get_offset_and_limit(request, max_limit=FLAGS.osapi_max_limit):
     """
-    Return a slice of items according to requested offset and limit.
+    Return the (offset, limit) tuple requested.
 
-    @param items: A sliceable entity
     @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
                     GET variables. 'offset' is where to start in the list,
                     and 'limit' is the maximum number of items to return. If
                     'limit' is not specified, 0, or > max_limit, we default
                     to max_limit. Negative values for either offset or limit
                     will cause exc.HTTPBadRequest() exceptions to be raised.
-    @kwarg max_limit: The maximum number of items to return from 'items'
+    @kwarg max_limit: The maximum number of items to return
     """
     try:
         offset = int(request.GET.get('offset', 0))
@@ -158,6 +157,19 @@ def limited(items, request, max_limit=FLAGS.osapi_max_limit):
         raise webob.exc.HTTPBadRequest(explanation=msg)
 
     limit = min(max_limit, limit or max_limit)
+    return offset, limit
+
+
+def limited(items, request, max_limit=FLAGS.osapi_max_limit):
+    """
+    Return a slice of items according to requested offset and limit.
+
+    @param items: A sliceable entity
+    @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
+                    GET variables, see get_offset_and_limit().
+    @kwarg max_limit: The maximum number of items to return from 'items'
+    """
+    offset, limit = get_offset_and_limit(request, max_limit)
     range_end = offset + limit
     return items[offset:range_end]
 
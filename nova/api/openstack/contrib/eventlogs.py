@@ -96,10 +96,15 @@ class EventLogsController(object):
             log_list.append(log_dict)
         return log_list
 
-    def _get_eventlogs(self, req, filters, is_detail=True):
+    def _get_eventlogs(self, req, filters, marker=None, limit=None):
         """Helper function that returns a list of eventlogs dicts."""
         ctxt = req.environ['nova.context']
-        eventlogs = db.api.eventlog_get_all(ctxt, filters)
+        try:
+            eventlogs = db.api.eventlog_get_all(ctxt, filters,
+                                                marker=marker, limit=limit)
+        except exception.MarkerNotFound:
+            msg = _('marker [%s] not found') % marker
+            raise webob.exc.HTTPBadRequest(explanation=msg)
         return eventlogs
 
     def generate_href(self, req, eventlog_id):
@@ -144,14 +149,19 @@ class EventLogsController(object):
         """
         params = self._get_filters(req)
         params['type'] = params.get('type', 'ALL')
-        logs = self._get_eventlogs(req, params)
         max_limit = max(params.get('limit'), FLAGS.pagination_limit)
-        if params.get('marker'):
-            limited_logs = common.limited_by_marker(logs,
-                                                    req,
-                                                    max_limit=max_limit)
+        # The page is read from the database by keyset on marker, plus one
+        # more row which tells whether a next page exists.
+        marker = params.pop('marker', None) or None
+        if marker:
+            offset = 0
+            limit = min(max_limit, params.get('limit') or max_limit)
         else:
-            limited_logs = common.limited(logs, req, max_limit=max_limit)
+            offset, limit = common.get_offset_and_limit(req,
+                                                        max_limit=max_limit)
+        logs = self._get_eventlogs(req, params, marker=marker,
+                                   limit=offset + limit + 1)
+        limited_logs = logs[offset:offset + limit]
         result = self._build(req, logs, limited_logs)
         return result
 
@@ -77,6 +77,9 @@ class Controller(object):
     def _limit_items(self, items, req):
         raise NotImplementedError()
 
+    def _get_limited_items(self, context, search_opts, req):
+        raise NotImplementedError()
+
     def _action_rebuild(self, info, request, instance_id):
         raise NotImplementedError()
 
@@ -125,10 +128,15 @@ class Controller(object):
                 # No 'changes-since', so we only want non-deleted servers
                 search_opts['deleted'] = False
 
-        instance_list = self.compute_api.get_all(context,
-                                                 search_opts=search_opts)
-
-        limited_list = self._limit_items(instance_list, req)
+        if search_opts['recurse_zones'] or 'reservation_id' in search_opts:
+            # Child zone results can't be paginated by our database, so
+            # the merged list has to be sliced here.  compute's get_all()
+            # always asks the child zones for a reservation_id.
+            instance_list = self.compute_api.get_all(context,
+                                                     search_opts=search_opts)
+            limited_list = self._limit_items(instance_list, req)
+        else:
+            limited_list = self._get_limited_items(context, search_opts, req)
         servers = [self._build_view(req, inst, is_detail)['server']
                     for inst in limited_list]
 
@@ -612,6 +620,13 @@ class ControllerV10(Controller):
     def _limit_items(self, items, req):
         return common.limited(items, req)
 
+    def _get_limited_items(self, context, search_opts, req):
+        offset, limit = common.get_offset_and_limit(req)
+        instance_list = self.compute_api.get_all(context,
+                                                 search_opts=search_opts,
+                                                 limit=offset + limit)
+        return instance_list[offset:offset + limit]
+
     def _update(self, context, req, id, inst_dict):
         if 'adminPass' in inst_dict['server']:
             self.compute_api.set_admin_password(context, id,
@@ -720,6 +735,17 @@ class ControllerV11(Controller):
     def _limit_items(self, items, req):
         return common.limited_by_marker(items, req)
 
+    def _get_limited_items(self, context, search_opts, req):
+        params = common.get_pagination_params(req)
+        limit = min(FLAGS.osapi_max_limit,
+                    params.get('limit', FLAGS.osapi_max_limit))
+        if not limit:
+            return []
+        return self.compute_api.get_all(context,
+                                        search_opts=search_opts,
+                                        marker=params.get('marker') or None,
+                                        limit=limit)
+
     def _validate_metadata(self, metadata):
         """Ensure that we can work with the metadata given."""
         try:
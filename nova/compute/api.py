@@ -37,6 +37,7 @@ from nova.compute import instance_types
 from nova.compute import power_state
 from nova.compute import task_states
 from nova.compute import vm_states
+from nova.compute.utils import instance_get_cached
 from nova.compute.utils import terminate_volumes
 from nova.scheduler import api as scheduler_api
 from nova.db import base
@@ -463,11 +464,15 @@ class API(base.Base):
                                           availability_zone, injected_files,
                                           admin_password, image,
                                           instance_id=None, num_instances=1,
-                                          requested_networks=None):
+                                          requested_networks=None,
+                                          instance_ids=None):
         """Send the run_instance request to the schedulers for processing."""
         pid = context.project_id
         uid = context.user_id
-        if instance_id:
+        if instance_ids:
+            LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
+                    " instances %(instance_ids)s (batch)") % locals())
+        elif instance_id:
             LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
                     " instance %(instance_id)s (single-shot)") % locals())
         else:
@@ -483,16 +488,21 @@ class API(base.Base):
             'num_instances': num_instances,
         }
 
+        args = {"topic": FLAGS.compute_topic,
+                "request_spec": request_spec,
+                "availability_zone": availability_zone,
+                "admin_password": admin_password,
+                "injected_files": injected_files,
+                "requested_networks": requested_networks}
+        if instance_ids:
+            method = "run_instances"
+            args["instance_ids"] = instance_ids
+        else:
+            method = "run_instance"
+            args["instance_id"] = instance_id
         rpc.cast(context,
                  FLAGS.scheduler_topic,
-                 {"method": "run_instance",
-                  "args": {"topic": FLAGS.compute_topic,
-                           "instance_id": instance_id,
-                           "request_spec": request_spec,
-                           "availability_zone": availability_zone,
-                           "admin_password": admin_password,
-                           "injected_files": injected_files,
-                           "requested_networks": requested_networks}})
+                 {"method": method, "args": args})
 
     def create_all_at_once(self, context, instance_type,
                image_href, kernel_id=None, ramdisk_id=None,
@@ -576,14 +586,24 @@ class API(base.Base):
                                     base_options, security_group,
                                     block_device_mapping, num=num)
             instances.append(instance)
-            instance_id = instance['id']
 
+        # NOTE: a reservation of several instances is placed by the
+        #       scheduler in a single pass rather than one request each.
+        instance_ids = [instance['id'] for instance in instances]
+        if len(instance_ids) == 1:
             self._ask_scheduler_to_create_instance(context, base_options,
                                         instance_type, zone_blob,
                                         availability_zone, injected_files,
                                         admin_password, image,
-                                        instance_id=instance_id,
+                                        instance_id=instance_ids[0],
                                         requested_networks=requested_networks)
+        else:
+            self._ask_scheduler_to_create_instance(context, base_options,
+                                        instance_type, zone_blob,
+                                        availability_zone, injected_files,
+                                        admin_password, image,
+                                        requested_networks=requested_networks,
+                                        instance_ids=instance_ids)
 
         return [dict(x.iteritems()) for x in instances]
 
@@ -862,11 +882,7 @@ class API(base.Base):
         # NOTE(sirp): id used to be exclusively integer IDs; now we're
         # accepting both UUIDs and integer IDs. The handling of this
         # is done in db/sqlalchemy/api/instance_get
-        if utils.is_uuid_like(instance_id):
-            uuid = instance_id
-            instance = self.db.instance_get_by_uuid(context, uuid)
-        else:
-            instance = self.db.instance_get(context, instance_id)
+        instance = instance_get_cached(self.db, context, instance_id)
         return dict(instance.iteritems())
 
     @scheduler_api.reroute_compute("get")
@@ -879,11 +895,17 @@ class API(base.Base):
         """
         return self.get(context, instance_id)
 
-    def get_all(self, context, search_opts=None):
+    def get_all(self, context, search_opts=None, marker=None, limit=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retreive
         all instances in the system.
+
+        marker and limit page through the instances of this zone: only
+        instances after the instance with id marker are returned, at most
+        limit of them.  They are ignored when child zones are searched too
+        (recurse_zones or reservation_id), the caller has to page through
+        the merged list then.
         """
 
         if search_opts is None:
@@ -934,8 +956,12 @@ class API(base.Base):
         recurse_zones = search_opts.get('recurse_zones', False)
         if 'reservation_id' in filters:
             recurse_zones = True
+        if recurse_zones:
+            marker = limit = None
 
-        instances = self.db.instance_get_all_by_filters(context, filters)
+        instances = self.db.instance_get_all_by_filters(context, filters,
+                                                         marker=marker,
+                                                         limit=limit)
 
         if not recurse_zones:
             return instances
@@ -18,12 +18,23 @@
 #    under the License.
 
 from nova import exception
+from nova import utils
 from nova import volume
 from nova import log as logging
 
 LOG = logging.getLogger("nova.compute.utils")
 
 
+def instance_get_cached(db, context, instance_id):
+    """Get an instance by id or uuid, loading it at most once per API
+    request.  Instance writes through db invalidate it."""
+    if utils.is_uuid_like(instance_id):
+        return context.cached('instance', ('uuid', instance_id),
+                lambda: db.instance_get_by_uuid(context, instance_id))
+    return context.cached('instance', ('id', str(instance_id)),
+            lambda: db.instance_get(context, instance_id))
+
+
 def terminate_volumes(db, context, instance_id):
     """delete volumes of delete_on_termination=True in block device mapping"""
     # parameter check
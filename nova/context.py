@@ -33,7 +33,7 @@ class RequestContext(object):
     def __init__(self, user_id, project_id, is_admin=None, read_deleted=False,
                  roles=None, remote_address=None, timestamp=None,
                  request_id=None, auth_token=None, strategy='noauth',
-                 overwrite=True):
+                 overwrite=True, cache=False):
         self.user_id = user_id
         self.project_id = project_id
         self.roles = roles or []
@@ -52,6 +52,11 @@ class RequestContext(object):
         self.request_id = request_id
         self.auth_token = auth_token
         self.strategy = strategy
+        # { kind : { key : value } } loaded while handling this request, or
+        # None if nothing is cached
+        self._cache = {} if cache else None
+        # the caching context this one was elevated from
+        self._origin = None
         if overwrite or not hasattr(local.store, 'context'):
             local.store.context = self
 
@@ -71,10 +76,35 @@ class RequestContext(object):
     def from_dict(cls, values):
         return cls(**values)
 
+    def cached(self, kind, key, load):
+        """Return load(), reusing the value remembered under kind and key.
+
+        Only contexts created with cache=True remember values.  They are
+        made by the API for a single request, so everything handling the
+        request shares the rows it loaded.
+        """
+        if self._cache is None:
+            return load()
+        values = self._cache.setdefault(kind, {})
+        if key not in values:
+            values[key] = load()
+        return values[key]
+
+    def invalidate(self, kind=None):
+        """Forget the cached values of kind, or all of them."""
+        if self._origin is not None:
+            self._origin.invalidate(kind)
+        if self._cache is None:
+            return
+        if kind is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(kind, None)
+
     def elevated(self, read_deleted=None, overwrite=False):
         """Return a version of this context with admin flag set."""
         rd = self.read_deleted if read_deleted is None else read_deleted
-        return RequestContext(user_id=self.user_id,
+        ctxt = RequestContext(user_id=self.user_id,
                               project_id=self.project_id,
                               is_admin=True,
                               read_deleted=rd,
@@ -85,7 +115,19 @@ class RequestContext(object):
                               auth_token=self.auth_token,
                               strategy=self.strategy,
                               overwrite=overwrite)
+        # Writes made with the elevated context invalidate what this one
+        # cached; it does not read through the cache itself because it may
+        # see different rows.
+        if self._cache is not None or self._origin is not None:
+            ctxt._origin = self
+        return ctxt
 
 
 def get_admin_context(read_deleted=False, overwrite=False):
     return RequestContext(None, None, True, read_deleted, overwrite=overwrite)
+
+
+def invalidate_cache(ctxt, kind=None):
+    """Forget the values cached on ctxt, if it is a RequestContext."""
+    if isinstance(ctxt, RequestContext):
+        ctxt.invalidate(kind)
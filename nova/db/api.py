@@ -35,6 +35,7 @@ The underlying driver is loaded as a :class:`LazyPluggable`.
 
 """
 
+from nova import context as nova_context
 from nova import exception
 from nova import flags
 from nova import utils
@@ -53,6 +54,9 @@ flags.DEFINE_string('snapshot_name_template', 'snapshot-%08x',
                     'Template string to be used to generate snapshot names')
 flags.DEFINE_string('vsa_name_template', 'vsa-%08x',
                     'Template string to be used to generate VSA names')
+flags.DEFINE_integer('instance_query_batch_size', 200,
+                     'Number of instances fetched per query when filters '
+                     'have to be applied outside of the database')
 
 IMPL = utils.LazyPluggable(FLAGS['db_backend'],
                            sqlalchemy='nova.db.sqlalchemy.api')
@@ -354,6 +358,11 @@ def fixed_ip_create(context, values):
     return IMPL.fixed_ip_create(context, values)
 
 
+def fixed_ip_bulk_create(context, ips):
+    """Create fixed ips from a list of values dictionaries, all at once."""
+    return IMPL.fixed_ip_bulk_create(context, ips)
+
+
 def fixed_ip_disassociate(context, address):
     """Disassociate a fixed ip from an instance by address."""
     return IMPL.fixed_ip_disassociate(context, address)
@@ -479,11 +488,13 @@ def instance_data_get_for_project(context, project_id):
 
 def instance_destroy(context, instance_id):
     """Destroy the instance or raise if it does not exist."""
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_destroy(context, instance_id)
 
 
 def instance_stop(context, instance_id):
     """Stop the instance or raise if it does not exist."""
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_stop(context, instance_id)
 
 
@@ -502,9 +513,14 @@ def instance_get_all(context):
     return IMPL.instance_get_all(context)
 
 
-def instance_get_all_by_filters(context, filters):
-    """Get all instances that match all filters."""
-    return IMPL.instance_get_all_by_filters(context, filters)
+def instance_get_all_by_filters(context, filters, marker=None, limit=None):
+    """Get all instances that match all filters, newest first.
+
+    If marker is given, only instances after the instance with that id
+    are returned; limit caps the number of instances returned.
+    """
+    return IMPL.instance_get_all_by_filters(context, filters,
+                                            marker=marker, limit=limit)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
@@ -574,6 +590,7 @@ def instance_get_project_vpn(context, project_id):
 
 def instance_set_state(context, instance_id, state, description=None):
     """Set the state of an instance."""
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_set_state(context, instance_id, state, description)
 
 
@@ -583,17 +600,31 @@ def instance_update(context, instance_id, values):
     Raises NotFound if instance does not exist.
 
     """
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_update(context, instance_id, values)
 
 
+def instance_update_hosts(context, instance_hosts, values=None):
+    """Assign hosts to several instances in one transaction.
+
+    instance_hosts is a dict mapping instance ids to host names; the
+    optional values are applied to every instance as well.
+
+    """
+    nova_context.invalidate_cache(context, 'instance')
+    return IMPL.instance_update_hosts(context, instance_hosts, values)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_add_security_group(context, instance_id,
                                             security_group_id)
 
 
 def instance_remove_security_group(context, instance_id, security_group_id):
     """Disassociate the given security group from the given instance."""
+    nova_context.invalidate_cache(context, 'instance')
     return IMPL.instance_remove_security_group(context, instance_id,
                                             security_group_id)
 
@@ -721,6 +752,12 @@ def network_get_associated_fixed_ips(context, network_id):
     return IMPL.network_get_associated_fixed_ips(context, network_id)
 
 
+def network_get_fixed_ips_updated_since(context, network_id, since):
+    """Get all network's ips updated at or after since, deleted ones too."""
+    return IMPL.network_get_fixed_ips_updated_since(context, network_id,
+                                                    since)
+
+
 def network_get_by_bridge(context, bridge):
     """Get a network by bridge or raise if it does not exist."""
     return IMPL.network_get_by_bridge(context, bridge)
@@ -1109,6 +1146,12 @@ def security_group_rule_get_by_security_group(context, security_group_id):
                                                           security_group_id)
 
 
+def security_group_rule_get_by_security_groups(context, security_group_ids):
+    """Get all rules for the given security groups."""
+    return IMPL.security_group_rule_get_by_security_groups(context,
+                                                           security_group_ids)
+
+
 def security_group_rule_get_by_security_group_grantee(context,
                                                       security_group_id):
     """Get all rules that grant access to the given security group."""
@@ -1408,11 +1451,13 @@ def instance_metadata_get(context, instance_id):
 
 def instance_metadata_delete(context, instance_id, key):
     """Delete the given metadata item."""
+    nova_context.invalidate_cache(context, 'instance')
     IMPL.instance_metadata_delete(context, instance_id, key)
 
 
 def instance_metadata_update(context, instance_id, metadata, delete):
     """Update metadata if it exists, otherwise create it."""
+    nova_context.invalidate_cache(context, 'instance')
     IMPL.instance_metadata_update(context, instance_id, metadata, delete)
 
 
@@ -1580,6 +1625,11 @@ def eventlog_create(context, values):
     return IMPL.eventlog_create(context, values)
 
 
+def eventlog_create_bulk(context, values_list):
+    """Create several EventLog records in one batched insert."""
+    return IMPL.eventlog_create_bulk(context, values_list)
+
+
 def eventlog_update(context, message_id, values):
     """Update EventLog record."""
     return IMPL.eventlog_update(context, message_id, values)
@@ -1597,7 +1647,20 @@ def eventlog_get_all_by_request_id(context, request_id, session=None):
                                                session=None)
 
 
-def eventlog_get_all(context, filters):
+def eventlog_get_all(context, filters, marker=None, limit=None):
     """Get all EventLog records, after applying filters."""
     return IMPL.eventlog_get_all(context,
-                                 filters)
+                                 filters,
+                                 marker=marker,
+                                 limit=limit)
+
+
+def eventlog_get_all_before(context, before, limit):
+    """Get up to limit of the oldest EventLog records created before
+    the given time."""
+    return IMPL.eventlog_get_all_before(context, before, limit)
+
+
+def eventlog_destroy_all_by_ids(context, ids):
+    """Permanently remove the given EventLog records."""
+    return IMPL.eventlog_destroy_all_by_ids(context, ids)
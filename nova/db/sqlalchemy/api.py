@@ -20,6 +20,8 @@
 """
 Implementation of SQLAlchemy backend.
 """
+import collections
+import functools
 import re
 import warnings
 
@@ -33,10 +35,13 @@ from nova import log as logging
 from nova.compute import vm_states
 from nova.db.sqlalchemy import models
 from nova.db.sqlalchemy.session import get_session
+from sqlalchemy import and_
 from sqlalchemy import or_
+from sqlalchemy import String
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
+from sqlalchemy.sql import exists
 from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
@@ -733,36 +738,77 @@ def fixed_ip_associate(context, address, instance_id, network_id=None,
     return fixed_ip_ref['address']
 
 
+# { network id : deque of (id, address) of the fixed ips of the network
+#   believed to be free, taken from the left }
+_free_fixed_ips = {}
+
+
+def _free_fixed_ip_criteria(network_id):
+    """Criteria of the fixed ips fixed_ip_associate_pool can hand out."""
+    return and_(or_(models.FixedIp.network_id == network_id,
+                    models.FixedIp.network_id == None),
+                models.FixedIp.reserved == False,
+                models.FixedIp.deleted == False,
+                models.FixedIp.instance_id == None,
+                models.FixedIp.host == None)
+
+
+def _pop_free_fixed_ip(session, network_id):
+    """(id, address) of a fixed ip of the network that is probably free.
+
+    The free fixed ips of a network are read from the database once, and
+    again only when all of them have been handed out.
+
+    """
+    free = _free_fixed_ips.get(network_id)
+    if not free:
+        free = collections.deque(session.query(models.FixedIp.id,
+                                               models.FixedIp.address).\
+                                 filter(_free_fixed_ip_criteria(network_id)).\
+                                 order_by(models.FixedIp.id).\
+                                 all())
+        _free_fixed_ips[network_id] = free
+    if not free:
+        raise exception.NoMoreFixedIps()
+    return free.popleft()
+
+
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
     session = get_session()
+    fixed_ip_id, address = _pop_free_fixed_ip(session, network_id)
+    values = {'network_id': network_id,
+              'updated_at': utils.utcnow()}
+    if instance_id:
+        instance_get(context, instance_id, session=session)
+        values['instance_id'] = instance_id
+    if host:
+        values['host'] = host
+    # NOTE: a fixed ip believed free may have been taken since, by this
+    #       or another host. Only take it if it still is free, so no row
+    #       is locked and no table scanned, and try the next one if not.
+    while True:
+        with session.begin():
+            taken = session.query(models.FixedIp).\
+                            filter_by(id=fixed_ip_id).\
+                            filter_by(address=address).\
+                            filter(_free_fixed_ip_criteria(network_id)).\
+                            update(values, synchronize_session=False)
+        if taken:
+            return address
+        fixed_ip_id, address = _pop_free_fixed_ip(session, network_id)
+
+
+@require_context
+def fixed_ip_bulk_create(_context, ips):
+    if not ips:
+        return
+    session = get_session()
     with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = session.query(models.FixedIp).\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(deleted=False).\
-                               filter_by(instance=None).\
-                               filter_by(host=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise exception.NoMoreFixedIps()
-        if not fixed_ip_ref.network:
-            fixed_ip_ref.network = network_get(context,
-                                           network_id,
-                                           session=session)
-        if instance_id:
-            fixed_ip_ref.instance = instance_get(context,
-                                                 instance_id,
-                                                 session=session)
-        if host:
-            fixed_ip_ref.host = host
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+        try:
+            session.execute(models.FixedIp.__table__.insert(), ips)
+        except Exception, e:
+            raise exception.DBError(e)
 
 
 @require_context
@@ -1235,11 +1281,81 @@ def instance_get_all(context):
                    all()
 
 
+def _regexp_to_like(pattern):
+    """Translate a filter regexp into an equivalent SQL LIKE pattern.
+
+    Only the subset of regular expressions that maps onto LIKE is handled:
+    literals (escaped or not), '.', '.*', a leading '^' and a trailing '$'.
+    Like re.match(), the result is anchored at the start of the value.
+    Returns None if the regexp can't be expressed as a LIKE pattern.
+
+    """
+    like = []
+    exact = False
+    i = 0
+    if pattern.startswith('^'):
+        i = 1
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                # \d, \w, \b and friends have no LIKE equivalent
+                return None
+            c = pattern[i + 1]
+            i += 1
+        elif c == '.':
+            if pattern[i + 1:i + 2] == '*':
+                if pattern[i + 2:i + 3] == '?':
+                    i += 1
+                like.append('%')
+                i += 2
+                continue
+            like.append('_')
+            i += 1
+            continue
+        elif c == '$' and i == len(pattern) - 1:
+            exact = True
+            break
+        elif c in '^$*+?{}[]()|':
+            return None
+        if c in '%_\\':
+            like.append('\\')
+        like.append(c)
+        i += 1
+    if not exact:
+        like.append('%')
+    return ''.join(like)
+
+
+def _instance_marker_clause(marker):
+    """Return the keyset clause selecting instances sorted after marker.
+
+    Instances are listed newest first, by created_at and then id.
+
+    """
+    created_at = models.Instance.created_at
+    if marker['created_at'] is None:
+        return and_(created_at == None,
+                    models.Instance.id < marker['id'])
+    return or_(created_at < marker['created_at'],
+               and_(created_at == marker['created_at'],
+                    models.Instance.id < marker['id']),
+               created_at == None)
+
+
 @require_context
-def instance_get_all_by_filters(context, filters):
+def instance_get_all_by_filters(context, filters, marker=None, limit=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise.
+
+    Instances are returned newest first.  If marker is given, only the
+    instances listed after the instance with that id are returned, and at
+    most limit instances are returned if limit is given.  Filters which can
+    be expressed in SQL are applied by the database; the rest are applied
+    to the rows as they are streamed in batches of
+    FLAGS.instance_query_batch_size.
+    """
 
     def _regexp_filter_by_ipv6(instance, filter_re):
         for interface in instance['virtual_interfaces']:
@@ -1296,6 +1412,44 @@ def instance_get_all_by_filters(context, filters):
             filter_dict[column] = value
             return query.filter_by(**filter_dict)
 
+    # NOTE: The EXISTS clauses below are spelled out rather than built
+    # with relationship.any(), whose bind parameters clash with the eager
+    # loads of the same relationships once the query is LIMITed.
+    def _ip_prefilter(query, like):
+        floating_ip_match = exists().where(and_(
+                models.FloatingIp.fixed_ip_id == models.FixedIp.id,
+                models.FloatingIp.deleted == False,
+                models.FloatingIp.address.like(like, escape='\\')))
+        fixed_ip_match = exists().where(and_(
+                models.FixedIp.virtual_interface_id ==
+                        models.VirtualInterface.id,
+                or_(models.FixedIp.address.like(like, escape='\\'),
+                    floating_ip_match)))
+        return query.filter(exists().where(and_(
+                models.VirtualInterface.instance_id == models.Instance.id,
+                fixed_ip_match)))
+
+    def _metadata_prefilter(query, meta):
+        if isinstance(meta, dict):
+            meta = [meta]
+        for node in meta:
+            for k, v in node.iteritems():
+                query = query.filter(exists().where(and_(
+                        models.InstanceMetadata.instance_id ==
+                                models.Instance.id,
+                        models.InstanceMetadata.deleted == False,
+                        models.InstanceMetadata.key == k,
+                        models.InstanceMetadata.value == v)))
+        return query
+
+    def _column_prefilter(query, filter_name, like):
+        column = models.Instance.__table__.columns.get(filter_name)
+        if column is None or not isinstance(column.type, String):
+            return query
+        column_attr = getattr(models.Instance, filter_name)
+        return query.filter(and_(column_attr != '',
+                                 column_attr.like(like, escape='\\')))
+
     session = get_session()
     query_prefix = session.query(models.Instance).\
                    options(joinedload_all('fixed_ips.floating_ips')).\
@@ -1307,7 +1461,8 @@ def instance_get_all_by_filters(context, filters):
                    options(joinedload_all('fixed_ips.network')).\
                    options(joinedload('metadata')).\
                    options(joinedload('instance_type')).\
-                   order_by(desc(models.Instance.created_at))
+                   order_by(desc(models.Instance.created_at),
+                            desc(models.Instance.id))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1339,33 +1494,78 @@ def instance_get_all_by_filters(context, filters):
         query_prefix = _exact_match_filter(query_prefix, filter_name,
                 filters.pop(filter_name))
 
-    instances = query_prefix.all()
-
-    if not instances:
-        return []
-
     # Now filter on everything else for regexp matching..
     # For filters not in the list, we'll attempt to use the filter_name
     # as a column name in Instance..
+    # NOTE: Regexps that translate into LIKE patterns, and metadata, are
+    # also pushed down into the query so the database can use its indexes
+    # and we don't load rows that can't match.  LIKE may be case
+    # insensitive, so the regexp is still checked on the rows returned.
     regexp_filter_funcs = {'ip6': _regexp_filter_by_ipv6,
             'ip': _regexp_filter_by_ip}
 
-    for filter_name in filters.iterkeys():
+    filter_funcs = []
+    for filter_name, filter_value in filters.iteritems():
         filter_func = regexp_filter_funcs.get(filter_name, None)
-        filter_re = re.compile(str(filters[filter_name]))
+        if filter_name == 'metadata':
+            query_prefix = _metadata_prefilter(query_prefix, filter_value)
+            filter_funcs.append(functools.partial(
+                    _regexp_filter_by_metadata, meta=filter_value))
+            continue
+        filter_re = re.compile(str(filter_value))
+        like = _regexp_to_like(str(filter_value))
         if filter_func:
-            filter_l = lambda instance: filter_func(instance, filter_re)
-        elif filter_name == 'metadata':
-            filter_l = lambda instance: _regexp_filter_by_metadata(instance,
-                    filters[filter_name])
+            if filter_name == 'ip' and like is not None:
+                query_prefix = _ip_prefilter(query_prefix, like)
+            filter_funcs.append(functools.partial(filter_func,
+                    filter_re=filter_re))
         else:
-            filter_l = lambda instance: _regexp_filter_by_column(instance,
-                    filter_name, filter_re)
-        instances = filter(filter_l, instances)
-
+            if like is not None:
+                query_prefix = _column_prefilter(query_prefix, filter_name,
+                                                 like)
+            filter_funcs.append(functools.partial(_regexp_filter_by_column,
+                    filter_name=filter_name, filter_re=filter_re))
+
+    if marker is not None:
+        marker_ref = session.query(models.Instance).\
+                             filter_by(id=marker).\
+                             first()
+        if not marker_ref:
+            raise exception.MarkerNotFound(marker=marker)
+        query_prefix = query_prefix.filter(
+                _instance_marker_clause(marker_ref))
+
+    batch_size = FLAGS.instance_query_batch_size
+    if limit and not filter_funcs:
+        batch_size = limit
+
+    instances = []
+    for batch in _instance_batches(query_prefix, batch_size):
+        for instance in batch:
+            if all(check(instance) for check in filter_funcs):
+                instances.append(instance)
+                if limit and len(instances) >= limit:
+                    return instances
     return instances
 
 
+def _instance_batches(query, batch_size):
+    """Yield the instances of query in batches of batch_size.
+
+    Uses keyset pagination on the query's (created_at, id) ordering, so
+    each batch is an indexed range scan instead of a growing OFFSET.
+
+    """
+    batch_query = query
+    while True:
+        batch = batch_query.limit(batch_size).all()
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        batch_query = query.filter(_instance_marker_clause(batch[-1]))
+
+
 @require_context
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
     """Return instances that were continuously active over window."""
@@ -1589,6 +1789,22 @@ def instance_update(context, instance_id, values):
     return instance_ref
 
 
+@require_admin_context
+def instance_update_hosts(context, instance_hosts, values=None):
+    by_host = {}
+    for instance_id, host in instance_hosts.iteritems():
+        by_host.setdefault(host, []).append(instance_id)
+
+    session = get_session()
+    with session.begin():
+        for host, instance_ids in by_host.iteritems():
+            updates = dict(values or {})
+            updates['host'] = host
+            session.query(models.Instance).\
+                    filter(models.Instance.id.in_(instance_ids)).\
+                    update(updates, synchronize_session=False)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -1899,6 +2115,7 @@ def network_get_associated_fixed_ips(context, network_id):
     session = get_session()
     return session.query(models.FixedIp).\
                    options(joinedload_all('instance')).\
+                   options(joinedload('virtual_interface')).\
                    filter_by(network_id=network_id).\
                    filter(models.FixedIp.instance_id != None).\
                    filter(models.FixedIp.virtual_interface_id != None).\
@@ -1906,6 +2123,17 @@ def network_get_associated_fixed_ips(context, network_id):
                    all()
 
 
+@require_admin_context
+def network_get_fixed_ips_updated_since(context, network_id, since):
+    session = get_session()
+    return session.query(models.FixedIp).\
+                   options(joinedload_all('instance')).\
+                   options(joinedload('virtual_interface')).\
+                   filter_by(network_id=network_id).\
+                   filter(models.FixedIp.updated_at >= since).\
+                   all()
+
+
 @require_admin_context
 def network_get_by_bridge(context, bridge):
     session = get_session()
@@ -2861,6 +3089,17 @@ def security_group_rule_get_by_security_group(context, security_group_id,
     return result
 
 
+@require_admin_context
+def security_group_rule_get_by_security_groups(context, security_group_ids):
+    session = get_session()
+    rule = models.SecurityGroupIngressRule
+    return session.query(rule).\
+                   filter_by(deleted=can_read_deleted(context)).\
+                   filter(rule.parent_group_id.in_(security_group_ids)).\
+                   options(joinedload_all('grantee_group.instances')).\
+                   all()
+
+
 @require_context
 def security_group_rule_get_by_security_group_grantee(context,
                                                       security_group_id,
@@ -4008,6 +4247,24 @@ def eventlog_create(context, values):
     return eventlog_ref
 
 
+@require_context
+def eventlog_create_bulk(context, values_list):
+    """Insert all rows with a single executemany.
+
+    Every row is given the same set of columns, as executemany requires.
+    """
+    if not values_list:
+        return
+    keys = set()
+    for values in values_list:
+        keys.update(values)
+    rows = [dict((key, values.get(key)) for key in keys)
+            for values in values_list]
+    session = get_session()
+    with session.begin():
+        session.execute(models.EventLog.__table__.insert(), rows)
+
+
 @require_context
 def eventlog_update(context, message_id, values):
     session = get_session()
@@ -4048,9 +4305,13 @@ def eventlog_get_all_by_request_id(context, request_id, session=None):
 
 
 @require_context
-def eventlog_get_all(context, filters=None):
+def eventlog_get_all(context, filters=None, marker=None, limit=None):
     """
-    Get all eventlog records.
+    Get all eventlog records, oldest first.
+
+    If marker is given, only the records listed after the record with that
+    id are returned, and at most limit records are returned if limit is
+    given.
     """
     session = get_session()
     query = session.query(models.EventLog).\
@@ -4064,6 +4325,44 @@ def eventlog_get_all(context, filters=None):
         if filters.get('created_at'):
             query = query.filter(models.EventLog.created_at >
                                  filters['created_at'])
-    query = query.order_by('created_at')
+
+    if marker is not None:
+        marker_ref = session.query(models.EventLog).\
+                             filter_by(id=marker).\
+                             first()
+        if not marker_ref:
+            raise exception.MarkerNotFound(marker=marker)
+        created_at = models.EventLog.created_at
+        query = query.filter(or_(
+                created_at > marker_ref.created_at,
+                and_(created_at == marker_ref.created_at,
+                     models.EventLog.id > marker_ref.id)))
+
+    query = query.order_by(models.EventLog.created_at, models.EventLog.id)
+    if limit is not None:
+        query = query.limit(limit)
     eventlog_ref = query.all()
     return eventlog_ref
+
+
+@require_admin_context
+def eventlog_get_all_before(context, before, limit):
+    """Get the oldest eventlog records created before the given time,
+    deleted or not."""
+    session = get_session()
+    return session.query(models.EventLog).\
+                   filter(models.EventLog.created_at < before).\
+                   order_by(models.EventLog.created_at,
+                            models.EventLog.id).\
+                   limit(limit).\
+                   all()
+
+
+@require_admin_context
+def eventlog_destroy_all_by_ids(context, ids):
+    """Remove eventlog records from the table."""
+    session = get_session()
+    with session.begin():
+        session.query(models.EventLog).\
+                filter(models.EventLog.id.in_(ids)).\
+                delete(synchronize_session=False)
@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+def _indexes():
+    instances = Table('instances', meta, autoload=True)
+    fixed_ips = Table('fixed_ips', meta, autoload=True)
+    floating_ips = Table('floating_ips', meta, autoload=True)
+    instance_metadata = Table('instance_metadata', meta, autoload=True)
+
+    # instance_get_all_by_filters() pages through instances by
+    # (created_at, id) and pushes ip and metadata filters down as
+    # EXISTS subqueries on these columns.
+    return [Index('instances_created_at_id_idx',
+                  instances.c.created_at, instances.c.id),
+            Index('fixed_ips_address_idx', fixed_ips.c.address),
+            Index('floating_ips_address_idx', floating_ips.c.address),
+            Index('instance_metadata_instance_id_key_idx',
+                  instance_metadata.c.instance_id,
+                  instance_metadata.c.key)]
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    for index in _indexes():
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            logging.error(_("Index %s not created") % index.name)
+            raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    for index in _indexes():
+        index.drop(migrate_engine)
@@ -0,0 +1,55 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+def _indexes():
+    eventlog = Table('eventlog', meta, autoload=True)
+
+    # HA cleanup reads a request's rows in id order, the rpc notifier looks
+    # rows up by message_id, and listings filter on deleted, event_type and
+    # priority while ordering by created_at.
+    return [Index('eventlog_request_id_id_idx',
+                  eventlog.c.request_id, eventlog.c.id),
+            Index('eventlog_message_id_idx', eventlog.c.message_id),
+            Index('eventlog_event_type_created_at_idx',
+                  eventlog.c.event_type, eventlog.c.created_at),
+            Index('eventlog_deleted_created_at_idx',
+                  eventlog.c.deleted, eventlog.c.created_at)]
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    for index in _indexes():
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            logging.error(_("Index %s not created") % index.name)
+            raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    for index in _indexes():
+        index.drop(migrate_engine)
@@ -0,0 +1,48 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+def _index():
+    eventlog = Table('eventlog', meta, autoload=True)
+
+    # 'nova-manage eventlog archive' walks the oldest rows, deleted or not,
+    # in (created_at, id) order.
+    return Index('eventlog_created_at_id_idx',
+                 eventlog.c.created_at, eventlog.c.id)
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    index = _index()
+    try:
+        index.create(migrate_engine)
+    except Exception:
+        logging.error(_("Index %s not created") % index.name)
+        raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    _index().drop(migrate_engine)
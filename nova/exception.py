@@ -256,6 +256,10 @@ class InvalidCidr(Invalid):
     message = _("Invalid cidr %(cidr)s.")
 
 
+class MarkerNotFound(Invalid):
+    message = _("Marker %(marker)s could not be found.")
+
+
 # Cannot be templated as the error syntax varies.
 # msg needs to be constructed when raised.
 class InvalidParameterValue(Invalid):
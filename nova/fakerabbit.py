@@ -125,14 +125,20 @@ class Backend(base.BaseBackend):
         global QUEUES
         if not queue in QUEUES or not QUEUES[queue].size():
             return None
-        (message_data, content_type, content_encoding) = QUEUES[queue].pop()
+        item = QUEUES[queue].pop()
+        (message_data, content_type, content_encoding) = item
         message = Message(backend=self, body=message_data,
+                          delivery_tag=(queue, item),
                           content_type=content_type,
                           content_encoding=content_encoding)
         message.result = True
         LOG.debug(_('Getting from %(queue)s: %(message)s') % locals())
         return message
 
+    def requeue(self, delivery_tag):
+        queue, item = delivery_tag
+        QUEUES[queue].push(item)
+
     def prepare_message(self, message_data, delivery_mode,
                         content_type, content_encoding, **kwargs):
         """Prepare message for sending."""
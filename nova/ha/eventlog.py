@@ -0,0 +1,186 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Buffered EventLog writer.
+
+The HA notification manager and the db notifier record an EventLog row for
+every notification.  Rows are collected here and written with a single
+batched insert once eventlog_batch_size rows are waiting or
+eventlog_flush_interval seconds after the first row was buffered, whichever
+comes first.  Callers that read the log back right away (failure and
+timeout handling) ask for an immediate flush.
+
+The buffer is bounded by eventlog_queue_size.  When it is full, for example
+because the database is unavailable, writers block flushing it themselves
+instead of letting it grow.
+
+Rows older than the retention period are moved out of the table into
+gzipped JSON files by archive(), which 'nova-manage eventlog archive' runs.
+"""
+
+import gzip
+import os
+
+import eventlet
+from eventlet import semaphore
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.ha.eventlog')
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('eventlog_batch_size', 100,
+                     'Number of buffered EventLog rows that triggers a flush')
+flags.DEFINE_float('eventlog_flush_interval', 1.0,
+                   'Seconds a buffered EventLog row may wait before it is '
+                   'flushed')
+flags.DEFINE_integer('eventlog_queue_size', 1000,
+                     'Maximum number of buffered EventLog rows before '
+                     'writers block')
+flags.DEFINE_integer('eventlog_retention_days', 30,
+                     'Days EventLog rows are kept in the database before '
+                     'they are archived')
+flags.DEFINE_string('eventlog_archive_path', '$state_path/eventlog_archive',
+                    'Directory EventLog rows are archived to')
+flags.DEFINE_integer('eventlog_archive_batch_size', 1000,
+                     'Number of EventLog rows archived per transaction')
+
+ARCHIVE_FIELDS = ('id', 'created_at', 'updated_at', 'deleted_at', 'deleted',
+                  'request_id', 'message_id', 'event_type', 'publisher_id',
+                  'priority', 'message', 'status', 'user_id', 'tenant_id')
+
+
+class EventLogWriter(object):
+    """Collects EventLog rows and writes them in batches."""
+
+    def __init__(self):
+        self._buffer = []
+        self._lock = semaphore.Semaphore()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def write(self, values, flush=False):
+        """Buffer an EventLog row, flushing when asked or when full."""
+        values = dict(values)
+        values.setdefault('created_at', utils.utcnow())
+        while len(self._buffer) >= FLAGS.eventlog_queue_size:
+            # NOTE: backpressure; a failing flush raises to the writer.
+            self.flush()
+        self._buffer.append(values)
+        if flush or len(self._buffer) >= FLAGS.eventlog_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = eventlet.spawn_after(FLAGS.eventlog_flush_interval,
+                                               self._timed_flush)
+
+    def flush(self):
+        """Write every buffered row.
+
+        Rows that fail to be written are put back at the head of the buffer
+        and the error is raised.
+        """
+        with self._lock:
+            if self._timer is not None:
+                # NOTE: cancel() leaves an already running timer alone.
+                self._timer.cancel()
+                self._timer = None
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            try:
+                db.eventlog_create_bulk(context.get_admin_context(), rows)
+            except Exception:
+                self._buffer[:0] = rows
+                raise
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception(_('Failed to flush %d EventLog rows, will retry'),
+                          len(self._buffer))
+            if self._timer is None:
+                self._timer = eventlet.spawn_after(
+                        FLAGS.eventlog_flush_interval, self._timed_flush)
+
+
+_WRITER = None
+
+
+def get_writer():
+    global _WRITER
+    if _WRITER is None:
+        _WRITER = EventLogWriter()
+    return _WRITER
+
+
+def write(values, flush=False):
+    """Buffer an EventLog row in the process wide writer."""
+    get_writer().write(values, flush=flush)
+
+
+def flush():
+    """Write all rows buffered in the process wide writer."""
+    get_writer().flush()
+
+
+def archive(context, before, path=None):
+    """Move the EventLog rows created before the given time to a file.
+
+    Rows are written as JSON lines to a gzipped file in path, which
+    defaults to eventlog_archive_path, and are deleted from the database
+    in batches of eventlog_archive_batch_size once they are on disk.
+
+    :returns: (filename, number of rows archived); filename is None if
+              there was nothing to archive.
+    """
+    path = path or FLAGS.eventlog_archive_path
+    batch_size = FLAGS.eventlog_archive_batch_size
+    rows = db.eventlog_get_all_before(context, before, batch_size)
+    if not rows:
+        return None, 0
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    filename = os.path.join(path, 'eventlog-%s.json.gz' %
+                            utils.utcnow().strftime('%Y%m%d%H%M%S'))
+    count = 0
+    archive_file = gzip.open(filename, 'ab')
+    try:
+        while rows:
+            for row in rows:
+                archive_file.write(utils.dumps(
+                        dict((field, row[field]) for field in ARCHIVE_FIELDS)))
+                archive_file.write('\n')
+            # NOTE: a crash after this point can only archive rows twice.
+            archive_file.flush()
+            db.eventlog_destroy_all_by_ids(context,
+                                           [row['id'] for row in rows])
+            count += len(rows)
+            LOG.debug(_('Archived %(count)d EventLog rows to %(filename)s')
+                      % locals())
+            rows = db.eventlog_get_all_before(context, before, batch_size)
+    finally:
+        archive_file.close()
+    return filename, count
@@ -19,6 +19,8 @@
 Billing Service
 """
 
+import collections
+import datetime
 import os
 import logging
 import json
@@ -31,12 +33,19 @@ from nova import manager
 from nova import rpc
 from nova import utils
 from nova.compute import instance_types
+from nova.ha import eventlog
 from nova.scheduler import zone_manager
 from nova.notifier import api
 
 
 LOG = logging.getLogger('ha.manager')
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('ha_correlation_window_size', 1024,
+                     'Number of recent requests whose EventLog rows the HA '
+                     'manager keeps in memory')
+flags.DEFINE_integer('ha_correlation_window_ttl', 60,
+                     'Seconds before the in-memory EventLog rows of a '
+                     'request are reloaded from the database')
 
 
 DEFAULT_REQUEST_ID = 'default_request'
@@ -52,6 +61,10 @@ EVENTLOG_NOTIFY_EVENT_TYPE = 'nova.ha.manager.NotificatinManager.notify'
 class NotificatinManager(manager.Manager):
     """Manages  HA notifier. """
 
+    def __init__(self, *args, **kwargs):
+        self.window = CorrelationWindow()
+        super(NotificatinManager, self).__init__(*args, **kwargs)
+
     def notify(self, message, context=None):
         """Register the database notifications HA notifier. """
 
@@ -66,8 +79,13 @@ class NotificatinManager(manager.Manager):
         if 'status' in message:
             request_id = message['request_id']
             status = EVENTLOG_STATUS_TIMEOUT
+            # The timed out row and the rest of the request are read back
+            # below, so nothing may be left in the buffer.
+            eventlog.flush()
             db.eventlog_update(context, message['message_id'], {'status':
                                EVENTLOG_STATUS_TIMEOUT})
+            self.window.update(request_id, message['message_id'],
+                               {'status': EVENTLOG_STATUS_TIMEOUT})
         else:
 
             request_id = self._get_value_from_message('request_id', message)
@@ -91,15 +109,16 @@ class NotificatinManager(manager.Manager):
                           publisher_id=message['publisher_id'],
                           priority=message['priority'])
 
-            db.eventlog_create(context, values)
+            eventlog.write(values,
+                           flush=(status == EVENTLOG_STATUS_FAILD))
+            self.window.add(values, message['payload'])
 
         # API fails when calling API, all of the  API, API to get any error.
         if status in (EVENTLOG_STATUS_FAILD, EVENTLOG_STATUS_TIMEOUT):
             # Get the information you want to cleanup the request_ID.
             LOG.error(_('Communication failure, error was detected: %s')
                       % (request_id))
-            msg = Message(db.eventlog_get_all_by_request_id(context,
-                          request_id, session=None))
+            msg = self.window.get(context, request_id)
 
             # If you can get the API for Cleanup is to run cleaupu.
             if msg.first:
@@ -131,12 +150,18 @@ class NotificatinManager(manager.Manager):
                           publisher_id=cleanup_msg['topic'],
                           priority=api.INFO)
 
-                    db.eventlog_create(context, cleanup_values)
+                    eventlog.write(cleanup_values, flush=True)
+                    self.window.add(cleanup_values, cleanup_msg['message'])
 
                     if cleanup_msg['topic']:
                         # cast a message to the cleanup
                         cleanup.cleanup_cast(context, cleanup_msg)
 
+    def notify_batch(self, messages, context=None):
+        """Register several notifications sent in one cast. """
+        for message in messages:
+            self.notify(message, context=context)
+
     def _get_value_from_message(self, key, message):
         """ Common get the value of the specified key from the message. """
         value = None
@@ -164,11 +189,76 @@ class NotificatinManager(manager.Manager):
         return value
 
 
+def _loads(message):
+    try:
+        return json.loads(message)
+    except (TypeError, ValueError):
+        return None
+
+
+class CorrelationWindow(object):
+    """ Recent EventLog rows grouped by request_id.
+
+    The rows of a request are loaded from the database the first time a
+    failure needs them and kept, together with their parsed messages, for
+    ha_correlation_window_ttl seconds.  Rows the manager writes or updates
+    in the meantime are applied to the window as well, so repeated failures
+    and timeouts of the same request are handled without a database round
+    trip or parsing the messages again.
+    """
+
+    def __init__(self):
+        # { <request_id> : {'loaded_at': ..., 'logs': [],
+        #                   'payloads': []} }
+        self._requests = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._requests)
+
+    def _is_fresh(self, entry):
+        elapsed = utils.utcnow() - entry['loaded_at']
+        return elapsed < datetime.timedelta(
+                seconds=FLAGS.ha_correlation_window_ttl)
+
+    def get(self, context, request_id):
+        """ Return a Message with all EventLog rows of the request. """
+        entry = self._requests.pop(request_id, None)
+        if entry is None or not self._is_fresh(entry):
+            logs = list(db.eventlog_get_all_by_request_id(context,
+                        request_id, session=None))
+            entry = dict(loaded_at=utils.utcnow(),
+                         logs=logs,
+                         payloads=[_loads(log['message']) for log in logs])
+        self._requests[request_id] = entry
+        while len(self._requests) > FLAGS.ha_correlation_window_size:
+            self._requests.popitem(last=False)
+        return Message(entry['logs'], entry['payloads'])
+
+    def add(self, values, payload):
+        """ Append a newly written row to a request already in the window.
+        """
+        entry = self._requests.get(values['request_id'])
+        if entry is not None:
+            entry['logs'].append(values)
+            entry['payloads'].append(payload)
+
+    def update(self, request_id, message_id, values):
+        """ Apply an EventLog update to a request already in the window. """
+        entry = self._requests.get(request_id)
+        if entry is None:
+            return
+        for log in entry['logs']:
+            if log['message_id'] == message_id:
+                log.update(values)
+
+
 class Message(object):
     """ Get the Message from the EventLog. """
 
-    def __init__(self, logs):
+    def __init__(self, logs, payloads=None):
         self.logs = logs
+        self._payloads = payloads
+        self._topics = {}
 
     def first(self):
         """ Eventlog to return the first API information. """
@@ -188,22 +278,30 @@ class Message(object):
         """ Eventlog to return the all API information."""
         return self.logs
 
+    def payloads(self):
+        """ Parsed messages of the eventlog, parsed at most once. """
+        if self._payloads is None:
+            self._payloads = [_loads(log['message']) for log in self.logs]
+        return self._payloads
+
     def get_topic(self, topicType):
         """ Get the topic from eventlog. """
+        if topicType in self._topics:
+            return self._topics[topicType]
         topic = None
         for log in self.logs:
             if topicType in log['event_type']:
                 if log['publisher_id'].find('compute') != -1:
                     topic = log['publisher_id']
                     break
+        self._topics[topicType] = topic
         return topic
 
     def get_instanceId(self):
         """ Get the incatance_id from eventlog message. """
         instance_id = None
-        for log in self.logs:
-            msg = json.loads(log['message'])
-            if 'args' in msg:
+        for msg in self.payloads():
+            if isinstance(msg, dict) and 'args' in msg:
                 if 'instance_id' in msg['args']:
                     instance_id = msg['args']['instance_id']
                     break
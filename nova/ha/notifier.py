@@ -13,9 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
+import datetime
 import logging
 import logging.handlers
 
+import eventlet
+from eventlet import queue
+
 import nova
 from nova import context
 from nova.exception import Error
@@ -26,10 +31,15 @@ from nova.notifier import api
 from nova import utils
 from nova.notifier import rabbit_notifier
 from nova.db import sqlalchemy
-from nova import db
+from nova.ha import eventlog
 import json
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('api_notification_queue_size', 1024,
+                     'Number of API notifications waiting to be sent, '
+                     'further ones are dropped. 0 sends them inline')
+flags.DEFINE_integer('api_notification_batch_size', 50,
+                     'Number of queued API notifications sent in one cast')
 
 
 
@@ -47,8 +57,6 @@ def db_decorator(name, fn):
         body = {}
 
 #        if not args and len(args) > 1:
-        print name
-        print args
         if name.startswith('nova.db.sqlalchemy.models'):
             actionm = name.split('.')[-1]
             if actionm in ('add', 'update', 'delete'):
@@ -59,8 +67,8 @@ def db_decorator(name, fn):
                     v1 = ''
                     if len(args) > 1:
                         v1 = args[1]
-                    print 'db action: table %s, action %s, param %s'\
-                               % (tablename, actionm, v1)
+                    LOG.debug('db action: table %s, action %s, param %s'
+                              % (tablename, actionm, v1))
 
                     values = dict(message=utils.dumps(v1),
                           message_id=tablename,
@@ -75,7 +83,7 @@ def db_decorator(name, fn):
 #                    f.write(str(values))
 #                    f.write('\n')
 #                    f.close()
-                    db.eventlog_create(context.get_admin_context(), values)
+                    eventlog.write(values)
 
         ret = None
         try:
@@ -98,48 +106,148 @@ def api_decorator(name, fn):
     def wrapped_func(*args, **kwarg):
         LOG.debug(args)
         LOG.debug(kwarg)
-        body = {}
-        body['args'] = []
-        body['kwarg'] = {}
-        original_args = args
+        # Only snapshot the arguments here, they are checked and sent by
+        # the notification worker.
+        ctxt = None
+        call_args = []
         for arg in args[1:]:
             if isinstance(arg, context.RequestContext):
-                body['context'] = arg
+                ctxt = arg.to_dict()
             else:
-                body['args'].append(arg)
-        try:
-            utils.dumps(body['args'])
-        except:
-            LOG.warn(_('Encode Faild arg: %s') % body['args'])
-            body['args'] = []
-        for key in kwarg:
-            try:
-                utils.dumps(kwarg[key])
-                body['kwarg'][key] = kwarg[key]
-            except:
-                LOG.warn(_('Encode Faild kwarg: %s') % kwarg[key])
-
-        api.notify(FLAGS.default_publisher_id,
-                            name,
-                            FLAGS.default_notification_level,
-                            body)
+                call_args.append(_snapshot(arg))
+        call_kwarg = dict((key, _snapshot(value))
+                          for key, value in kwarg.iteritems())
 
-        ret = None
+        NOTIFICATIONS.put(name, FLAGS.default_notification_level,
+                          ctxt, call_args, call_kwarg)
         try:
-            ret = fn(*original_args, **kwarg)
-        #except Error as e:
+            return fn(*args, **kwarg)
         except Exception as e:
-            print FLAGS.notification_driver
-            body['error'] = "%s" % e
-            api.notify(FLAGS.default_publisher_id,
-                            name,
-                            'ERROR',
-                            body)
-            raise e
-        return ret
+            NOTIFICATIONS.put(name, 'ERROR', ctxt, call_args, call_kwarg,
+                              error="%s" % e)
+            raise
     return wrapped_func
 
 
+def _snapshot(value):
+    """Shallow copy of a list or dict argument.
+
+    The notification is encoded after the API method ran, so changes the
+    method makes to the arguments it was passed would show up in it
+    otherwise.  Values nested in the copy are still shared.
+    """
+    if isinstance(value, (list, dict)):
+        return copy.copy(value)
+    return value
+
+
+# Types whose values utils.dumps can always encode.  Whether it can
+# encode a string or any other object depends on the value itself.
+_serializable_types = frozenset([int, long, float, bool, type(None),
+                                 datetime.datetime])
+
+
+def _serializable(value):
+    """Whether utils.dumps can encode value."""
+    value_type = type(value)
+    if value_type in _serializable_types:
+        return True
+    if value_type in (list, tuple):
+        return all(_serializable(item) for item in value)
+    if value_type is dict:
+        return all(_serializable(key) and _serializable(item)
+                   for key, item in value.iteritems())
+    try:
+        utils.dumps(value)
+        return True
+    except Exception:
+        return False
+
+
+class ApiNotifications(object):
+    """Sends the notifications of api_decorator from a greenthread.
+
+    Notifications wait in a queue of at most api_notification_queue_size,
+    further ones are dropped rather than slowing down the API.  The worker
+    sends whatever is queued, up to api_notification_batch_size, at once.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.worker = None
+        self.pending = 0
+        self.dropped = 0
+
+    def put(self, name, priority, ctxt, args, kwarg, error=None):
+        if not FLAGS.api_notification_queue_size:
+            api.notify(FLAGS.default_publisher_id, name, priority,
+                       _payload(ctxt, args, kwarg, error))
+            return
+        if self.queue is None:
+            self.queue = queue.LightQueue(FLAGS.api_notification_queue_size)
+        try:
+            self.queue.put_nowait((name, priority, ctxt, args, kwarg, error))
+        except queue.Full:
+            self.dropped += 1
+            LOG.warn(_('Notification queue is full, dropped %(name)s '
+                       '(%(priority)s)') % locals())
+            return
+        self.pending += 1
+        if self.worker is None:
+            self.worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        try:
+            while self.pending:
+                batch = [self.queue.get()]
+                while len(batch) < FLAGS.api_notification_batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._send(batch)
+                except Exception:
+                    LOG.exception(_('Failed to send API notifications'))
+                finally:
+                    self.pending -= len(batch)
+        finally:
+            self.worker = None
+
+    def _send(self, batch):
+        notifications = []
+        for name, priority, ctxt, args, kwarg, error in batch:
+            notifications.append((FLAGS.default_publisher_id, name,
+                                  priority,
+                                  _payload(ctxt, args, kwarg, error)))
+        api.notify_batch(notifications)
+
+    def flush(self):
+        """Wait until the queued notifications have been sent."""
+        while self.pending:
+            eventlet.sleep(0.01)
+
+
+def _payload(ctxt, args, kwarg, error):
+    body = {'args': args, 'kwarg': {}}
+    if ctxt is not None:
+        body['context'] = ctxt
+    if not _serializable(args):
+        LOG.warn(_('Encode Faild arg: %s') % args)
+        body['args'] = []
+    for key, value in kwarg.iteritems():
+        if _serializable(value):
+            body['kwarg'][key] = value
+        else:
+            LOG.warn(_('Encode Faild kwarg: %s') % value)
+    if error is not None:
+        body['error'] = error
+    return body
+
+
+NOTIFICATIONS = ApiNotifications()
+
+
 def emit(self, record):
     if 'list_notifier_drivers' in FLAGS:
         if 'nova.notifier.log_notifier' in  FLAGS.list_notifier_drivers:
@@ -163,5 +271,15 @@ def notify(message):
                                                  'args': {'message': message}})
     #LOG.info('yyyyyyy888888')
 
+
+def notify_batch(messages):
+    """Notifies several messages with one cast."""
+    if len(messages) == 1:
+        return notify(messages[0])
+    for message in messages:
+        message['method'] = 'notify'
+    rpc.cast(context.get_admin_context(), FLAGS.notification_topic,
+             {'method': 'notify_batch', 'args': {'messages': messages}})
+
 #Patching Emit function
 nova.log.PublishErrorsHandler.emit = emit
@@ -53,14 +53,23 @@ This module provides Manager, a base class for managers.
 
 """
 
+import copy
+
 from nova import flags
 from nova import log as logging
 from nova import utils
 from nova.db import base
+from nova.rpc import common as rpc_common
 from nova.scheduler import api
 
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('capabilities_full_update_interval', 1,
+                     'Send the schedulers a full capabilities snapshot every '
+                     'this many periodic tasks and only the changed '
+                     'capabilities in between; 1 always sends the full '
+                     'snapshot.  Only raise it once every scheduler '
+                     'understands capability deltas.')
 
 
 LOG = logging.getLogger('nova.manager')
@@ -85,6 +94,14 @@ class Manager(base.Base):
         """
         pass
 
+    def get_rpc_stats(self, context):
+        """Return the rpc latency histograms of this service."""
+        return rpc_common.STATS.to_dict()
+
+    def get_rpc_lanes(self, context):
+        """Return the greenthreads in use and requests waiting per lane."""
+        return rpc_common.lane_stats()
+
 
 class SchedulerDependentManager(Manager):
     """Periodically send capability updates to the Scheduler services.
@@ -99,6 +116,9 @@ class SchedulerDependentManager(Manager):
     def __init__(self, host=None, db_driver=None, service_name='undefined'):
         self.last_capabilities = None
         self.service_name = service_name
+        self._sent_capabilities = None
+        self._capabilities_sequence = 0
+        self._deltas_since_snapshot = 0
         super(SchedulerDependentManager, self).__init__(host, db_driver)
 
     def update_service_capabilities(self, capabilities):
@@ -109,7 +129,38 @@ class SchedulerDependentManager(Manager):
         """Pass data back to the scheduler at a periodic interval."""
         if self.last_capabilities:
             LOG.debug(_('Notifying Schedulers of capabilities ...'))
-            api.update_service_capabilities(context, self.service_name,
-                                self.host, self.last_capabilities)
+            self._publish_capabilities(context)
 
         super(SchedulerDependentManager, self).periodic_tasks(context)
+
+    def _publish_capabilities(self, context):
+        """Send the full capabilities or only what changed since the last
+        update.
+
+        Updates are numbered so a scheduler that missed one, or started
+        after the last snapshot, ignores deltas until the next snapshot.
+        """
+        capabilities = self.last_capabilities
+        interval = FLAGS.capabilities_full_update_interval
+        if interval <= 1:
+            api.update_service_capabilities(context, self.service_name,
+                                            self.host, capabilities)
+            return
+
+        self._capabilities_sequence += 1
+        sent = self._sent_capabilities
+        if sent is None or self._deltas_since_snapshot + 1 >= interval:
+            api.update_service_capabilities(context, self.service_name,
+                    self.host, capabilities,
+                    sequence=self._capabilities_sequence)
+            self._deltas_since_snapshot = 0
+        else:
+            changed = dict((key, value)
+                           for key, value in capabilities.iteritems()
+                           if key not in sent or sent[key] != value)
+            removed = [key for key in sent if key not in capabilities]
+            api.update_service_capabilities_delta(context, self.service_name,
+                    self.host, changed, removed, self._capabilities_sequence)
+            self._deltas_since_snapshot += 1
+        # NOTE: drivers may update their stats dict in place.
+        self._sent_capabilities = copy.deepcopy(capabilities)
@@ -21,9 +21,14 @@
 """Implements vlans, bridges, and iptables rules using linux utilities."""
 
 import calendar
+import datetime
 import inspect
 import netaddr
 import os
+import tempfile
+import time
+
+from eventlet import greenthread
 
 from nova import db
 from nova import exception
@@ -72,6 +77,17 @@ flags.DEFINE_bool('send_arp_for_ha', False,
 flags.DEFINE_bool('use_single_default_gateway',
                    False, 'Use single default gateway. Only first nic of vm'
                           ' will get default gateway from dhcp server')
+flags.DEFINE_float('iptables_apply_coalesce_window', 0,
+                   'Seconds to gather security group and provider rule '
+                   'refreshes before applying them with one '
+                   'iptables-restore. 0 applies each refresh at once')
+flags.DEFINE_integer('dhcp_hosts_reconcile_interval', 600,
+                     'Seconds between rebuilds of a dnsmasq hosts file from '
+                     'all fixed ips of its network. In between only the '
+                     'fixed ips updated since the last update are read')
+flags.DEFINE_float('dnsmasq_hup_interval', 1,
+                   'Minimum seconds between reloads of the hosts file of '
+                   'a dnsmasq, changes in between are reloaded together')
 binary_name = os.path.basename(inspect.stack()[-1][1])
 
 
@@ -290,7 +306,42 @@ class IptablesManager(object):
         self.ipv4['nat'].add_chain('floating-snat')
         self.ipv4['nat'].add_rule('snat', '-j $floating-snat')
 
-    @utils.synchronized('iptables', external=True)
+        self._deferred = 0
+        self._apply_pending = False
+        self._scheduled = None
+
+    def defer_apply_on(self):
+        """Hold back apply() until the matching defer_apply_off().
+
+        Calls may be nested, the rules are applied once by the outermost
+        defer_apply_off(), if apply() was called in between.
+
+        """
+        self._deferred += 1
+
+    def defer_apply_off(self):
+        self._deferred -= 1
+        if not self._deferred and self._apply_pending:
+            self.apply()
+
+    def schedule_apply(self):
+        """Apply the rules within iptables_apply_coalesce_window seconds.
+
+        Every change scheduled within the window is applied by a single
+        restore. Without a window this is just apply().
+
+        """
+        if not FLAGS.iptables_apply_coalesce_window:
+            self.apply()
+        elif self._scheduled is None:
+            self._scheduled = greenthread.spawn_after(
+                    FLAGS.iptables_apply_coalesce_window,
+                    self._scheduled_apply)
+
+    def _scheduled_apply(self):
+        self._scheduled = None
+        self.apply()
+
     def apply(self):
         """Apply the current in-memory set of iptables rules.
 
@@ -299,19 +350,34 @@ class IptablesManager(object):
         rules. This happens atomically, thanks to iptables-restore.
 
         """
+        if self._deferred:
+            self._apply_pending = True
+            return
+        self._apply_pending = False
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        self._apply()
+
+    @utils.synchronized('iptables', external=True)
+    def _apply(self):
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
             for table in tables:
-                current_table, _ = self.execute('%s-save' % (cmd,),
-                                                '-t', '%s' % (table,),
-                                                run_as_root=True,
-                                                attempts=5)
+                current_table, _err = self.execute('%s-save' % (cmd,),
+                                                   '-t', '%s' % (table,),
+                                                   run_as_root=True,
+                                                   attempts=5)
                 current_lines = current_table.split('\n')
                 new_filter = self._modify_rules(current_lines,
                                                 tables[table])
+                if _loaded_rules(new_filter) == _loaded_rules(current_lines):
+                    LOG.debug(_('%(cmd)s %(table)s table is up to date') %
+                              locals())
+                    continue
                 self.execute('%s-restore' % (cmd,), run_as_root=True,
                              process_input='\n'.join(new_filter),
                              attempts=5)
@@ -321,9 +387,15 @@ class IptablesManager(object):
         chains = table.chains
         rules = table.rules
 
+        # rule.top == True means we want this rule to be at the top.
+        # Further down, we weed out duplicates from the bottom of the
+        # list, so here we remove the dupes ahead of time.
+        top_rules = set(str(rule).strip() for rule in rules if rule.top)
+
         # Remove any trace of our rules
-        new_filter = filter(lambda line: binary_name not in line,
-                            current_lines)
+        new_filter = [line for line in current_lines
+                      if binary_name not in line and
+                      line.strip() not in top_rules]
 
         seen_chains = False
         rules_index = 0
@@ -335,16 +407,7 @@ class IptablesManager(object):
                 if not rule.startswith(':'):
                     break
 
-        our_rules = []
-        for rule in rules:
-            rule_str = str(rule)
-            if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
-            our_rules += [rule_str]
+        our_rules = [str(rule) for rule in rules]
 
         new_filter[rules_index:rules_index] = our_rules
 
@@ -373,6 +436,159 @@ class IptablesManager(object):
         return new_filter
 
 
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    Keeps hash:ip sets of addresses, which iptables rules of any nova
+    component on the host can match with '-m set --match-set <name> src'.
+    The members of every set this process has written are remembered, so
+    changing them only sends the added and removed addresses.
+
+    """
+
+    def __init__(self, execute=None):
+        if not execute:
+            self.execute = _execute
+        else:
+            self.execute = execute
+        self.sets = {}
+
+    @utils.synchronized('ipset')
+    def set_members(self, name, members):
+        """Make the addresses in members the content of the set name."""
+        members = set(members)
+        current = self.sets.get(name)
+        if current is not None:
+            commands = ['add %s %s' % (name, address)
+                        for address in sorted(members - current)]
+            commands += ['del %s %s' % (name, address)
+                         for address in sorted(current - members)]
+        else:
+            # The set may be left over from an earlier run. Fill a new
+            # one and swap it in, so the set never misses a member.
+            new_name = '%s-new' % (name,)
+            commands = ['create %s hash:ip family inet' % (name,),
+                        'create %s hash:ip family inet' % (new_name,),
+                        'flush %s' % (new_name,)]
+            commands += ['add %s %s' % (new_name, address)
+                         for address in sorted(members)]
+            commands += ['swap %s %s' % (new_name, name),
+                         'destroy %s' % (new_name,)]
+        if commands:
+            self.execute('ipset', '-exist', 'restore', run_as_root=True,
+                         process_input='\n'.join(commands) + '\n')
+        self.sets[name] = members
+
+
+class DhcpHosts(object):
+    """The dhcp-host entries of the networks dnsmasq serves on this host.
+
+    The entries of each device are kept in memory and updated with the
+    fixed ips that changed since the last update. All fixed ips of the
+    network are only read at the first update, and again every
+    FLAGS.dhcp_hosts_reconcile_interval to catch anything missed.
+
+    """
+
+    # Fixed ips updated this long before the last update are read again,
+    # for updates committed after it with an earlier timestamp.
+    overlap = datetime.timedelta(seconds=60)
+
+    def __init__(self):
+        # { dev : { address : entry in dhcp-host format } }
+        self.hosts = {}
+        # { dev : (time of the last rebuild, time of the last update) }
+        self.updated = {}
+        # { dev : time of the last HUP }
+        self.hupped = {}
+        # { dev : greenthread of the scheduled HUP }
+        self.scheduled_hups = {}
+
+    def update(self, context, dev, network_ref):
+        """Update the entries of dev, return whether they changed."""
+        now = utils.utcnow()
+        rebuilt_at, updated_at = self.updated.get(dev, (None, None))
+        interval = datetime.timedelta(
+                seconds=FLAGS.dhcp_hosts_reconcile_interval)
+        if rebuilt_at is None or now - rebuilt_at >= interval:
+            hosts = dict((fixed_ref['address'], _host_dhcp(fixed_ref))
+                         for fixed_ref in _dhcp_fixed_ips(context,
+                                                          network_ref))
+            changed = hosts != self.hosts.get(dev)
+            self.hosts[dev] = hosts
+            rebuilt_at = now
+        else:
+            updates = {}
+            for fixed_ref in db.network_get_fixed_ips_updated_since(
+                    context, network_ref['id'], updated_at - self.overlap):
+                if _is_dhcp_fixed_ip(fixed_ref, network_ref):
+                    updates[fixed_ref['address']] = _host_dhcp(fixed_ref)
+                else:
+                    updates[fixed_ref['address']] = None
+            hosts = self.hosts[dev]
+            changed = False
+            for address, host in updates.iteritems():
+                if hosts.get(address) == host:
+                    continue
+                changed = True
+                if host is None:
+                    del hosts[address]
+                else:
+                    hosts[address] = host
+        self.updated[dev] = (rebuilt_at, now)
+        return changed
+
+    def write(self, dev, path):
+        """Write the entries of dev to the hosts file at path."""
+        _write_file('\n'.join(sorted(self.hosts[dev].itervalues())), path)
+
+    def reload(self, dev, pid):
+        """HUP the dnsmasq of dev, at most every FLAGS.dnsmasq_hup_interval.
+
+        Reloads asked for sooner are made once the interval is over.
+
+        """
+        if dev in self.scheduled_hups:
+            return
+        wait = self.hupped.get(dev, 0) + FLAGS.dnsmasq_hup_interval - \
+               time.time()
+        if wait > 0:
+            self.scheduled_hups[dev] = greenthread.spawn_after(
+                    wait, self._scheduled_reload, dev)
+            return
+        self.hupped[dev] = time.time()
+        _execute('kill', '-HUP', pid, run_as_root=True)
+
+    def _scheduled_reload(self, dev):
+        del self.scheduled_hups[dev]
+        pid = _dnsmasq_pid_for(dev)
+        if not pid:
+            return
+        try:
+            self.reload(dev, pid)
+        except Exception as exc:  # pylint: disable=W0703
+            LOG.debug(_('Hupping dnsmasq threw %s'), exc)
+
+    def forget(self, dev):
+        """Drop the entries of dev, the next update rebuilds them."""
+        self.hosts.pop(dev, None)
+        self.updated.pop(dev, None)
+
+
+def _loaded_rules(lines):
+    """The lines of iptables-save output which iptables-restore loads,
+    without comments and packet counters."""
+    loaded = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith(':'):
+            line = line.rsplit(' ', 1)[0]
+        loaded.append(line)
+    return loaded
+
+
 def metadata_forward():
     """Create forwarding rule for metadata."""
     iptables_manager.ipv4['nat'].add_rule('PREROUTING',
@@ -520,14 +736,29 @@ def initialize_gateway_device(dev, network_ref):
                      'dev', dev, 'promisc', 'on', run_as_root=True)
 
 
-def get_dhcp_leases(context, network_ref):
-    """Return a network's hosts config in dnsmasq leasefile format."""
-    hosts = []
+def _dhcp_fixed_ips(context, network_ref):
+    """The fixed ips of a network the dnsmasq on this host hands out."""
     for fixed_ref in db.network_get_associated_fixed_ips(context,
                                                          network_ref['id']):
         host = fixed_ref['instance']['host']
         if network_ref['multi_host'] and FLAGS.host != host:
             continue
+        yield fixed_ref
+
+
+def _is_dhcp_fixed_ip(fixed_ref, network_ref):
+    """Whether the dnsmasq on this host hands out a fixed ip."""
+    if (fixed_ref['deleted'] or fixed_ref['instance_id'] is None or
+        fixed_ref['virtual_interface_id'] is None):
+        return False
+    host = fixed_ref['instance']['host']
+    return not (network_ref['multi_host'] and FLAGS.host != host)
+
+
+def get_dhcp_leases(context, network_ref):
+    """Return a network's hosts config in dnsmasq leasefile format."""
+    hosts = []
+    for fixed_ref in _dhcp_fixed_ips(context, network_ref):
         hosts.append(_host_lease(fixed_ref))
     return '\n'.join(hosts)
 
@@ -535,11 +766,7 @@ def get_dhcp_leases(context, network_ref):
 def get_dhcp_hosts(context, network_ref):
     """Get network's hosts config in dhcp-host format."""
     hosts = []
-    for fixed_ref in db.network_get_associated_fixed_ips(context,
-                                                         network_ref['id']):
-        host = fixed_ref['instance']['host']
-        if network_ref['multi_host'] and FLAGS.host != host:
-            continue
+    for fixed_ref in _dhcp_fixed_ips(context, network_ref):
         hosts.append(_host_dhcp(fixed_ref))
     return '\n'.join(hosts)
 
@@ -595,20 +822,21 @@ def update_dhcp(context, dev, network_ref):
 
     If a dnsmasq instance is already running then send a HUP
     signal causing it to reload, otherwise spawn a new instance.
+    A running instance whose hosts did not change is left alone.
 
     """
     conffile = _dhcp_file(dev, 'conf')
-    with open(conffile, 'w') as f:
-        f.write(get_dhcp_hosts(context, network_ref))
-
-    if FLAGS.use_single_default_gateway:
-        optsfile = _dhcp_file(dev, 'opts')
-        with open(optsfile, 'w') as f:
-            f.write(get_dhcp_opts(context, network_ref))
-        os.chmod(optsfile, 0644)
-
-    # Make sure dnsmasq can actually read it (it setuid()s to "nobody")
-    os.chmod(conffile, 0644)
+    changed = dhcp_hosts.update(context, dev, network_ref)
+    if changed or not os.path.exists(conffile):
+        try:
+            dhcp_hosts.write(dev, conffile)
+            if FLAGS.use_single_default_gateway:
+                _write_file(get_dhcp_opts(context, network_ref),
+                            _dhcp_file(dev, 'opts'))
+        except Exception:
+            # Rebuild and write the files again next time
+            dhcp_hosts.forget(dev)
+            raise
 
     pid = _dnsmasq_pid_for(dev)
 
@@ -617,8 +845,10 @@ def update_dhcp(context, dev, network_ref):
         out, _err = _execute('cat', '/proc/%d/cmdline' % pid,
                              check_exit_code=False)
         if conffile in out:
+            if not changed:
+                return
             try:
-                _execute('kill', '-HUP', pid, run_as_root=True)
+                dhcp_hosts.reload(dev, pid)
                 return
             except Exception as exc:  # pylint: disable=W0703
                 LOG.debug(_('Hupping dnsmasq threw %s'), exc)
@@ -778,6 +1008,20 @@ def _dhcp_file(dev, kind):
                                               kind))
 
 
+def _write_file(data, path):
+    """Replace the file at path with one holding data, atomically."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        # Make sure dnsmasq can actually read it (it setuid()s to "nobody")
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
 def _ra_file(dev, kind):
     """Return path to a pid or conf file for a bridge/device."""
 
@@ -1019,4 +1263,6 @@ class LinuxOVSInterfaceDriver(LinuxNetInterfaceDriver):
         return dev
 
 iptables_manager = IptablesManager()
+ipset_manager = IpsetManager()
+dhcp_hosts = DhcpHosts()
 interface_driver = utils.import_object(FLAGS.linuxnet_interface_driver)
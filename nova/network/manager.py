@@ -951,24 +951,22 @@ class NetworkManager(manager.SchedulerDependentManager):
         top_reserved = self._top_reserved_ips
         project_net = netaddr.IPNetwork(network['cidr'])
         num_ips = len(project_net)
-        ex_list = []
-        for index in range(num_ips):
-            address = str(project_net[index])
+        ips = []
+        for index, address in enumerate(project_net):
             if index < bottom_reserved or num_ips - index < top_reserved:
                 reserved = True
             else:
                 reserved = False
-            try:
-                self.db.fixed_ip_create(context, {'network_id': network_id,
-                                                  'address': address,
-                                                  'reserved': reserved})
-            # following processes should continue even when exception occurred
-            except exception.DBError as ex:
-                ex_list.append(ex)
-                LOG.error(_('Exception occurred in creating fixed ip '
-                            '|address=%(address)s|: %(ex)s') % locals())
-        if ex_list:
-            raise ex_list[0]
+            ips.append({'network_id': network_id,
+                        'address': str(address),
+                        'reserved': reserved})
+        try:
+            self.db.fixed_ip_bulk_create(context, ips)
+        except exception.DBError as ex:
+            cidr = network['cidr']
+            LOG.error(_('Exception occurred in creating fixed ips '
+                        '|cidr=%(cidr)s|: %(ex)s') % locals())
+            raise
 
     def _allocate_fixed_ips(self, context, instance_id, host, networks,
                             **kwargs):
@@ -1083,13 +1081,19 @@ class FlatDHCPManager(FloatingIP, RPCAllocateFixedIP, NetworkManager):
         """Do any initialization that needs to be run if this is a
         standalone service.
         """
-        self.driver.init_host()
-        self.driver.ensure_metadata_ip()
+        # Every network and floating ip changes the iptables rules,
+        # apply them all at once.
+        self.driver.iptables_manager.defer_apply_on()
+        try:
+            self.driver.init_host()
+            self.driver.ensure_metadata_ip()
 
-        super(FlatDHCPManager, self).init_host()
-        self.init_host_floating_ips()
+            super(FlatDHCPManager, self).init_host()
+            self.init_host_floating_ips()
 
-        self.driver.metadata_forward()
+            self.driver.metadata_forward()
+        finally:
+            self.driver.iptables_manager.defer_apply_off()
 
     def _setup_network(self, context, network_ref):
         """Sets up network on this host."""
@@ -1144,13 +1148,19 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         standalone service.
         """
 
-        self.driver.init_host()
-        self.driver.ensure_metadata_ip()
+        # Every network and floating ip changes the iptables rules,
+        # apply them all at once.
+        self.driver.iptables_manager.defer_apply_on()
+        try:
+            self.driver.init_host()
+            self.driver.ensure_metadata_ip()
 
-        NetworkManager.init_host(self)
-        self.init_host_floating_ips()
+            NetworkManager.init_host(self)
+            self.init_host_floating_ips()
 
-        self.driver.metadata_forward()
+            self.driver.metadata_forward()
+        finally:
+            self.driver.iptables_manager.defer_apply_off()
 
     def allocate_fixed_ip(self, context, instance_id, network, **kwargs):
         """Gets a fixed ip from the pool."""
@@ -104,23 +104,50 @@ def notify(publisher_id, event_type, priority, payload):
      'payload': {'instance_id': 12, ... }}
 
     """
-    if priority not in log_levels:
-        raise BadPriorityException(
-                 _('%s not in valid priorities' % priority))
-
-    # Ensure everything is JSON serializable.
-    payload = utils.to_primitive(payload, convert_instances=True)
-
+    msg = _message(publisher_id, event_type, priority, payload)
     driver = utils.import_object(FLAGS.notification_driver)
-    msg = dict(message_id=str(uuid.uuid4()),
-                   publisher_id=publisher_id,
-                   event_type=event_type,
-                   priority=priority,
-                   payload=payload,
-                   timestamp=str(utils.utcnow()))
     try:
         driver.notify(msg)
     except Exception, e:
+        payload = msg['payload']
         LOG.exception(_("Problem '%(e)s' attempting to "
                         "send to notification system. Payload=%(payload)s" %
                         locals()))
+
+
+def notify_batch(notifications):
+    """
+    Sends several notifications at once using the specified driver
+
+    notifications is a list of (publisher_id, event_type, priority,
+    payload) tuples, see notify(). Drivers which provide notify_batch()
+    get all the messages in one go, the others get them one at a time.
+    """
+    msgs = [_message(*notification) for notification in notifications]
+    driver = utils.import_object(FLAGS.notification_driver)
+    try:
+        if hasattr(driver, 'notify_batch'):
+            driver.notify_batch(msgs)
+        else:
+            for msg in msgs:
+                driver.notify(msg)
+    except Exception, e:
+        count = len(msgs)
+        LOG.exception(_("Problem '%(e)s' attempting to send %(count)d "
+                        "notifications to notification system." % locals()))
+
+
+def _message(publisher_id, event_type, priority, payload):
+    if priority not in log_levels:
+        raise BadPriorityException(
+                 _('%s not in valid priorities' % priority))
+
+    # Ensure everything is JSON serializable.
+    payload = utils.to_primitive(payload, convert_instances=True)
+
+    return dict(message_id=str(uuid.uuid4()),
+                publisher_id=publisher_id,
+                event_type=event_type,
+                priority=priority,
+                payload=payload,
+                timestamp=str(utils.utcnow()))
@@ -18,7 +18,8 @@
 
 
 from nova.utils import import_object
-from nova.rpc.common import RemoteError, LOG
+from nova.rpc.common import RemoteError, Timeout, LOG
+from nova import context as nova_context
 from nova import flags
 
 FLAGS = flags.FLAGS
@@ -41,17 +42,23 @@ def create_connection(new=True):
     return get_impl().create_connection(new=new)
 
 
+# NOTE: the receiver of a message may change rows cached on the context,
+#       so they are forgotten whenever one is sent.
 def call(context, topic, msg):
+    nova_context.invalidate_cache(context)
     return get_impl().call(context, topic, msg)
 
 
 def cast(context, topic, msg):
+    nova_context.invalidate_cache(context)
     return get_impl().cast(context, topic, msg)
 
 
 def fanout_cast(context, topic, msg):
+    nova_context.invalidate_cache(context)
     return get_impl().fanout_cast(context, topic, msg)
 
 
 def multicall(context, topic, msg):
+    nova_context.invalidate_cache(context)
     return get_impl().multicall(context, topic, msg)
@@ -1,13 +1,66 @@
+import bisect
+import time
+import uuid
+import zlib
+
+from eventlet import greenpool
+from eventlet import queue
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova import utils
 
+FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.rpc')
 
 flags.DEFINE_integer('rpc_thread_pool_size', 1024,
                              'Size of RPC thread pool')
+flags.DEFINE_list('rpc_lanes', ['priority:64'],
+                  'Lanes rpc requests are handled in besides the default '
+                  'one, as <lane>:<greenthreads>; the default lane has '
+                  'rpc_thread_pool_size greenthreads')
+flags.DEFINE_list('rpc_lane_methods',
+                  ['get_console_output:priority',
+                   'get_ajax_console:priority',
+                   'get_vnc_console:priority',
+                   'refresh_security_group_rules:priority',
+                   'refresh_security_group_members:priority',
+                   'refresh_provider_fw_rules:priority',
+                   'terminate_instance:priority',
+                   'get_rpc_stats:priority',
+                   'get_rpc_lanes:priority'],
+                  'Methods handled outside the default lane, as '
+                  '<method>:<lane>')
+flags.DEFINE_integer('rpc_lane_queue_size', 128,
+                     'Requests that may wait for a greenthread in each '
+                     'lane before the consumer stops taking messages')
+flags.DEFINE_integer('rpc_prefetch_count', 0,
+                     'Unacknowledged messages the broker may send each '
+                     'consumer; 0 is unlimited')
 flags.DEFINE_integer('rpc_conn_pool_size', 30,
                              'Size of RPC connection pool')
+flags.DEFINE_boolean('rpc_shared_reply_queue', False,
+                     'Receive the replies to rpc calls on one long-lived '
+                     'queue per process instead of declaring a queue for '
+                     'every call.  All services must understand _reply_q '
+                     'before this is turned on.')
+flags.DEFINE_integer('rpc_response_timeout', 60,
+                     'Seconds an rpc call may take before the caller gives '
+                     'up and the callee drops it; 0 waits forever')
+flags.DEFINE_string('rpc_serializer', 'json',
+                    'Serializer for rpc requests, json or msgpack.  All '
+                    'services must be able to decode it before it is '
+                    'changed; replies follow what the caller accepts.')
+flags.DEFINE_integer('rpc_compression_threshold', 0,
+                     'Compress rpc messages of at least this many bytes '
+                     'with zlib; 0 disables compression.  All services '
+                     'must be able to decode it before it is turned on.')
 
 
 class RemoteError(exception.Error):
@@ -27,3 +80,397 @@ class RemoteError(exception.Error):
         super(RemoteError, self).__init__('%s %s\n%s' % (exc_type,
                                                          value,
                                                          traceback))
+
+
+class Timeout(exception.Error):
+    """Signifies that no reply to an rpc call arrived in time."""
+    pass
+
+
+class ReplyWaiter(object):
+    """Iterates over the replies to one call sent to the shared reply queue.
+
+    Behaves like the MulticallWaiter of each implementation, and raises
+    Timeout once the deadline of the call has passed.
+    """
+
+    def __init__(self, dispatcher, msg_id, deadline=None):
+        self._dispatcher = dispatcher
+        self._msg_id = msg_id
+        self._deadline = deadline
+        self._queue = queue.LightQueue()
+        self._done = False
+
+    def put(self, data):
+        self._queue.put(data)
+
+    def done(self):
+        if self._done:
+            return
+        self._done = True
+        self._dispatcher.unregister(self._msg_id)
+
+    def __iter__(self):
+        if self._done:
+            raise StopIteration
+        while True:
+            timeout = None
+            if self._deadline is not None:
+                timeout = max(self._deadline - time.time(), 0)
+            try:
+                data = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self.done()
+                raise Timeout(_('Timed out waiting for a reply to '
+                                'message %s') % self._msg_id)
+            if data['failure']:
+                self.done()
+                raise RemoteError(*data['failure'])
+            if data.get('ending', False):
+                self.done()
+                raise StopIteration
+            yield data['result']
+
+
+class ReplyDispatcher(object):
+    """Routes the replies arriving on a process's reply queue to waiters.
+
+    Each call registers a ReplyWaiter under its msg_id before the request
+    is sent.  Replies carry the msg_id they answer in '_correlation_id'.
+    Implementations consume reply_q and pass every reply to dispatch().
+    """
+
+    def __init__(self):
+        self.reply_q = 'reply_%s' % uuid.uuid4().hex
+        self._waiters = {}
+
+    def waiter(self, msg_id, deadline=None):
+        waiter = ReplyWaiter(self, msg_id, deadline)
+        self._waiters[msg_id] = waiter
+        return waiter
+
+    def unregister(self, msg_id):
+        self._waiters.pop(msg_id, None)
+
+    def dispatch(self, data):
+        msg_id = data.pop('_correlation_id', None)
+        waiter = self._waiters.get(msg_id)
+        if waiter is None:
+            # NOTE: the caller gave up, most likely on a timeout.
+            LOG.warn(_('No caller is waiting for the reply to %s, '
+                       'dropping it'), msg_id)
+            return
+        waiter.put(data)
+
+
+def get_deadline(context):
+    """Return the absolute deadline, in seconds since the epoch, for a call
+    made in this context.
+
+    A call made while handling another call may not outlive its caller, so
+    the deadline of the call being handled is inherited when it is sooner.
+    """
+    deadline = None
+    if FLAGS.rpc_response_timeout:
+        deadline = time.time() + FLAGS.rpc_response_timeout
+    parent_deadline = getattr(context, 'deadline', None)
+    if parent_deadline is not None and \
+       (deadline is None or parent_deadline < deadline):
+        deadline = parent_deadline
+    return deadline
+
+
+class Histogram(object):
+    """Counts durations in buckets bounded by BUCKETS milliseconds."""
+
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+               30000, 60000)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, seconds):
+        ms = max(seconds, 0) * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.counts[bisect.bisect_left(self.BUCKETS, ms)] += 1
+
+    def to_dict(self):
+        """Counts per bucket, keyed by upper bound; None is unbounded."""
+        bounds = list(self.BUCKETS) + [None]
+        return {'count': self.count,
+                'total_ms': self.total,
+                'max_ms': self.max,
+                'buckets': [(bound, count)
+                            for bound, count in zip(bounds, self.counts)
+                            if count]}
+
+
+class RpcStats(object):
+    """Latency histograms of the rpc traffic seen by this process.
+
+    Kinds are 'call' (caller side, until the last reply), 'queue_wait'
+    (callee side, from sending until handling starts) and 'handle' (callee
+    side, running the method).  Calls dropped for a missed deadline are
+    counted per topic and method as well.
+    """
+
+    def __init__(self):
+        self.histograms = {}  # { (kind, topic, method) : Histogram }
+        self.expired = {}     # { (topic, method) : count }
+
+    def record(self, kind, topic, method, seconds):
+        key = (kind, topic, method)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.record(seconds)
+
+    def record_expired(self, topic, method):
+        key = (topic, method)
+        self.expired[key] = self.expired.get(key, 0) + 1
+
+    def reset(self):
+        self.histograms = {}
+        self.expired = {}
+
+    def to_dict(self):
+        stats = {}
+        for (kind, topic, method), histogram in self.histograms.iteritems():
+            stats.setdefault('%s.%s' % (topic, method), {})[kind] = \
+                    histogram.to_dict()
+        for (topic, method), count in self.expired.iteritems():
+            stats.setdefault('%s.%s' % (topic, method), {})['expired'] = \
+                    count
+        return stats
+
+
+STATS = RpcStats()
+
+
+def record_received(ctxt, topic, method):
+    """Record how long a request waited before being handled.
+
+    Returns False if the caller's deadline has already passed, in which
+    case the request should be dropped.
+    """
+    now = time.time()
+    sent_at = getattr(ctxt, 'sent_at', None)
+    if sent_at is not None:
+        STATS.record('queue_wait', topic, method, now - sent_at)
+    deadline = getattr(ctxt, 'deadline', None)
+    if deadline is not None and now > deadline:
+        STATS.record_expired(topic, method)
+        late = now - deadline
+        LOG.warn(_('Dropping %(method)s on %(topic)s, its deadline passed '
+                   '%(late).3f seconds ago') % locals())
+        return False
+    return True
+
+
+class Serializer(object):
+    """Encodes rpc messages for the wire.
+
+    Receivers pick the decoder by content_type, so each serializer needs a
+    distinct one.  COMPRESSED_SUFFIX is appended to it for messages that
+    were compressed after serialization.
+    """
+
+    name = None
+    content_type = None
+    content_encoding = 'binary'
+
+    def dumps(self, data):
+        raise NotImplementedError()
+
+    def loads(self, body):
+        raise NotImplementedError()
+
+
+class JsonSerializer(Serializer):
+    name = 'json'
+    content_type = 'application/json'
+    content_encoding = 'utf-8'
+
+    def dumps(self, data):
+        return utils.dumps(data)
+
+    def loads(self, body):
+        return utils.loads(body)
+
+
+class MsgpackSerializer(Serializer):
+    """Binary serializer, available when msgpack is installed.
+
+    Strings are decoded to unicode and arrays to lists, as they are from
+    json.
+    """
+
+    name = 'msgpack'
+    content_type = 'application/x-msgpack'
+
+    def dumps(self, data):
+        return msgpack.packb(data, default=utils.to_primitive)
+
+    def loads(self, body):
+        return msgpack.unpackb(body, encoding='utf-8', use_list=True)
+
+
+COMPRESSED_SUFFIX = '+zlib'
+SERIALIZERS = {}  # { name : Serializer }
+
+
+def register_serializer(serializer):
+    SERIALIZERS[serializer.name] = serializer
+
+
+register_serializer(JsonSerializer())
+if msgpack is not None:
+    register_serializer(MsgpackSerializer())
+
+
+def get_serializer(name):
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise exception.Error(_('Unknown rpc serializer %s') % name)
+
+
+def accepted_content_types():
+    """Content types this process can decode, sent as _accept on calls."""
+    content_types = []
+    for serializer in SERIALIZERS.values():
+        content_types.append(serializer.content_type)
+        content_types.append(serializer.content_type + COMPRESSED_SUFFIX)
+    return content_types
+
+
+def serialize(data, accept=None):
+    """Encode data for the wire.
+
+    Requests are encoded with rpc_serializer.  Replies pass the content
+    types their caller accepts, and fall back to uncompressed json for
+    callers that did not say, so they are never sent in a form the caller
+    cannot decode.
+
+    :returns: (body, content_type, content_encoding)
+    """
+    serializer = get_serializer(FLAGS.rpc_serializer)
+    threshold = FLAGS.rpc_compression_threshold
+    if accept is not None:
+        if serializer.content_type not in accept:
+            serializer = SERIALIZERS['json']
+        if serializer.content_type + COMPRESSED_SUFFIX not in accept:
+            threshold = 0
+    body = serializer.dumps(data)
+    if threshold and len(body) >= threshold:
+        return (zlib.compress(body),
+                serializer.content_type + COMPRESSED_SUFFIX, 'binary')
+    return body, serializer.content_type, serializer.content_encoding
+
+
+def register_decoders(registry):
+    """Teach a kombu or carrot serialization registry every content type
+    this process accepts."""
+    def _compressed(serializer):
+        return lambda body: serializer.loads(zlib.decompress(body))
+
+    for serializer in SERIALIZERS.values():
+        registry.register(serializer.content_type, None, serializer.loads,
+                          serializer.content_type,
+                          serializer.content_encoding)
+        compressed_type = serializer.content_type + COMPRESSED_SUFFIX
+        registry.register(compressed_type, None, _compressed(serializer),
+                          compressed_type, 'binary')
+
+
+class Lane(object):
+    """A bounded pool of greenthreads handling the rpc methods routed to it.
+
+    Requests arriving while every greenthread is busy wait in a queue of
+    at most rpc_lane_queue_size.  Once that is full, spawn() turns requests
+    down rather than blocking the consumer, which is shared with the other
+    lanes; the consumer puts them back on the broker.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.pool = greenpool.GreenPool(size)
+        self.queue = queue.LightQueue(FLAGS.rpc_lane_queue_size or None)
+        self.max_waiting = 0
+        self.rejected = 0
+
+    def spawn(self, func, *args):
+        """Run func(*args) in the lane, or queue it until a greenthread is
+        free.  Returns False if the queue is full and func was not taken.
+        """
+        if self.pool.free() and not self.queue.qsize():
+            self.pool.spawn_n(self._run, func, args)
+            return True
+        try:
+            self.queue.put_nowait((func, args))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.max_waiting = max(self.max_waiting, self.queue.qsize())
+        return True
+
+    def _run(self, func, args):
+        """Handle a request, then those queued behind it."""
+        while True:
+            try:
+                func(*args)
+            except Exception:
+                LOG.exception(_('Unhandled error in rpc lane %s'),
+                              self.name)
+            try:
+                func, args = self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def to_dict(self):
+        return {'size': self.size,
+                'running': self.size - self.pool.free(),
+                'waiting': self.queue.qsize(),
+                'max_waiting': self.max_waiting,
+                'rejected': self.rejected}
+
+
+LANES = {}  # { name : Lane }
+_LANE_METHODS = {}  # { method : lane name }
+
+
+def _setup_lanes():
+    LANES['default'] = Lane('default', FLAGS.rpc_thread_pool_size)
+    for lane in FLAGS.rpc_lanes:
+        name, size = lane.split(':')
+        LANES[name] = Lane(name, int(size))
+    for method_lane in FLAGS.rpc_lane_methods:
+        method, name = method_lane.split(':')
+        if name not in LANES:
+            raise exception.Error(_('rpc lane %(name)s of %(method)s is '
+                                    'not in rpc_lanes') % locals())
+        _LANE_METHODS[method] = name
+
+
+def get_lane(method):
+    """Return the lane requests for method are handled in."""
+    if not LANES:
+        _setup_lanes()
+    return LANES[_LANE_METHODS.get(method, 'default')]
+
+
+def reset_lanes():
+    """Forget the lanes, so they are set up again from the flags."""
+    LANES.clear()
+    _LANE_METHODS.clear()
+
+
+def lane_stats():
+    """Greenthreads in use and requests waiting in each lane."""
+    return dict((name, lane.to_dict()) for name, lane in LANES.iteritems())
@@ -33,8 +33,8 @@ import uuid
 
 from carrot import connection as carrot_connection
 from carrot import messaging
+from carrot import serialization
 import eventlet
-from eventlet import greenpool
 from eventlet import pools
 from eventlet import queue
 import greenlet
@@ -43,6 +43,7 @@ from nova import context
 from nova import exception
 from nova import fakerabbit
 from nova import flags
+from nova.rpc import common as rpc_common
 from nova.rpc.common import RemoteError, LOG
 
 # Needed for tests
@@ -50,6 +51,8 @@ eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
 
+rpc_common.register_decoders(serialization.registry)
+
 
 class Connection(carrot_connection.BrokerConnection):
     """Connection instance object."""
@@ -234,7 +237,7 @@ class AdapterConsumer(Consumer):
     def __init__(self, connection=None, topic='broadcast', proxy=None):
         LOG.debug(_('Initing the Adapter Consumer for %s') % topic)
         self.proxy = proxy
-        self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
+        self.topic = topic
         super(AdapterConsumer, self).__init__(connection=connection,
                                               topic=topic)
         self.register_callback(self.process_data)
@@ -259,8 +262,8 @@ class AdapterConsumer(Consumer):
 
         method = message_data.get('method')
         args = message_data.get('args', {})
-        message.ack()
         if not method:
+            message.ack()
             # NOTE(vish): we may not want to ack here, but that means that bad
             #             messages stay in the queue indefinitely, so for now
             #             we just log the message and send an error string
@@ -269,7 +272,12 @@ class AdapterConsumer(Consumer):
             ctxt.reply(msg_id,
                     _('No method for message: %s') % message_data)
             return
-        self.pool.spawn_n(self._process_data, ctxt, method, args)
+        # A full lane leaves the message to be delivered again
+        if rpc_common.get_lane(method).spawn(self._process_data, ctxt,
+                                             method, args):
+            message.ack()
+        else:
+            message.requeue()
 
     @exception.wrap_exception()
 
@@ -277,7 +285,9 @@ class AdapterConsumer(Consumer):
         """Thread that magically looks for a method on the proxy
         object and calls it.
         """
-
+        if not rpc_common.record_received(ctxt, self.topic, method):
+            return
+        start = time.time()
         node_func = getattr(self.proxy, str(method))
         node_args = dict((str(k), v) for k, v in args.iteritems())
         # NOTE(vish): magic is fun!
@@ -295,6 +305,9 @@ class AdapterConsumer(Consumer):
         except Exception as e:
             LOG.exception('Exception during message handling')
             ctxt.reply(None, sys.exc_info())
+        finally:
+            rpc_common.STATS.record('handle', self.topic, method,
+                                    time.time() - start)
         return
 
 
@@ -384,7 +397,14 @@ class ConsumerSet(object):
 
 class Publisher(messaging.Publisher):
     """Publisher base class."""
-    pass
+
+    def send(self, message_data, accept=None, **kwargs):
+        """Send a message, encoded for a receiver accepting accept."""
+        body, content_type, content_encoding = rpc_common.serialize(
+                message_data, accept)
+        super(Publisher, self).send(body, content_type=content_type,
+                                    content_encoding=content_encoding,
+                                    **kwargs)
 
 
 class TopicPublisher(Publisher):
@@ -442,10 +462,13 @@ class DirectPublisher(Publisher):
         super(DirectPublisher, self).__init__(connection=connection)
 
 
-def msg_reply(msg_id, reply=None, failure=None, ending=False):
+def msg_reply(msg_id, reply=None, failure=None, ending=False, reply_q=None,
+              accept=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
-    Failure should be a sys.exc_info() tuple.
+    Failure should be a sys.exc_info() tuple.  If the caller named a shared
+    reply queue in reply_q, the reply is sent there and tagged with msg_id.
+    The reply is encoded in a content type the caller listed in accept.
 
     """
     if failure:
@@ -456,19 +479,24 @@ def msg_reply(msg_id, reply=None, failure=None, ending=False):
         failure = (failure[0].__name__, str(failure[1]), tb)
 
     with ConnectionPool.item() as conn:
-        publisher = DirectPublisher(connection=conn, msg_id=msg_id)
+        publisher = DirectPublisher(connection=conn,
+                                    msg_id=reply_q or msg_id)
         try:
             msg = {'result': reply, 'failure': failure}
             if ending:
                 msg['ending'] = True
-            publisher.send(msg)
+            if reply_q:
+                msg['_correlation_id'] = msg_id
+            publisher.send(msg, accept)
         except TypeError:
             msg = {'result': dict((k, repr(v))
                             for k, v in reply.__dict__.iteritems()),
                     'failure': failure}
             if ending:
                 msg['ending'] = True
-            publisher.send(msg)
+            if reply_q:
+                msg['_correlation_id'] = msg_id
+            publisher.send(msg, accept)
 
         publisher.close()
 
@@ -484,11 +512,15 @@ def _unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
+    context_dict['accept'] = msg.pop('_accept', None)
+    context_dict['deadline'] = msg.pop('_deadline', None)
+    context_dict['sent_at'] = msg.pop('_sent_at', None)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
 
-def _pack_context(msg, context):
+def _pack_context(msg, context, deadline=None):
     """Pack context into msg.
 
     Values for message keys need to be less than 255 chars, so we pull
@@ -496,36 +528,98 @@ def _pack_context(msg, context):
     more arguments in rabbit messages, we may want to do the same
     for args at some point.
 
+    The send time and the caller's deadline travel alongside the context,
+    as keys older callees ignore.
+
     """
     context_d = dict([('_context_%s' % key, value)
                       for (key, value) in context.to_dict().iteritems()])
     msg.update(context_d)
+    msg['_sent_at'] = time.time()
+    if deadline is not None:
+        msg['_deadline'] = deadline
 
 
 class RpcContext(context.RequestContext):
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
         self.msg_id = msg_id
+        self.reply_q = kwargs.pop('reply_q', None)
+        self.accept = kwargs.pop('accept', None)
+        self.deadline = kwargs.pop('deadline', None)
+        self.sent_at = kwargs.pop('sent_at', None)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, reply=None, failure=None, ending=False):
         if self.msg_id:
-            msg_reply(self.msg_id, reply, failure, ending)
+            msg_reply(self.msg_id, reply, failure, ending, self.reply_q,
+                      self.accept)
             if ending:
                 self.msg_id = None
 
 
+class ReplyDispatcher(rpc_common.ReplyDispatcher):
+    """Consumes this process's shared reply queue on its own connection."""
+
+    def __init__(self):
+        super(ReplyDispatcher, self).__init__()
+        self.connection = Connection.instance(new=True)
+        consumer = DirectConsumer(connection=self.connection,
+                                  msg_id=self.reply_q)
+        consumer.register_callback(self._process_data)
+        self.connection._rpc_consumers.append(consumer)
+        self.connection.consume_in_thread()
+
+    def _process_data(self, message_data, message):
+        message.ack()
+        self.dispatch(message_data)
+
+    def close(self):
+        self.connection.close()
+
+
+_REPLY_DISPATCHER = None
+
+
+def _get_reply_dispatcher():
+    global _REPLY_DISPATCHER
+    if _REPLY_DISPATCHER is None:
+        _REPLY_DISPATCHER = ReplyDispatcher()
+    return _REPLY_DISPATCHER
+
+
+def cleanup():
+    """Close the shared reply queue connection, if there is one."""
+    global _REPLY_DISPATCHER
+    if _REPLY_DISPATCHER is not None:
+        _REPLY_DISPATCHER.close()
+        _REPLY_DISPATCHER = None
+
+
 def multicall(context, topic, msg):
     """Make a call that returns multiple times."""
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
     msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
+    msg.update({'_msg_id': msg_id,
+                '_accept': rpc_common.accepted_content_types()})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
-    _pack_context(msg, context)
+    deadline = rpc_common.get_deadline(context)
+    _pack_context(msg, context, deadline)
+
+    if FLAGS.rpc_shared_reply_queue:
+        dispatcher = _get_reply_dispatcher()
+        msg['_reply_q'] = dispatcher.reply_q
+        # NOTE: register before sending so an early reply isn't dropped.
+        wait_msg = dispatcher.waiter(msg_id, deadline)
+        with ConnectionPool.item() as conn:
+            publisher = TopicPublisher(connection=conn, topic=topic)
+            publisher.send(msg)
+            publisher.close()
+        return wait_msg
 
     con_conn = ConnectionPool.get()
     consumer = DirectConsumer(connection=con_conn, msg_id=msg_id)
-    wait_msg = MulticallWaiter(consumer)
+    wait_msg = MulticallWaiter(consumer, deadline)
     consumer.register_callback(wait_msg)
 
     publisher = TopicPublisher(connection=con_conn, topic=topic)
@@ -536,8 +630,9 @@ def multicall(context, topic, msg):
 
 
 class MulticallWaiter(object):
-    def __init__(self, consumer):
+    def __init__(self, consumer, deadline=None):
         self._consumer = consumer
+        self._deadline = deadline
         self._results = queue.Queue()
         self._closed = False
         self._got_ending = False
@@ -570,6 +665,11 @@ class MulticallWaiter(object):
                 self.close()
                 raise
             if rv is None:
+                if self._deadline is not None and \
+                   time.time() >= self._deadline:
+                    self.close()
+                    raise rpc_common.Timeout(
+                            _('Timed out waiting for a reply'))
                 time.sleep(0.01)
                 continue
             if self._got_ending:
@@ -589,9 +689,14 @@ def create_connection(new=True):
 
 def call(context, topic, msg):
     """Sends a message on a topic and wait for a response."""
-    rv = multicall(context, topic, msg)
-    # NOTE(vish): return the last result from the multicall
-    rv = list(rv)
+    method = msg.get('method')
+    start = time.time()
+    try:
+        rv = multicall(context, topic, msg)
+        # NOTE(vish): return the last result from the multicall
+        rv = list(rv)
+    finally:
+        rpc_common.STATS.record('call', topic, method, time.time() - start)
     if not rv:
         return
     return rv[-1]
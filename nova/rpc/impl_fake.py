@@ -141,6 +141,8 @@ def fanout_cast(context, topic, msg):
 
     for consumer in CONSUMERS.get(topic, []):
         try:
-            consumer.call(context, method, args)
+            # Consumer.call is a generator, the method only runs while
+            # it is iterated
+            list(consumer.call(context, method, args))
         except rpc_common.RemoteError:
             pass
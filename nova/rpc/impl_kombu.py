@@ -18,6 +18,8 @@ import kombu
 import kombu.entity
 import kombu.messaging
 import kombu.connection
+import kombu.serialization
+import collections
 import itertools
 import sys
 import time
@@ -26,19 +28,28 @@ import types
 import uuid
 
 import eventlet
-from eventlet import greenpool
 from eventlet import pools
+from eventlet import timeout as eventlet_timeout
 import greenlet
 
 from nova import context
 from nova import exception
 from nova import flags
+from nova.rpc import common as rpc_common
 from nova.rpc.common import RemoteError, LOG
 
 # Needed for tests
 eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('rpc_conn_idle_timeout', 600,
+                     'Seconds a pooled rpc connection may sit unused before '
+                     'it is closed; 0 keeps them forever')
+flags.DEFINE_integer('rpc_publisher_cache_size', 64,
+                     'Topic and fanout publishers kept per pooled rpc '
+                     'connection; 0 creates one for every message')
+
+rpc_common.register_decoders(kombu.serialization.registry)
 
 
 class ConsumerBase(object):
@@ -63,6 +74,8 @@ class ConsumerBase(object):
     def reconnect(self, channel):
         """Re-declare the queue after a rabbit reconnect"""
         self.channel = channel
+        if FLAGS.rpc_prefetch_count:
+            channel.basic_qos(0, FLAGS.rpc_prefetch_count, False)
         self.kwargs['channel'] = channel
         self.queue = kombu.entity.Queue(**self.kwargs)
         self.queue.declare()
@@ -80,7 +93,7 @@ class ConsumerBase(object):
         a message is read.
 
         Messages will automatically be acked if the callback doesn't
-        raise an exception
+        raise an exception, or put back on the queue if it returns False
         """
 
         options = {'consumer_tag': self.tag}
@@ -91,8 +104,10 @@ class ConsumerBase(object):
 
         def _callback(raw_message):
             message = self.channel.message_to_python(raw_message)
-            callback(message.payload)
-            message.ack()
+            if callback(message.payload) is False:
+                message.requeue()
+            else:
+                message.ack()
 
         self.queue.consume(*args, callback=_callback, **options)
 
@@ -213,6 +228,9 @@ class FanoutConsumer(ConsumerBase):
 class Publisher(object):
     """Base Publisher class"""
 
+    # Whether a Connection may keep the publisher for later messages
+    cacheable = True
+
     def __init__(self, channel, exchange_name, routing_key, **kwargs):
         """Init the Publisher class with the exchange_name, routing_key,
         and other options
@@ -229,13 +247,20 @@ class Publisher(object):
         self.producer = kombu.messaging.Producer(exchange=self.exchange,
                 channel=channel, routing_key=self.routing_key)
 
-    def send(self, msg):
-        """Send a message"""
-        self.producer.publish(msg)
+    def send(self, msg, accept=None):
+        """Send a message, encoded for a receiver accepting accept"""
+        body, content_type, content_encoding = rpc_common.serialize(msg,
+                                                                    accept)
+        self.producer.publish(body, content_type=content_type,
+                              content_encoding=content_encoding)
 
 
 class DirectPublisher(Publisher):
     """Publisher class for 'direct'"""
+
+    # msg_ids are rarely sent to twice
+    cacheable = False
+
     def __init__(self, channel, msg_id, **kwargs):
         """init a 'direct' publisher.
 
@@ -294,7 +319,10 @@ class Connection(object):
 
     def __init__(self):
         self.consumers = []
+        # { (<publisher class>, <topic>) : Publisher }, least recent first
+        self.publishers = collections.OrderedDict()
         self.consumer_thread = None
+        self.last_used = time.time()
         self.max_retries = FLAGS.rabbit_max_retries
         # Try forever?
         if self.max_retries <= 0:
@@ -354,6 +382,8 @@ class Connection(object):
             self.channel._new_queue('ae.undeliver')
         for consumer in self.consumers:
             consumer.reconnect(self.channel)
+        for publisher in self.publishers.itervalues():
+            publisher.reconnect(self.channel)
         if self.consumers:
             LOG.debug(_("Re-established AMQP queues"))
 
@@ -376,9 +406,20 @@ class Connection(object):
         self.connection.release()
         self.connection = None
 
+    def is_healthy(self):
+        """Whether the connection can be handed out again"""
+        return self.connection is not None
+
     def reset(self):
-        """Reset a connection so it can be used again"""
+        """Reset a connection so it can be used again.
+
+        The channel, and the publishers kept on it, are only replaced when
+        consumers were declared on it.
+        """
         self.cancel_consumer_thread()
+        if not self.consumers:
+            return
+        self.publishers.clear()
         self.channel.close()
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
@@ -424,13 +465,29 @@ class Connection(object):
                 pass
             self.consumer_thread = None
 
-    def publisher_send(self, cls, topic, msg):
+    def get_publisher(self, cls, topic):
+        """Return a publisher of the class for topic, reusing the one kept
+        from an earlier message when there is one.
+
+        The class and topic determine the exchange and routing key.
+        """
+        key = (cls, topic)
+        publisher = self.publishers.pop(key, None)
+        if publisher is None:
+            publisher = cls(self.channel, topic)
+        if cls.cacheable and FLAGS.rpc_publisher_cache_size > 0:
+            self.publishers[key] = publisher
+            while len(self.publishers) > FLAGS.rpc_publisher_cache_size:
+                self.publishers.popitem(last=False)
+        return publisher
+
+    def publisher_send(self, cls, topic, msg, accept=None):
         """Send to a publisher based on the publisher class"""
         while True:
             publisher = None
             try:
-                publisher = cls(self.channel, topic)
-                publisher.send(msg)
+                publisher = self.get_publisher(cls, topic)
+                publisher.send(msg, accept)
                 return
             except self.connection.connection_errors, e:
                 LOG.exception(_('Failed to publish message %s' % str(e)))
@@ -456,9 +513,9 @@ class Connection(object):
         """Create a 'fanout' consumer"""
         self.declare_consumer(FanoutConsumer, topic, callback)
 
-    def direct_send(self, msg_id, msg):
+    def direct_send(self, msg_id, msg, accept=None):
         """Send a 'direct' message"""
-        self.publisher_send(DirectPublisher, msg_id, msg)
+        self.publisher_send(DirectPublisher, msg_id, msg, accept)
 
     def topic_send(self, topic, msg):
         """Send a 'topic' message"""
@@ -491,22 +548,59 @@ class Connection(object):
     def create_consumer(self, topic, proxy, fanout=False):
         """Create a consumer that calls a method in a proxy object"""
         if fanout:
-            self.declare_fanout_consumer(topic, ProxyCallback(proxy))
+            self.declare_fanout_consumer(topic, ProxyCallback(proxy, topic))
         else:
-            self.declare_topic_consumer(topic, ProxyCallback(proxy))
+            self.declare_topic_consumer(topic, ProxyCallback(proxy, topic))
 
 
 class Pool(pools.Pool):
-    """Class that implements a Pool of Connections."""
+    """Class that implements a Pool of Connections.
+
+    Connections that were closed are dropped instead of handed out, and
+    those unused for rpc_conn_idle_timeout seconds are closed.
+    """
 
-    # TODO(comstud): Timeout connections not used in a while
     def create(self):
         LOG.debug('Pool creating new connection')
         return Connection()
 
+    def get(self):
+        self.reap_idle()
+        while self.free_items:
+            conn = self.free_items.popleft()
+            if conn.is_healthy():
+                return conn
+            LOG.debug(_('Pool dropping closed connection'))
+            self._discard(conn)
+        return super(Pool, self).get()
+
+    def put(self, conn):
+        conn.last_used = time.time()
+        super(Pool, self).put(conn)
+
+    def reap_idle(self):
+        """Close the connections unused for rpc_conn_idle_timeout seconds.
+
+        The pool is ordered as a stack, so they are at the far end.
+        """
+        if FLAGS.rpc_conn_idle_timeout <= 0:
+            return
+        cutoff = time.time() - FLAGS.rpc_conn_idle_timeout
+        while self.free_items and self.free_items[-1].last_used < cutoff:
+            LOG.debug(_('Pool closing idle connection'))
+            self._discard(self.free_items.pop())
+
+    def _discard(self, conn):
+        self.current_size -= 1
+        try:
+            conn.close()
+        except Exception:
+            # NOTE: the kombu 'memory' transport can fail an assert here
+            pass
+
 # Create a ConnectionPool to use for RPC calls.  We'll order the
-# pool as a stack (LIFO), so that we can potentially loop through and
-# timeout old unused connections at some point
+# pool as a stack (LIFO), so that the connections idle the longest
+# gather at the end and can be timed out
 ConnectionPool = Pool(
         max_size=FLAGS.rpc_conn_pool_size,
         order_as_stack=True)
@@ -580,9 +674,9 @@ class ConnectionContext(object):
 class ProxyCallback(object):
     """Calls methods on a proxy object based on method and args."""
 
-    def __init__(self, proxy):
+    def __init__(self, proxy, topic=None):
         self.proxy = proxy
-        self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
+        self.topic = topic
 
     def __call__(self, message_data):
         """Consumer callback to call a method on a proxy object.
@@ -605,14 +699,18 @@ class ProxyCallback(object):
             LOG.warn(_('no method for message: %s') % message_data)
             ctxt.reply(_('No method for message: %s') % message_data)
             return
-        self.pool.spawn_n(self._process_data, ctxt, method, args)
+        # A full lane leaves the message to be delivered again
+        return rpc_common.get_lane(method).spawn(self._process_data, ctxt,
+                                                 method, args)
 
     @exception.wrap_exception()
     def _process_data(self, ctxt, method, args):
         """Thread that maigcally looks for a method on the proxy
         object and calls it.
         """
-
+        if not rpc_common.record_received(ctxt, self.topic, method):
+            return
+        start = time.time()
         node_func = getattr(self.proxy, str(method))
         node_args = dict((str(k), v) for k, v in args.iteritems())
         # NOTE(vish): magic is fun!
@@ -629,6 +727,9 @@ class ProxyCallback(object):
         except Exception as e:
             LOG.exception('Exception during message handling')
             ctxt.reply(None, sys.exc_info())
+        finally:
+            rpc_common.STATS.record('handle', self.topic, method,
+                                    time.time() - start)
         return
 
 
@@ -643,11 +744,15 @@ def _unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
+    context_dict['accept'] = msg.pop('_accept', None)
+    context_dict['deadline'] = msg.pop('_deadline', None)
+    context_dict['sent_at'] = msg.pop('_sent_at', None)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
 
-def _pack_context(msg, context):
+def _pack_context(msg, context, deadline=None):
     """Pack context into msg.
 
     Values for message keys need to be less than 255 chars, so we pull
@@ -655,10 +760,16 @@ def _pack_context(msg, context):
     more arguments in rabbit messages, we may want to do the same
     for args at some point.
 
+    The send time and the caller's deadline travel alongside the context,
+    as keys older callees ignore.
+
     """
     context_d = dict([('_context_%s' % key, value)
                       for (key, value) in context.to_dict().iteritems()])
     msg.update(context_d)
+    msg['_sent_at'] = time.time()
+    if deadline is not None:
+        msg['_deadline'] = deadline
 
 
 class RpcContext(context.RequestContext):
@@ -666,18 +777,24 @@ class RpcContext(context.RequestContext):
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
         self.msg_id = msg_id
+        self.reply_q = kwargs.pop('reply_q', None)
+        self.accept = kwargs.pop('accept', None)
+        self.deadline = kwargs.pop('deadline', None)
+        self.sent_at = kwargs.pop('sent_at', None)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, reply=None, failure=None, ending=False):
         if self.msg_id:
-            msg_reply(self.msg_id, reply, failure, ending)
+            msg_reply(self.msg_id, reply, failure, ending, self.reply_q,
+                      self.accept)
             if ending:
                 self.msg_id = None
 
 
 class MulticallWaiter(object):
-    def __init__(self, connection):
+    def __init__(self, connection, deadline=None):
         self._connection = connection
+        self._deadline = deadline
         self._iterator = connection.iterconsume()
         self._result = None
         self._done = False
@@ -698,12 +815,24 @@ class MulticallWaiter(object):
         else:
             self._result = data['result']
 
+    def _next(self):
+        if self._deadline is None:
+            self._iterator.next()
+            return
+        remaining = max(self._deadline - time.time(), 0)
+        try:
+            with eventlet_timeout.Timeout(remaining):
+                self._iterator.next()
+        except eventlet_timeout.Timeout:
+            self.done()
+            raise rpc_common.Timeout(_('Timed out waiting for a reply'))
+
     def __iter__(self):
         """Return a result until we get a 'None' response from consumer"""
         if self._done:
             raise StopIteration
         while True:
-            self._iterator.next()
+            self._next()
             if self._got_ending:
                 self.done()
                 raise StopIteration
@@ -714,6 +843,37 @@ class MulticallWaiter(object):
             yield result
 
 
+class ReplyDispatcher(rpc_common.ReplyDispatcher):
+    """Consumes this process's shared reply queue on its own connection."""
+
+    def __init__(self):
+        super(ReplyDispatcher, self).__init__()
+        self.connection = Connection()
+        self.connection.declare_direct_consumer(self.reply_q, self.dispatch)
+        self.connection.consume_in_thread()
+
+    def close(self):
+        self.connection.close()
+
+
+_REPLY_DISPATCHER = None
+
+
+def _get_reply_dispatcher():
+    global _REPLY_DISPATCHER
+    if _REPLY_DISPATCHER is None:
+        _REPLY_DISPATCHER = ReplyDispatcher()
+    return _REPLY_DISPATCHER
+
+
+def cleanup():
+    """Close the shared reply queue connection, if there is one."""
+    global _REPLY_DISPATCHER
+    if _REPLY_DISPATCHER is not None:
+        _REPLY_DISPATCHER.close()
+        _REPLY_DISPATCHER = None
+
+
 def create_connection(new=True):
     """Create a connection"""
     return ConnectionContext(pooled=not new)
@@ -727,12 +887,23 @@ def multicall(context, topic, msg):
     # the pool
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
     msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
+    msg.update({'_msg_id': msg_id,
+                '_accept': rpc_common.accepted_content_types()})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
-    _pack_context(msg, context)
+    deadline = rpc_common.get_deadline(context)
+    _pack_context(msg, context, deadline)
+
+    if FLAGS.rpc_shared_reply_queue:
+        dispatcher = _get_reply_dispatcher()
+        msg['_reply_q'] = dispatcher.reply_q
+        # NOTE: register before sending so an early reply isn't dropped.
+        wait_msg = dispatcher.waiter(msg_id, deadline)
+        with ConnectionContext() as conn:
+            conn.topic_send(topic, msg)
+        return wait_msg
 
     conn = ConnectionContext()
-    wait_msg = MulticallWaiter(conn)
+    wait_msg = MulticallWaiter(conn, deadline)
     conn.declare_direct_consumer(msg_id, wait_msg)
     conn.topic_send(topic, msg)
 
@@ -741,9 +912,14 @@ def multicall(context, topic, msg):
 
 def call(context, topic, msg):
     """Sends a message on a topic and wait for a response."""
-    rv = multicall(context, topic, msg)
-    # NOTE(vish): return the last result from the multicall
-    rv = list(rv)
+    method = msg.get('method')
+    start = time.time()
+    try:
+        rv = multicall(context, topic, msg)
+        # NOTE(vish): return the last result from the multicall
+        rv = list(rv)
+    finally:
+        rpc_common.STATS.record('call', topic, method, time.time() - start)
     if not rv:
         return
     return rv[-1]
@@ -765,10 +941,13 @@ def fanout_cast(context, topic, msg):
         conn.fanout_send(topic, msg)
 
 
-def msg_reply(msg_id, reply=None, failure=None, ending=False):
+def msg_reply(msg_id, reply=None, failure=None, ending=False, reply_q=None,
+              accept=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
-    Failure should be a sys.exc_info() tuple.
+    Failure should be a sys.exc_info() tuple.  If the caller named a shared
+    reply queue in reply_q, the reply is sent there and tagged with msg_id.
+    The reply is encoded in a content type the caller listed in accept.
 
     """
     with ConnectionContext() as conn:
@@ -787,4 +966,8 @@ def msg_reply(msg_id, reply=None, failure=None, ending=False):
                     'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_correlation_id'] = msg_id
+            conn.direct_send(reply_q, msg, accept)
+        else:
+            conn.direct_send(msg_id, msg, accept)
@@ -20,8 +20,10 @@ customize the behavior: filter_hosts() and weigh_hosts(). The default
 behavior is to simply select all hosts and weight them the same.
 """
 
+import copy
 import operator
 import json
+import time
 
 import M2Crypto
 
@@ -40,6 +42,9 @@ from nova.scheduler import api
 from nova.scheduler import driver
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('child_zone_select_cache_ttl', 5,
+                     'Seconds to reuse the build plans child zones '
+                     'returned for a request of the same shape')
 LOG = logging.getLogger('nova.scheduler.abstract_scheduler')
 
 
@@ -52,9 +57,58 @@ class AbstractScheduler(driver.Scheduler):
     """Base class for creating Schedulers that can work across any nova
     deployment, from simple designs to multiply-nested zones.
     """
+    def __init__(self):
+        super(AbstractScheduler, self).__init__()
+        # { <request shape> : (expires, zone ids, child results) }
+        self._child_select_cache = {}
+
     def _call_zone_method(self, context, method, specs, zones):
         """Call novaclient zone method. Broken out for testing."""
-        return api.call_zone_method(context, method, specs=specs, zones=zones)
+        timings = {}
+        results = api.call_zone_method(context, method, specs=specs,
+                                       zones=zones, timings=timings)
+        if self.zone_manager:
+            self.zone_manager.record_zone_latencies(timings)
+        return results
+
+    @staticmethod
+    def _request_shape(request_spec):
+        """The parts of a request_spec a child zone's select() depends on;
+        names, ids and blobs of the particular request are left out."""
+        instance_type = request_spec.get('instance_type') or {}
+        return json.dumps(dict(
+                instance_type=dict((key, instance_type.get(key))
+                                   for key in ('memory_mb', 'local_gb',
+                                               'vcpus', 'extra_specs')),
+                filter=request_spec.get('filter'),
+                num_instances=request_spec.get('num_instances', 1)),
+            sort_keys=True)
+
+    def _select_from_child_zones(self, context, request_spec, zones):
+        """Ask the child zones for build plans, reusing the answer to a
+        request of the same shape for child_zone_select_cache_ttl seconds.
+        Answers missing a zone that timed out are not reused, expired ones
+        are dropped whenever a new answer is cached.
+        """
+        zone_ids = sorted(zone['id'] for zone in zones)
+        key = self._request_shape(request_spec)
+        now = time.time()
+        cached = self._child_select_cache.get(key)
+        if cached and cached[0] > now and cached[1] == zone_ids:
+            return copy.deepcopy(cached[2])
+
+        json_spec = json.dumps(request_spec)
+        child_results = self._call_zone_method(context, "select",
+                specs=json_spec, zones=zones)
+        if FLAGS.child_zone_select_cache_ttl > 0 and \
+           None not in [result for zone_id, result in child_results]:
+            for old_key, old_value in self._child_select_cache.items():
+                if old_value[0] <= now:
+                    del self._child_select_cache[old_key]
+            expires = now + FLAGS.child_zone_select_cache_ttl
+            self._child_select_cache[key] = (expires, zone_ids,
+                                             copy.deepcopy(child_results))
+        return child_results
 
     def _provision_resource_locally(self, context, build_plan_item,
             request_spec, kwargs):
@@ -230,10 +284,8 @@ class AbstractScheduler(driver.Scheduler):
         if not build_plan:
             raise driver.NoValidHost(_('No hosts were available'))
 
-        for num in xrange(num_instances):
-            if not build_plan:
-                break
-            build_plan_item = build_plan.pop(0)
+        for build_plan_item in self._plan_instances(build_plan, request_spec,
+                                                    num_instances):
             self._provision_resource(context, build_plan_item, instance_id,
                     request_spec, kwargs)
 
@@ -241,6 +293,40 @@ class AbstractScheduler(driver.Scheduler):
         # we've already done it here)
         return None
 
+    def _plan_instances(self, build_plan, request_spec, num_instances):
+        """Assign num_instances to the weighed build plan in one pass.
+
+        Local hosts are visited in weight order, repeatedly, and the free
+        memory each placement needs is deducted locally so a host is not
+        handed more instances than it reported room for. Child zone
+        entries are used at most once, as before.
+        """
+        instance_type = request_spec.get('instance_type') or {}
+        requested_mem = instance_type.get('memory_mb', 0) * 1024 * 1024
+        free_mem = {}  # { <hostname> : bytes still free }
+        plan = []
+        candidates = build_plan
+        while candidates and len(plan) < num_instances:
+            reusable = []
+            for item in candidates:
+                if len(plan) >= num_instances:
+                    break
+                hostname = item.get('hostname')
+                if hostname is None:
+                    plan.append(item)
+                    continue
+                capabilities = item.get('capabilities') or {}
+                free = free_mem.get(hostname,
+                                    capabilities.get('host_memory_free'))
+                if free is not None:
+                    if free < requested_mem:
+                        continue
+                    free_mem[hostname] = free - requested_mem
+                plan.append(item)
+                reusable.append(item)
+            candidates = reusable
+        return plan
+
     def select(self, context, request_spec, *args, **kwargs):
         """Select returns a list of weights and zone/host information
         corresponding to the best hosts to service the request. Any
@@ -283,12 +369,14 @@ class AbstractScheduler(driver.Scheduler):
         #         capabilities=capabs}, ...]
         weighted_hosts = self.weigh_hosts(topic, request_spec, filtered_hosts)
         # Next, tack on the host weights from the child zones
-        json_spec = json.dumps(request_spec)
         all_zones = db.zone_get_all(context)
-        child_results = self._call_zone_method(context, "select",
-                specs=json_spec, zones=all_zones)
+        child_results = self._select_from_child_zones(context, request_spec,
+                                                      all_zones)
         self._adjust_child_weights(child_results, all_zones)
         for child_zone, result in child_results:
+            if not result:
+                # The child zone did not answer in time
+                continue
             for weighting in result:
                 # Remember the child_zone so we can get back to
                 # it later if needed. This implicitly builds a zone
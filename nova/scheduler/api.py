@@ -20,6 +20,8 @@
 Handles all requests relating to schedulers.
 """
 
+import time
+
 from novaclient import v1_1 as novaclient
 from novaclient import exceptions as novaclient_exceptions
 
@@ -31,11 +33,14 @@ from nova import rpc
 from nova import utils
 
 from eventlet import greenpool
+from eventlet import timeout as eventlet_timeout
 
 FLAGS = flags.FLAGS
 flags.DEFINE_bool('enable_zone_routing',
     False,
     'When True, routing to child zones will occur.')
+flags.DEFINE_integer('zone_call_timeout', 10,
+    'Seconds to wait for a child zone to answer before going on without it')
 
 LOG = logging.getLogger('nova.scheduler.api')
 
@@ -97,54 +102,91 @@ def select(context, specs=None):
             params={"request_spec": specs})
 
 
-def update_service_capabilities(context, service_name, host, capabilities):
+def update_service_capabilities(context, service_name, host, capabilities,
+                                sequence=None):
     """Send an update to all the scheduler services informing them
-       of the capabilities of this service."""
-    kwargs = dict(method='update_service_capabilities',
+       of the capabilities of this service.
+
+    A sequence number is only sent along when the service also sends
+    deltas, which older schedulers do not understand."""
+    args = dict(service_name=service_name, host=host,
+                capabilities=capabilities)
+    if sequence is not None:
+        args['sequence'] = sequence
+    kwargs = dict(method='update_service_capabilities', args=args)
+    return rpc.fanout_cast(context, 'scheduler', kwargs)
+
+
+def update_service_capabilities_delta(context, service_name, host, changed,
+                                      removed, sequence):
+    """Send the capabilities of this service that changed, or were
+       removed, since the update numbered sequence - 1."""
+    kwargs = dict(method='update_service_capabilities_delta',
                   args=dict(service_name=service_name, host=host,
-                            capabilities=capabilities))
+                            changed=changed, removed=removed,
+                            sequence=sequence))
     return rpc.fanout_cast(context, 'scheduler', kwargs)
 
 
 def call_zone_method(context, method_name, errors_to_ignore=None,
                      novaclient_collection_name='zones', zones=None,
-                     *args, **kwargs):
-    """Returns a list of (zone, call_result) objects."""
+                     timings=None, *args, **kwargs):
+    """Returns a list of (zone, call_result) objects.
+
+    Child zones are called concurrently. A zone that does not answer
+    within FLAGS.zone_call_timeout seconds gets a None result rather than
+    holding up the others. If a timings dict is passed, it is filled in
+    with the seconds each zone took, or None for those that timed out.
+    """
     if not isinstance(errors_to_ignore, (list, tuple)):
         # This will also handle the default None
         errors_to_ignore = [errors_to_ignore]
 
+    skipped = object()
+
+    def _call_zone(zone):
+        url = zone.api_url
+        start = time.time()
+        try:
+            with eventlet_timeout.Timeout(FLAGS.zone_call_timeout):
+                try:
+                    nova = novaclient.Client(zone.username, zone.password,
+                                             None, url)
+                    nova.authenticate()
+                except novaclient_exceptions.BadRequest, e:
+                    LOG.warn(_("Failed request to zone; URL=%(url)s: %(e)s")
+                            % locals())
+                    #TODO (dabo) - add logic for failure counts per zone,
+                    # with escalation after a given number of failures.
+                    return skipped
+                novaclient_collection = getattr(nova,
+                                                novaclient_collection_name)
+                collection_method = getattr(novaclient_collection,
+                                            method_name)
+                try:
+                    result = collection_method(*args, **kwargs)
+                except Exception as e:
+                    if type(e) not in errors_to_ignore:
+                        raise
+                    result = None
+        except eventlet_timeout.Timeout:
+            LOG.warn(_("Zone %(url)s did not answer %(method_name)s within "
+                       "%(timeout)d seconds") %
+                     dict(url=url, method_name=method_name,
+                          timeout=FLAGS.zone_call_timeout))
+            if timings is not None:
+                timings[zone.id] = None
+            return None
+        if timings is not None:
+            timings[zone.id] = time.time() - start
+        return result
+
     pool = greenpool.GreenPool()
-    results = []
     if zones is None:
         zones = db.zone_get_all(context)
-    for zone in zones:
-        try:
-            nova = novaclient.Client(zone.username, zone.password, None,
-                    zone.api_url)
-            nova.authenticate()
-        except novaclient_exceptions.BadRequest, e:
-            url = zone.api_url
-            LOG.warn(_("Failed request to zone; URL=%(url)s: %(e)s")
-                    % locals())
-            #TODO (dabo) - add logic for failure counts per zone,
-            # with escalation after a given number of failures.
-            continue
-        novaclient_collection = getattr(nova, novaclient_collection_name)
-        collection_method = getattr(novaclient_collection, method_name)
-
-        def _error_trap(*args, **kwargs):
-            try:
-                return collection_method(*args, **kwargs)
-            except Exception as e:
-                if type(e) in errors_to_ignore:
-                    return None
-                raise
-
-        res = pool.spawn(_error_trap, *args, **kwargs)
-        results.append((zone, res))
-    pool.waitall()
-    return [(zone.id, res.wait()) for zone, res in results]
+    results = [(zone, pool.spawn(_call_zone, zone)) for zone in zones]
+    results = [(zone.id, res.wait()) for zone, res in results]
+    return [(zone_id, res) for zone_id, res in results if res is not skipped]
 
 
 def child_zone_helper(zone_list, func):
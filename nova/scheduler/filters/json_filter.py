@@ -17,10 +17,16 @@
 import json
 import operator
 
+from nova import flags
 import nova.scheduler
 from nova.scheduler.filters import abstract_filter
 
 
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('json_filter_plan_cache_size', 128,
+                     'Number of compiled JsonFilter queries to keep')
+
+
 class JsonFilter(abstract_filter.AbstractHostFilter):
     """Host Filter to allow simple JSON-based grammar for
     selecting hosts.
@@ -96,51 +102,158 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
                 ['>=', '$compute.disk_available', required_disk]]
         return (self._full_name(), json.dumps(query))
 
-    def _parse_string(self, string, host, services):
+    def _compile_string(self, string):
         """Strings prefixed with $ are capability lookups in the
-        form '$service.capability[.subcap*]'.
+        form '$service.capability[.subcap*]'. Returns a function of the
+        host's services, or None if the string is dropped from the args.
         """
         if not string:
             return None
         if not string.startswith("$"):
-            return string
+            return lambda services: string
 
         path = string[1:].split(".")
-        for item in path:
-            services = services.get(item, None)
-            if not services:
-                return None
-        return services
-
-    def _process_filter(self, zone_manager, query, host, services):
-        """Recursively parse the query structure."""
+
+        def lookup(services):
+            for item in path:
+                services = services.get(item, None)
+                if not services:
+                    return None
+            return services
+        return lookup
+
+    def _compile(self, query):
+        """Turn the query structure into a tree of closures, each taking
+        the services of one host.
+        """
         if not query:
-            return True
-        cmd = query[0]
-        method = self.commands[cmd]
-        cooked_args = []
+            return lambda services: True
+        method = self.commands[query[0]]
+        getters = []
         for arg in query[1:]:
             if isinstance(arg, list):
-                arg = self._process_filter(zone_manager, arg, host, services)
+                getters.append(self._compile(arg))
             elif isinstance(arg, basestring):
-                arg = self._parse_string(arg, host, services)
-            if arg is not None:
-                cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+                getter = self._compile_string(arg)
+                if getter is not None:
+                    getters.append(getter)
+            elif arg is not None:
+                getters.append(lambda services, arg=arg: arg)
+
+        def evaluate(services):
+            cooked_args = []
+            for getter in getters:
+                arg = getter(services)
+                if arg is not None:
+                    cooked_args.append(arg)
+            return method(self, cooked_args)
+        return evaluate
+
+    _range_bounds = {
+        '=': (True, True, True, True),
+        '<': (False, False, True, False),
+        '<=': (False, False, True, True),
+        '>': (True, False, False, False),
+        '>=': (True, True, False, False),
+    }
+
+    def _index_lookups(self, query):
+        """Find the conjuncts of the query that are range predicates on a
+        top level capability, i.e. ['>=', '$service.cap', number]. Hosts
+        failing any of them can be skipped without evaluating the query.
+        """
+        if not query or not isinstance(query, list):
+            return []
+        if query[0] == 'and':
+            conjuncts = query[1:]
+        else:
+            conjuncts = [query]
+        lookups = []
+        for conjunct in conjuncts:
+            if not isinstance(conjunct, list) or len(conjunct) != 3:
+                continue
+            cmd, name, value = conjunct
+            if cmd not in self._range_bounds:
+                continue
+            if not isinstance(name, basestring) or not name.startswith("$"):
+                continue
+            if not isinstance(value, (int, long, float)) or \
+               isinstance(value, bool):
+                continue
+            path = name[1:].split(".")
+            if len(path) != 2:
+                continue
+            has_lower, lower_inc, has_upper, upper_inc = \
+                    self._range_bounds[cmd]
+            lookups.append(dict(service_name=path[0], cap=path[1],
+                                lower=value if has_lower else None,
+                                upper=value if has_upper else None,
+                                include_lower=lower_inc,
+                                include_upper=upper_inc))
+        return lookups
+
+    def _get_plan(self, query):
+        """Parse and compile a query once, remembering the result."""
+        key = (self.__class__, query)
+        plan = _plan_cache.get(key)
+        if plan is None:
+            expanded = json.loads(query)
+            plan = (self._compile(expanded), self._index_lookups(expanded))
+            _plan_cache.set(key, plan)
+        return plan
 
     def filter_hosts(self, zone_manager, query):
         """Return a list of hosts that can fulfill the requirements
         specified in the query.
         """
-        expanded = json.loads(query)
+        evaluate, lookups = self._get_plan(query)
+        service_states = zone_manager.service_states
+        index = getattr(zone_manager, 'capability_index', None)
+        if index is not None and lookups:
+            candidates = None
+            for lookup in lookups:
+                hosts = index.hosts_in_range(**lookup)
+                if candidates is None:
+                    candidates = hosts
+                else:
+                    candidates &= hosts
+            hosts = [(host, service_states[host]) for host in candidates
+                     if host in service_states]
+        else:
+            hosts = service_states.iteritems()
+
         filtered_hosts = []
-        for host, services in zone_manager.service_states.iteritems():
-            result = self._process_filter(zone_manager, expanded, host,
-                    services)
+        for host, services in hosts:
+            result = evaluate(services)
             if isinstance(result, list):
                 # If any succeeded, include the host
                 result = any(result)
             if result:
                 filtered_hosts.append((host, services))
         return filtered_hosts
+
+
+class _PlanCache(object):
+    """Least recently used cache of compiled queries."""
+
+    def __init__(self):
+        self._plans = {}  # { key : [plan, last_used] }
+        self._clock = 0
+
+    def get(self, key):
+        entry = self._plans.get(key)
+        if entry is None:
+            return None
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[0]
+
+    def set(self, key, plan):
+        self._clock += 1
+        self._plans[key] = [plan, self._clock]
+        if len(self._plans) > FLAGS.json_filter_plan_cache_size:
+            oldest = min(self._plans, key=lambda k: self._plans[k][1])
+            del self._plans[oldest]
+
+
+_plan_cache = _PlanCache()
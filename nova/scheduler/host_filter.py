@@ -42,17 +42,25 @@ from nova.scheduler import filters
 FLAGS = flags.FLAGS
 
 
+_FILTERS = None
+
+
 def _get_filters():
+    global _FILTERS
+    if _FILTERS is not None:
+        return _FILTERS
+
     # Imported here to avoid circular imports
     from nova.scheduler import filters
 
     def get_itm(nm):
         return getattr(filters, nm)
 
-    return [get_itm(itm) for itm in dir(filters)
-            if (type(get_itm(itm)) is types.TypeType)
-            and issubclass(get_itm(itm), filters.AbstractHostFilter)
-            and get_itm(itm) is not filters.AbstractHostFilter]
+    _FILTERS = [get_itm(itm) for itm in dir(filters)
+                if (type(get_itm(itm)) is types.TypeType)
+                and issubclass(get_itm(itm), filters.AbstractHostFilter)
+                and get_itm(itm) is not filters.AbstractHostFilter]
+    return _FILTERS
 
 
 def choose_host_filter(filter_name=None):
@@ -0,0 +1,160 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory view of compute host load used by the SimpleScheduler.
+
+Rather than aggregating SUM(instances.vcpus) over every compute service on
+each request, the scheduler keeps a min-heap of hosts keyed on claimed cores.
+Claims made by the scheduler are applied immediately, capability updates
+from the compute nodes refresh liveness and free memory, and the whole view
+is periodically reconciled against the database so drift from deletes or
+out-of-band changes cannot accumulate.
+"""
+
+import datetime
+import heapq
+
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import utils
+from nova.scheduler import driver
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('host_state_reconcile_interval', 10,
+                     'Seconds between reconciling the scheduler host state '
+                     'cache with the database; keep this below '
+                     'service_down_time')
+flags.DECLARE('max_cores', 'nova.scheduler.simple')
+
+LOG = logging.getLogger('nova.scheduler.host_state')
+
+
+class HostState(object):
+    """Claimed resources and liveness of a single compute host."""
+
+    def __init__(self, host):
+        self.host = host
+        self.vcpus_used = 0
+        self.service = None
+        self.memory_mb_free = None
+        self.last_capabilities = datetime.datetime.min
+
+    def is_up(self):
+        """Alive if either the service row or a recent capability update
+        says so."""
+        if self.service and driver.Scheduler.service_is_up(self.service):
+            return True
+        elapsed = utils.utcnow() - self.last_capabilities
+        return elapsed <= datetime.timedelta(seconds=FLAGS.service_down_time)
+
+    def has_memory(self, memory_mb):
+        """Unknown free memory never excludes a host."""
+        return self.memory_mb_free is None or \
+               self.memory_mb_free >= (memory_mb or 0)
+
+    def consume(self, vcpus, memory_mb):
+        self.vcpus_used += vcpus or 0
+        if self.memory_mb_free is not None:
+            self.memory_mb_free -= memory_mb or 0
+
+
+class HostStateCache(object):
+    """Min-heap of compute hosts ordered by claimed cores.
+
+    Heap entries are (vcpus_used, host) tuples.  Entries are never updated in
+    place; a claim pushes a fresh entry and entries whose core count no
+    longer matches the host state are discarded lazily when they surface.
+    """
+
+    def __init__(self):
+        self.host_states = {}  # { <host> : HostState }
+        self._heap = []
+        self.last_reconcile = datetime.datetime.min
+
+    def is_stale(self):
+        elapsed = utils.utcnow() - self.last_reconcile
+        return elapsed >= datetime.timedelta(
+                seconds=FLAGS.host_state_reconcile_interval)
+
+    def reconcile(self, context):
+        """Replace the cached core counts with the database view."""
+        host_states = {}
+        for service, instance_cores in db.service_get_all_compute_sorted(
+                context):
+            host = service['host']
+            state = self.host_states.get(host) or HostState(host)
+            state.service = service
+            state.vcpus_used = instance_cores
+            host_states[host] = state
+        self.host_states = host_states
+        self._rebuild_heap()
+        self.last_reconcile = utils.utcnow()
+
+    def _rebuild_heap(self):
+        self._heap = [(state.vcpus_used, host)
+                      for host, state in self.host_states.iteritems()]
+        heapq.heapify(self._heap)
+
+    def update_service_capabilities(self, host, capabilities):
+        """Refresh liveness and free memory from a compute node update."""
+        state = self.host_states.get(host)
+        if state is None:
+            # NOTE: unknown hosts are picked up by the next reconcile, which
+            #       also supplies their service row and claimed cores.
+            return
+        state.last_capabilities = utils.utcnow()
+        memory_free = capabilities.get('host_memory_free')
+        if memory_free is not None:
+            state.memory_mb_free = memory_free / (1024 * 1024)
+        elif 'memory_mb' in capabilities and \
+             'memory_mb_used' in capabilities:
+            state.memory_mb_free = capabilities['memory_mb'] - \
+                                   capabilities['memory_mb_used']
+
+    def select_host(self, context, vcpus, memory_mb=None):
+        """Claim resources on the least loaded live host and return it.
+
+        Returns None if no live host can take the request.
+        """
+        if self.is_stale():
+            self.reconcile(context)
+        vcpus = vcpus or 0
+        skipped = []
+        try:
+            while self._heap:
+                vcpus_used, host = self._heap[0]
+                state = self.host_states.get(host)
+                if state is None or state.vcpus_used != vcpus_used:
+                    heapq.heappop(self._heap)
+                    continue
+                if vcpus_used + vcpus > FLAGS.max_cores:
+                    raise driver.NoValidHost(_("All hosts have too many "
+                                               "cores"))
+                skipped.append(heapq.heappop(self._heap))
+                if not state.is_up() or not state.has_memory(memory_mb):
+                    continue
+                # NOTE: the claimed entry is replaced, not restored.
+                skipped.pop()
+                state.consume(vcpus, memory_mb)
+                heapq.heappush(self._heap, (state.vcpus_used, host))
+                return host
+            return None
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
@@ -24,6 +24,7 @@ is then selected for provisioning.
 
 
 import collections
+import operator
 
 from nova import flags
 from nova import log as logging
@@ -47,11 +48,53 @@ flags.DEFINE_integer('compute_fill_first_cost_fn_weight', 1,
              'How much weight to give the fill-first cost function')
 
 
+class HostColumns(object):
+    """Columnar view of a list of (hostname, service) pairs.
+
+    Each capability is packed into a list aligned with the host list the
+    first time a cost function asks for it, so vectorized cost functions
+    share one pass over the hosts per capability instead of each unpacking
+    every host on its own.
+    """
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def get(self, topic, capability, default=0):
+        """Return the list of <topic> <capability> values for all hosts."""
+        key = (topic, capability, default)
+        column = self._columns.get(key)
+        if column is None:
+            column = [service.get(topic, {}).get(capability, default)
+                      for hostname, service in self.hosts]
+            self._columns[key] = column
+        return column
+
+
+def vectorized(vector_fn):
+    """Attach a whole-column implementation to a per-host cost function.
+
+    vector_fn takes a HostColumns instance and returns one cost per host;
+    weighted_sum() prefers it and falls back to calling the decorated
+    function once per host.
+    """
+    def decorator(fn):
+        fn.vectorized = vector_fn
+        return fn
+    return decorator
+
+
+@vectorized(lambda columns: [1] * len(columns))
 def noop_cost_fn(host):
     """Return a pre-weight cost of 1 for each host"""
     return 1
 
 
+@vectorized(lambda columns: columns.get("compute", "host_memory_free"))
 def compute_fill_first_cost_fn(host):
     """Prefer hosts that have less ram available, filter_hosts will exclude
     hosts that don't have enough ram.
@@ -74,18 +117,7 @@ def normalize_list(L):
     return L
 
 
-def weighted_sum(domain, weighted_fns, normalize=True):
-    """Use the weighted-sum method to compute a score for an array of objects.
-    Normalize the results of the objective-functions so that the weights are
-    meaningful regardless of objective-function's range.
-
-    domain - input to be scored
-    weighted_fns - list of weights and functions like:
-        [(weight, objective-functions)]
-
-    Returns an unsorted list of scores. To pair with hosts do:
-        zip(scores, hosts)
-    """
+def _weighted_sum_per_host(domain, weighted_fns, normalize=True):
     # Table of form:
     #   { domain1: [score1, score2, ..., scoreM]
     #     ...
@@ -109,6 +141,50 @@ def weighted_sum(domain, weighted_fns, normalize=True):
     return domain_scores
 
 
+def _weighted_sum_vectorized(domain, weighted_fns, normalize=True):
+    if not domain or not weighted_fns:
+        return []
+    columns = HostColumns(domain)
+    totals = None
+    for weight, fn in weighted_fns:
+        vector_fn = getattr(fn, 'vectorized', None)
+        if vector_fn is not None:
+            scores = vector_fn(columns)
+        else:
+            scores = [fn(elem) for elem in domain]
+        max_ = normalize and max(scores)
+        # Normalizing and weighing happen in the same pass as the sum.
+        if max_ > 0:
+            max_ = float(max_)
+            weighted = [(score / max_) * weight for score in scores]
+        else:
+            weighted = [score * weight for score in scores]
+        if totals is None:
+            totals = weighted
+        else:
+            totals = map(operator.add, totals, weighted)
+    return totals
+
+
+def weighted_sum(domain, weighted_fns, normalize=True, vectorize=True):
+    """Use the weighted-sum method to compute a score for an array of objects.
+    Normalize the results of the objective-functions so that the weights are
+    meaningful regardless of objective-function's range.
+
+    domain - input to be scored
+    weighted_fns - list of weights and functions like:
+        [(weight, objective-functions)]
+    vectorize - evaluate cost functions a column at a time where they
+        provide a vectorized implementation (see vectorized())
+
+    Returns an unsorted list of scores. To pair with hosts do:
+        zip(scores, hosts)
+    """
+    if vectorize:
+        return _weighted_sum_vectorized(domain, weighted_fns, normalize)
+    return _weighted_sum_per_host(domain, weighted_fns, normalize)
+
+
 class LeastCostScheduler(base_scheduler.BaseScheduler):
     def __init__(self, *args, **kwargs):
         self.cost_fns_cache = {}
@@ -72,12 +72,21 @@ class SchedulerManager(manager.Manager):
         return self.zone_manager.get_zone_capabilities(context)
 
     def update_service_capabilities(self, context=None, service_name=None,
-                                                host=None, capabilities=None):
+                                    host=None, capabilities=None,
+                                    sequence=None):
         """Process a capability update from a service node."""
         if not capabilities:
             capabilities = {}
         self.zone_manager.update_service_capabilities(service_name,
-                            host, capabilities)
+                            host, capabilities, sequence)
+
+    def update_service_capabilities_delta(self, context=None,
+                                          service_name=None, host=None,
+                                          changed=None, removed=None,
+                                          sequence=None):
+        """Process the changed capabilities of a service node."""
+        self.zone_manager.update_service_capabilities_delta(service_name,
+                            host, changed or {}, removed or [], sequence)
 
     def select(self, context=None, *args, **kwargs):
         """Select a list of hosts best matching the provided specs."""
@@ -111,6 +120,30 @@ class SchedulerManager(manager.Manager):
                   "args": kwargs})
         LOG.debug(_("Casted to %(topic)s %(host)s for %(method)s") % locals())
 
+    def run_instances(self, context, topic, instance_ids, *args, **kwargs):
+        """Schedules a whole reservation of already created instances.
+
+        Drivers providing schedule_run_instances() place every instance in
+        one pass; others fall back to one schedule_run_instance() each.
+        """
+        try:
+            schedule = getattr(self.driver, 'schedule_run_instances')
+        except AttributeError:
+            for instance_id in instance_ids:
+                self._schedule('run_instance', context, topic, *args,
+                               instance_id=instance_id, **kwargs)
+            return
+
+        hosts = schedule(context.elevated(), instance_ids, *args, **kwargs)
+        for instance_id, host in zip(instance_ids, hosts):
+            instance_kwargs = dict(kwargs, instance_id=instance_id)
+            rpc.cast(context,
+                     db.queue_get_for(context, topic, host),
+                     {"method": "run_instance",
+                      "args": instance_kwargs})
+            LOG.debug(_("Casted to %(topic)s %(host)s for run_instance")
+                      % locals())
+
     # NOTE (masumotok) : This method should be moved to nova.api.ec2.admin.
     #                    Based on bexar design summit discussion,
     #                    just put this here for bexar release.
@@ -37,6 +37,7 @@ flags.DEFINE_string('volume_scheduler_driver',
 
 # A mapping of methods to topics so we can figure out which driver to use.
 _METHOD_MAP = {'run_instance': 'compute',
+               'run_instances': 'compute',
                'start_instance': 'compute',
                'create_volume': 'volume'}
 
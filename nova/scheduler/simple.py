@@ -21,7 +21,10 @@
 Simple Scheduler
 """
 
+import heapq
+
 from nova import db
+from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
@@ -36,6 +39,10 @@ flags.DEFINE_integer("max_gigabytes", 10000,
                      "maximum number of volume gigabytes to allow per host")
 flags.DEFINE_integer("max_networks", 1000,
                      "maximum number of networks to allow per host")
+flags.DEFINE_boolean("simple_scheduler_host_cache", False,
+                     "Pick compute hosts from the in-memory host state "
+                     "cache instead of aggregating instance cores from the "
+                     "database on every request")
 
 LOG = logging.getLogger('nova.scheduler.simple')
 
@@ -43,9 +50,9 @@ LOG = logging.getLogger('nova.scheduler.simple')
 class SimpleScheduler(chance.ChanceScheduler):
     """Implements Naive Scheduler that tries to find least loaded host."""
 
-    def _schedule_instance(self, context, instance_id, *_args, **_kwargs):
-        """Picks a host that is up and has the fewest running instances."""
-        instance_ref = db.instance_get(context, instance_id)
+    def _schedule_instance_on_forced_host(self, context, instance_ref):
+        """Returns the host an admin named in the availability zone, if
+        any, after making sure it is alive."""
         if (instance_ref['availability_zone']
             and ':' in instance_ref['availability_zone']
             and context.is_admin):
@@ -54,13 +61,22 @@ class SimpleScheduler(chance.ChanceScheduler):
                                              'nova-compute')
             if not self.service_is_up(service):
                 raise driver.WillNotSchedule(_("Host %s is not alive") % host)
+            return host
+        return None
 
+    def _schedule_instance(self, context, instance_id, *_args, **_kwargs):
+        """Picks a host that is up and has the fewest running instances."""
+        instance_ref = db.instance_get(context, instance_id)
+        host = self._schedule_instance_on_forced_host(context, instance_ref)
+        if host:
             # TODO(vish): this probably belongs in the manager, if we
             #             can generalize this somehow
             now = utils.utcnow()
             db.instance_update(context, instance_id, {'host': host,
                                                       'scheduled_at': now})
             return host
+        if FLAGS.simple_scheduler_host_cache and self.zone_manager:
+            return self._schedule_instance_from_cache(context, instance_ref)
         results = db.service_get_all_compute_sorted(context)
         for result in results:
             (service, instance_cores) = result
@@ -79,6 +95,59 @@ class SimpleScheduler(chance.ChanceScheduler):
                                    " for this request. Is the appropriate"
                                    " service running?"))
 
+    def _select_hosts(self, context, instance_refs):
+        """Places every instance in one pass over the compute services,
+        charging each placement against a local copy of the core counts.
+        """
+        if FLAGS.simple_scheduler_host_cache and self.zone_manager:
+            cache = self.zone_manager.host_state_cache
+            select = lambda ref: cache.select_host(context, ref['vcpus'],
+                                                   ref['memory_mb'])
+        else:
+            heap = [(instance_cores, service['host'])
+                    for service, instance_cores
+                    in db.service_get_all_compute_sorted(context)
+                    if self.service_is_up(service)]
+            heapq.heapify(heap)
+
+            def select(instance_ref):
+                if not heap:
+                    return None
+                instance_cores, host = heap[0]
+                vcpus = instance_ref['vcpus']
+                if instance_cores + vcpus > FLAGS.max_cores:
+                    raise driver.NoValidHost(_("All hosts have too many "
+                                               "cores"))
+                heapq.heapreplace(heap, (instance_cores + vcpus, host))
+                return host
+
+        hosts = []
+        for instance_ref in instance_refs:
+            host = self._schedule_instance_on_forced_host(context,
+                                                          instance_ref)
+            if not host:
+                host = select(instance_ref)
+            if not host:
+                raise driver.NoValidHost(_("Scheduler was unable to locate"
+                                           " a host for this request. Is the"
+                                           " appropriate service running?"))
+            hosts.append(host)
+        return hosts
+
+    def _schedule_instance_from_cache(self, context, instance_ref):
+        """Picks the least loaded live host from the host state cache."""
+        cache = self.zone_manager.host_state_cache
+        host = cache.select_host(context, instance_ref['vcpus'],
+                                 instance_ref['memory_mb'])
+        if host is None:
+            raise driver.NoValidHost(_("Scheduler was unable to locate a host"
+                                       " for this request. Is the appropriate"
+                                       " service running?"))
+        now = utils.utcnow()
+        db.instance_update(context, instance_ref['id'], {'host': host,
+                                                         'scheduled_at': now})
+        return host
+
     def _instance_update_state_error(self, context, instance_id):
         """Update an instance state to error in the database."""
         values = {"vm_state": vm_states.ERROR, "task_state": None}
@@ -95,6 +164,29 @@ class SimpleScheduler(chance.ChanceScheduler):
             self._instance_update_state_error(context, instance_id)
             raise e
 
+    def schedule_run_instances(self, context, instance_ids, *_args,
+                               **_kwargs):
+        """Picks hosts for a whole reservation and records them at once.
+
+        Returns the hosts in the order of instance_ids.
+        """
+        try:
+            instance_refs = [db.instance_get(context, instance_id)
+                             for instance_id in instance_ids]
+            hosts = self._select_hosts(context, instance_refs)
+            db.instance_update_hosts(context,
+                                     dict(zip(instance_ids, hosts)),
+                                     {'scheduled_at': utils.utcnow()})
+            return hosts
+        except Exception as e:
+            LOG.exception(_("Failed to schedule instances."))
+            for instance_id in instance_ids:
+                try:
+                    self._instance_update_state_error(context, instance_id)
+                except exception.NotFound:
+                    pass
+            raise e
+
     def schedule_start_instance(self, context, instance_id, *_args, **_kwargs):
         return self._schedule_instance(context, instance_id, *_args, **_kwargs)
 
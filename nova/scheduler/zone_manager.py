@@ -17,24 +17,35 @@
 ZoneManager oversees all communications with child Zones.
 """
 
+import bisect
+import calendar
 import datetime
 import thread
+import time
 import traceback
 
 from novaclient import v1_1 as novaclient
 
+import eventlet
 from eventlet import greenpool
+from eventlet import timeout as eventlet_timeout
 
 from nova import db
 from nova import flags
 from nova import log as logging
 from nova import utils
+from nova.scheduler import host_state
 
 FLAGS = flags.FLAGS
+flags.DECLARE('zone_call_timeout', 'nova.scheduler.api')
 flags.DEFINE_integer('zone_db_check_interval', 60,
                     'Seconds between getting fresh zone info from db.')
 flags.DEFINE_integer('zone_failures_to_offline', 3,
              'Number of consecutive errors before marking zone offline')
+flags.DEFINE_float('capabilities_coalesce_window', 0.0,
+                   'Seconds capability updates are collected before they '
+                   'are merged, so several updates from one service cost '
+                   'one merge; 0 merges every update as it arrives')
 
 
 class ZoneState(object):
@@ -47,6 +58,11 @@ class ZoneState(object):
         self.last_seen = datetime.datetime.min
         self.last_exception = None
         self.last_exception_time = None
+        self.call_count = 0
+        self.timeout_count = 0
+        self.latency_last = None
+        self.latency_max = None
+        self.latency_total = 0.0
 
     def update_credentials(self, zone):
         """Update zone credentials from db"""
@@ -65,10 +81,30 @@ class ZoneState(object):
                         for k, v in zone_metadata.iteritems() if k != 'name'])
         self.is_active = True
 
+    def record_latency(self, seconds):
+        """Account for one call to the zone; None means it timed out."""
+        self.call_count += 1
+        if seconds is None:
+            self.timeout_count += 1
+            return
+        self.latency_last = seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self.latency_total += seconds
+
+    def latency_average(self):
+        answered = self.call_count - self.timeout_count
+        if not answered:
+            return None
+        return self.latency_total / answered
+
     def to_dict(self):
         return dict(name=self.name, capabilities=self.capabilities,
                     is_active=self.is_active, api_url=self.api_url,
-                    id=self.zone_id)
+                    id=self.zone_id, call_count=self.call_count,
+                    timeout_count=self.timeout_count,
+                    latency_last=self.latency_last,
+                    latency_average=self.latency_average(),
+                    latency_max=self.latency_max)
 
     def log_error(self, exception):
         """Something went wrong. Check to see if zone should be
@@ -98,10 +134,200 @@ def _call_novaclient(zone):
 def _poll_zone(zone):
     """Eventlet worker to poll a zone."""
     logging.debug(_("Polling zone: %s") % zone.api_url)
+    start = time.time()
     try:
-        zone.update_metadata(_call_novaclient(zone))
+        with eventlet_timeout.Timeout(FLAGS.zone_call_timeout):
+            zone_metadata = _call_novaclient(zone)
+    except eventlet_timeout.Timeout:
+        zone.record_latency(None)
+        zone.log_error(_("No answer within %d seconds")
+                       % FLAGS.zone_call_timeout)
+        return
     except Exception, e:
         zone.log_error(traceback.format_exc())
+        return
+    zone.record_latency(time.time() - start)
+    zone.update_metadata(zone_metadata)
+
+
+class CapabilityIndex(object):
+    """Inverted index of numeric service capabilities.
+
+    For every <service>.<capability> the (value, host) pairs are kept
+    sorted, so range predicates can find the matching hosts by bisection
+    instead of looking at every host. Hosts reporting a non-numeric value
+    for a capability cannot be ordered and are returned as candidates for
+    any range on it.
+    """
+
+    def __init__(self):
+        self._entries = {}  # { (<service>, <cap>) : [(value, host), ...] }
+        self._values = {}  # { (<service>, <cap>) : [value, ...] }
+        self._unordered = {}  # { (<service>, <cap>) : set([host, ...]) }
+        self._host_keys = {}  # { (<host>, <service>) : { <cap> : value } }
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, (int, long, float)) and \
+               not isinstance(value, bool)
+
+    def _remove(self, host, service_name, cap, value):
+        key = (service_name, cap)
+        if self._is_number(value):
+            entries = self._entries[key]
+            idx = bisect.bisect_left(entries, (value, host))
+            del entries[idx]
+            del self._values[key][idx]
+        else:
+            self._unordered[key].discard(host)
+
+    def _add(self, host, service_name, cap, value):
+        key = (service_name, cap)
+        if self._is_number(value):
+            entries = self._entries.setdefault(key, [])
+            idx = bisect.bisect_left(entries, (value, host))
+            entries.insert(idx, (value, host))
+            self._values.setdefault(key, []).insert(idx, value)
+        else:
+            self._unordered.setdefault(key, set()).add(host)
+
+    def update(self, host, service_name, capabilities):
+        """Replace the indexed capabilities of a host's service."""
+        old = self._host_keys.get((host, service_name), {})
+        new = {}
+        for cap, value in capabilities.iteritems():
+            if cap == "timestamp":
+                continue
+            new[cap] = value
+        unchanged = set(cap for cap, value in new.iteritems()
+                        if cap in old and old[cap] == value
+                        and type(old[cap]) is type(value))
+        for cap, value in old.iteritems():
+            if cap not in unchanged:
+                self._remove(host, service_name, cap, value)
+        for cap, value in new.iteritems():
+            if cap not in unchanged:
+                self._add(host, service_name, cap, value)
+        self._host_keys[(host, service_name)] = new
+
+    def update_keys(self, host, service_name, changed, removed):
+        """Apply the changed and removed capabilities of a host's service,
+        leaving the others alone."""
+        old = self._host_keys.setdefault((host, service_name), {})
+        for cap in removed:
+            if cap in old:
+                self._remove(host, service_name, cap, old.pop(cap))
+        for cap, value in changed.iteritems():
+            if cap == "timestamp":
+                continue
+            if cap in old:
+                if old[cap] == value and type(old[cap]) is type(value):
+                    continue
+                self._remove(host, service_name, cap, old[cap])
+            old[cap] = value
+            self._add(host, service_name, cap, value)
+
+    def remove(self, host, service_name):
+        """Forget everything a host's service reported."""
+        old = self._host_keys.pop((host, service_name), {})
+        for cap, value in old.iteritems():
+            self._remove(host, service_name, cap, value)
+
+    def hosts_in_range(self, service_name, cap, lower=None, upper=None,
+                       include_lower=True, include_upper=True):
+        """Return the set of hosts whose value lies within the bounds, plus
+        those whose value cannot be ordered. Hosts that never reported the
+        capability are not included.
+        """
+        key = (service_name, cap)
+        values = self._values.get(key, [])
+        start, end = 0, len(values)
+        if lower is not None:
+            if include_lower:
+                start = bisect.bisect_left(values, lower)
+            else:
+                start = bisect.bisect_right(values, lower)
+        if upper is not None:
+            if include_upper:
+                end = bisect.bisect_right(values, upper)
+            else:
+                end = bisect.bisect_left(values, upper)
+        hosts = set(host for value, host in
+                    self._entries.get(key, [])[start:end])
+        hosts.update(self._unordered.get(key, ()))
+        return hosts
+
+
+def _same_value(value, other):
+    """Whether a host reported the same value again; 1, 1.0 and True are
+    different reports."""
+    return value == other and type(value) is type(other)
+
+
+class CapabilityRange(object):
+    """The (min, max) of one <service>_<cap> over every reporting host.
+
+    Contributions are replaced as hosts report.  The number of hosts at
+    each bound is counted, so the bounds are only rescanned once the last
+    host holding one of them moves away from it.
+    """
+
+    def __init__(self):
+        self.values = {}  # { (<host>, <service>) : value }
+        self._bounds = None  # (<min>, <hosts at min>, <max>, <hosts at max>)
+
+    def set(self, key, value):
+        replaced = key in self.values
+        old = self.values.get(key)
+        if replaced and _same_value(old, value):
+            return
+        self.values[key] = value
+        if self._bounds is None:
+            return
+        min_value, min_count, max_value, max_count = self._bounds
+        if replaced and _same_value(old, min_value):
+            min_count -= 1
+        if replaced and _same_value(old, max_value):
+            max_count -= 1
+        if _same_value(value, min_value):
+            min_count += 1
+        elif value < min_value:
+            min_value, min_count = value, 1
+        if _same_value(value, max_value):
+            max_count += 1
+        elif value > max_value:
+            max_value, max_count = value, 1
+        self._set_bounds(min_value, min_count, max_value, max_count)
+
+    def remove(self, key):
+        old = self.values.pop(key)
+        if self._bounds is None:
+            return
+        min_value, min_count, max_value, max_count = self._bounds
+        if _same_value(old, min_value):
+            min_count -= 1
+        if _same_value(old, max_value):
+            max_count -= 1
+        self._set_bounds(min_value, min_count, max_value, max_count)
+
+    def _set_bounds(self, min_value, min_count, max_value, max_count):
+        if min_count and max_count:
+            self._bounds = (min_value, min_count, max_value, max_count)
+        else:
+            self._bounds = None
+
+    def _scan(self):
+        values = self.values.values()
+        min_value, max_value = min(values), max(values)
+        self._bounds = (min_value,
+                        len([v for v in values if _same_value(v, min_value)]),
+                        max_value,
+                        len([v for v in values if _same_value(v, max_value)]))
+
+    def bounds(self):
+        if self._bounds is None:
+            self._scan()
+        return self._bounds[0], self._bounds[2]
 
 
 class ZoneManager(object):
@@ -111,6 +337,16 @@ class ZoneManager(object):
         self.zone_states = {}  # { <zone_id> : ZoneState }
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
         self.green_pool = greenpool.GreenPool()
+        self.host_state_cache = host_state.HostStateCache()
+        self.capability_index = CapabilityIndex()
+        self._rollup = {}  # { <service>_<cap> : CapabilityRange }
+        self._rollup_keys = {}  # { (<host>, <service>) : [<service>_<cap>] }
+        self._expiry_buckets = {}  # { <time slot> : set([(<host>, <svc>)]) }
+        self._service_buckets = {}  # { (<host>, <service>) : <time slot> }
+        self._capability_sequences = {}  # { (<host>, <service>) : <seq> }
+        # { (<host>, <service>) : (<capabilities>, <removed caps or None>) }
+        self._pending_updates = {}
+        self._flush_timer = None
 
     def get_zone_list(self):
         """Return the list of zones we know about."""
@@ -132,37 +368,104 @@ class ZoneManager(object):
         """Roll up all the individual host info to generic 'service'
            capabilities. Each capability is aggregated into
            <cap>_min and <cap>_max values."""
-        hosts_dict = self.service_states
-
-        # TODO(sandy) - be smarter about fabricating this structure.
-        # But it's likely to change once we understand what the Best-Match
-        # code will need better.
-        combined = {}  # { <service>_<cap> : (min, max), ... }
+        self._expire_stale_host_services()
+        return dict((key, capability_range.bounds())
+                    for key, capability_range in self._rollup.iteritems())
+
+    def _expiry_bucket(self, timestamp):
+        """Index of the periodic_interval wide time slot of timestamp."""
+        seconds = calendar.timegm(timestamp.timetuple())
+        return int(seconds // max(FLAGS.periodic_interval, 1))
+
+    def _set_rollup(self, host, service_name, capabilities):
+        """Replace what one host service contributes to the rollup by its
+        capabilities and file it under the time slot it reported in."""
+        if not capabilities.get("enabled", True):
+            # Service is disabled; do no include it
+            self._remove_from_rollup(host, service_name)
+            return
+        old_keys = self._rollup_keys.get((host, service_name), [])
+        rollup_keys = []
+        for cap, value in capabilities.iteritems():
+            if cap == "timestamp":  # Timestamp is not needed
+                continue
+            key = "%s_%s" % (service_name, cap)
+            capability_range = self._rollup.get(key)
+            if capability_range is None:
+                capability_range = self._rollup[key] = CapabilityRange()
+            capability_range.set((host, service_name), value)
+            rollup_keys.append(key)
+        for key in set(old_keys) - set(rollup_keys):
+            self._remove_rollup_value(key, host, service_name)
+        self._rollup_keys[(host, service_name)] = rollup_keys
+        self._unfile_for_expiry(host, service_name)
+        self._file_for_expiry(host, service_name, capabilities["timestamp"])
+
+    def _update_rollup(self, host, service_name, changed, removed,
+                       timestamp):
+        """Fold only the changed and removed capabilities of an enabled
+        host service into the rollup."""
+        rollup_keys = self._rollup_keys.setdefault((host, service_name), [])
+        for cap in removed:
+            key = "%s_%s" % (service_name, cap)
+            if key in rollup_keys:
+                rollup_keys.remove(key)
+                self._remove_rollup_value(key, host, service_name)
+        for cap, value in changed.iteritems():
+            if cap == "timestamp":
+                continue
+            key = "%s_%s" % (service_name, cap)
+            capability_range = self._rollup.get(key)
+            if capability_range is None:
+                capability_range = self._rollup[key] = CapabilityRange()
+            if (host, service_name) not in capability_range.values:
+                rollup_keys.append(key)
+            capability_range.set((host, service_name), value)
+        self._unfile_for_expiry(host, service_name)
+        self._file_for_expiry(host, service_name, timestamp)
+
+    def _remove_from_rollup(self, host, service_name):
+        for key in self._rollup_keys.pop((host, service_name), []):
+            self._remove_rollup_value(key, host, service_name)
+        self._unfile_for_expiry(host, service_name)
+
+    def _remove_rollup_value(self, key, host, service_name):
+        capability_range = self._rollup[key]
+        capability_range.remove((host, service_name))
+        if not capability_range.values:
+            del self._rollup[key]
+
+    def _file_for_expiry(self, host, service_name, timestamp):
+        bucket = self._expiry_bucket(timestamp)
+        self._expiry_buckets.setdefault(bucket, set()).add(
+                (host, service_name))
+        self._service_buckets[(host, service_name)] = bucket
+
+    def _unfile_for_expiry(self, host, service_name):
+        bucket = self._service_buckets.pop((host, service_name), None)
+        if bucket is not None:
+            services = self._expiry_buckets[bucket]
+            services.discard((host, service_name))
+            if not services:
+                del self._expiry_buckets[bucket]
+
+    def _expire_stale_host_services(self):
+        """Only the time slots at or before the staleness cutoff are
+        looked at; all but the last of them are stale as a whole."""
+        allowed_time_diff = FLAGS.periodic_interval * 3
+        cutoff = utils.utcnow() - \
+                 datetime.timedelta(seconds=allowed_time_diff)
+        cutoff_bucket = self._expiry_bucket(cutoff)
         stale_host_services = {}  # { host1 : [svc1, svc2], host2 :[svc1]}
-        for host, host_dict in hosts_dict.iteritems():
-            for service_name, service_dict in host_dict.iteritems():
-                if not service_dict.get("enabled", True):
-                    # Service is disabled; do no include it
-                    continue
-
-                #Check if the service capabilities became stale
-                if self.host_service_caps_stale(host, service_name):
-                    if host not in stale_host_services:
-                        stale_host_services[host] = []  # Adding host key once
-                    stale_host_services[host].append(service_name)
+        for bucket in [bucket for bucket in self._expiry_buckets
+                       if bucket <= cutoff_bucket]:
+            for host, service_name in self._expiry_buckets[bucket]:
+                if bucket == cutoff_bucket and \
+                   not self.host_service_caps_stale(host, service_name):
                     continue
-                for cap, value in service_dict.iteritems():
-                    if cap == "timestamp":  # Timestamp is not needed
-                        continue
-                    key = "%s_%s" % (service_name, cap)
-                    min_value, max_value = combined.get(key, (value, value))
-                    min_value = min(min_value, value)
-                    max_value = max(max_value, value)
-                    combined[key] = (min_value, max_value)
-
-        # Delete the expired host services
+                stale_host_services.setdefault(host, []).append(
+                        service_name)
         self.delete_expired_host_services(stale_host_services)
-        return combined
 
     def _refresh_from_db(self, context):
         """Make our zone state map match the db."""
@@ -184,7 +487,15 @@ class ZoneManager(object):
 
     def _poll_zones(self, context):
         """Try to connect to each child zone and get update."""
-        self.green_pool.imap(_poll_zone, self.zone_states.values())
+        for zone in self.zone_states.values():
+            self.green_pool.spawn_n(_poll_zone, zone)
+
+    def record_zone_latencies(self, timings):
+        """Account for the per-zone timings of a call_zone_method()."""
+        for zone_id, seconds in timings.iteritems():
+            zone = self.zone_states.get(zone_id)
+            if zone is not None:
+                zone.record_latency(seconds)
 
     def ping(self, context=None):
         """Ping should be called periodically to update zone status."""
@@ -195,14 +506,108 @@ class ZoneManager(object):
             self._refresh_from_db(context)
         self._poll_zones(context)
 
-    def update_service_capabilities(self, service_name, host, capabilities):
-        """Update the per-service capabilities based on this notification."""
+    def update_service_capabilities(self, service_name, host, capabilities,
+                                    sequence=None):
+        """Update the per-service capabilities based on this notification.
+
+        sequence numbers the update when the service also sends deltas.
+        """
         logging.debug(_("Received %(service_name)s service update from "
                 "%(host)s.") % locals())
+        self._capability_sequences[(host, service_name)] = sequence
+        self._queue_capability_update(host, service_name, capabilities, None)
+
+    def update_service_capabilities_delta(self, service_name, host, changed,
+                                          removed, sequence):
+        """Update the per-service capabilities that changed since the
+        previous update.
+
+        Deltas that do not follow on from the last update seen are ignored
+        until the service sends its next full snapshot.
+        """
+        key = (host, service_name)
+        last = self._capability_sequences.get(key)
+        if last is None or sequence != last + 1:
+            logging.debug(_("Ignoring out of sequence %(service_name)s "
+                    "service update from %(host)s.") % locals())
+            self._capability_sequences.pop(key, None)
+            return
+        self._capability_sequences[key] = sequence
+        self._queue_capability_update(host, service_name, changed, removed)
+
+    def _queue_capability_update(self, host, service_name, capabilities,
+                                 removed):
+        """Fold an update into the pending one of the same service; a
+        removed of None marks a full snapshot."""
+        key = (host, service_name)
+        pending = self._pending_updates.get(key)
+        if pending is None or removed is None:
+            pending = ({}, None if removed is None else set())
+            self._pending_updates[key] = pending
+        pending_caps, pending_removed = pending
+        pending_caps.update(capabilities)
+        for cap in removed or []:
+            pending_caps.pop(cap, None)
+        if pending_removed is not None:
+            pending_removed.difference_update(capabilities)
+            pending_removed.update(removed)
+
+        if FLAGS.capabilities_coalesce_window <= 0:
+            self.flush_capability_updates()
+        elif self._flush_timer is None:
+            self._flush_timer = eventlet.spawn_after(
+                    FLAGS.capabilities_coalesce_window,
+                    self.flush_capability_updates)
+
+    def flush_capability_updates(self):
+        """Merge every pending capability update."""
+        if self._flush_timer is not None:
+            # NOTE: cancel() leaves an already running timer alone.
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        pending, self._pending_updates = self._pending_updates, {}
+        for (host, service_name), (capabilities, removed) in \
+                pending.iteritems():
+            if removed is None:
+                self._set_service_capabilities(host, service_name,
+                                               capabilities)
+            else:
+                self._merge_service_capabilities(host, service_name,
+                                                 capabilities, removed)
+
+    def _merge_service_capabilities(self, host, service_name, changed,
+                                    removed):
+        capabilities = self.service_states.get(host, {}).get(service_name)
+        if capabilities is None:
+            # Expired since the last snapshot; wait for the next one
+            self._capability_sequences.pop((host, service_name), None)
+            return
+        was_enabled = capabilities.get("enabled", True)
+        capabilities.update(changed)
+        for cap in removed:
+            capabilities.pop(cap, None)
+        capabilities["timestamp"] = utils.utcnow()  # Reported time
+        if was_enabled and capabilities.get("enabled", True):
+            self._update_rollup(host, service_name, changed, removed,
+                                capabilities["timestamp"])
+        else:
+            self._set_rollup(host, service_name, capabilities)
+        self.capability_index.update_keys(host, service_name, changed,
+                                          removed)
+        if service_name == 'compute':
+            self.host_state_cache.update_service_capabilities(host,
+                                                              capabilities)
+
+    def _set_service_capabilities(self, host, service_name, capabilities):
         service_caps = self.service_states.get(host, {})
         capabilities["timestamp"] = utils.utcnow()  # Reported time
         service_caps[service_name] = capabilities
         self.service_states[host] = service_caps
+        self._set_rollup(host, service_name, capabilities)
+        self.capability_index.update(host, service_name, capabilities)
+        if service_name == 'compute':
+            self.host_state_cache.update_service_capabilities(host,
+                                                              capabilities)
 
     def host_service_caps_stale(self, host, service):
         """Check if host service capabilites are not recent enough."""
@@ -219,5 +624,8 @@ class ZoneManager(object):
             service_caps = self.service_states[host]
             for service in services:
                 del service_caps[service]
+                self._capability_sequences.pop((host, service), None)
+                self.capability_index.remove(host, service)
+                self._remove_from_rollup(host, service)
                 if len(service_caps) == 0:  # Delete host if no services
                     del self.service_states[host]
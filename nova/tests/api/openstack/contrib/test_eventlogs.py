@@ -64,8 +64,14 @@ def db_eventlog_get_all_by_request_id(context, request_id, session=None):
     return get_single_requestid_logs()
 
 
-def db_eventlog_get_all(context, filters=None):
-    return get_all_logs()
+def db_eventlog_get_all(context, filters=None, marker=None, limit=None):
+    logs = get_all_logs()
+    if marker is not None:
+        ids = [log['id'] for log in logs]
+        if marker not in ids:
+            raise exception.MarkerNotFound(marker=marker)
+        logs = logs[ids.index(marker) + 1:]
+    return logs[:limit]
 
 
 class EventlogsTest(test.TestCase):
@@ -144,6 +150,22 @@ class EventlogsTest(test.TestCase):
         response = {'eventlogs': expected_logs[5:]}
         self.assertEqual(res_dict, response)
 
+    def test_logs_list_fetches_one_page(self):
+        calls = []
+
+        def fake_eventlog_get_all(context, filters=None, marker=None,
+                                  limit=None):
+            calls.append((marker, limit))
+            return db_eventlog_get_all(context, filters, marker, limit)
+
+        self.stubs.Set(db.api, "eventlog_get_all", fake_eventlog_get_all)
+        req = webob.Request.blank('/v1.1/fake/logs?limit=3&marker=5')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 200)
+        res_dict = json.loads(res.body)
+        self.assertEqual(res_dict['eventlogs'], get_all_logs()[5:8])
+        self.assertEqual(calls, [(5, 4)])
+
     def test_logs_list_invalid_marker(self):
         req = webob.Request.blank('/v1.1/fake/logs?marker=555')
         res = req.get_response(fakes.wsgi_app())
@@ -108,7 +108,11 @@ def return_server_with_uuid_and_state(vm_state, task_state):
 
 
 def return_servers(context, *args, **kwargs):
-    return [stub_instance(i, 'fake', 'fake') for i in xrange(5)]
+    servers = [stub_instance(i, 'fake', 'fake') for i in xrange(5)]
+    marker = kwargs.get('marker')
+    if marker is not None:
+        servers = servers[marker + 1:]
+    return servers[:kwargs.get('limit')]
 
 
 def return_servers_by_reservation(context, reservation_id=""):
@@ -1078,6 +1082,20 @@ class ServersTest(test.TestCase):
                 self.assertEqual(s.get('name'), 'server%d' % i)
                 i += 1
 
+    def test_get_server_list_with_reservation_id_and_limit(self):
+        self.stubs.Set(nova.scheduler.api, 'call_zone_method',
+                       return_servers_from_child_zones)
+        req = webob.Request.blank('/v1.1/fake/servers?reservation_id=foo'
+                                  '&limit=3')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(3, len(json.loads(res.body)['servers']))
+
+        req = webob.Request.blank('/v1.0/servers?reservation_id=foo'
+                                  '&limit=3&offset=4')
+        res = req.get_response(fakes.wsgi_app())
+        servers = json.loads(res.body)['servers']
+        self.assertEqual([4, 0, 1], [s['id'] for s in servers])
+
     def test_get_server_list_v1_1(self):
         req = webob.Request.blank('/v1.1/fake/servers')
         res = req.get_response(fakes.wsgi_app())
@@ -1162,7 +1180,7 @@ class ServersTest(test.TestCase):
 
     def test_get_servers_with_bad_option_v1_0(self):
         # 1.0 API ignores unknown options
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             return [stub_instance(100)]
 
         self.stubs.Set(nova.compute.API, 'get_all', fake_get_all)
@@ -1176,7 +1194,7 @@ class ServersTest(test.TestCase):
 
     def test_get_servers_with_bad_option_v1_1(self):
         # 1.1 API also ignores unknown options
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             return [stub_instance(100)]
 
         self.stubs.Set(nova.compute.API, 'get_all', fake_get_all)
@@ -1189,7 +1207,7 @@ class ServersTest(test.TestCase):
         self.assertEqual(servers[0]['id'], 100)
 
     def test_get_servers_allows_image_v1_1(self):
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('image' in search_opts)
             self.assertEqual(search_opts['image'], '12345')
@@ -1208,7 +1226,7 @@ class ServersTest(test.TestCase):
         self.assertEqual(servers[0]['id'], 100)
 
     def test_tenant_id_filter_converts_to_project_id_for_admin(self):
-        def fake_get_all(context, filters=None):
+        def fake_get_all(context, filters=None, **kwargs):
             self.assertNotEqual(filters, None)
             self.assertEqual(filters['project_id'], 'faketenant')
             self.assertFalse(filters.get('tenant_id'))
@@ -1228,7 +1246,7 @@ class ServersTest(test.TestCase):
         self.assertEqual(res.status_int, 200)
 
     def test_get_servers_allows_flavor_v1_1(self):
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('flavor' in search_opts)
             # flavor is an integer ID
@@ -1248,7 +1266,7 @@ class ServersTest(test.TestCase):
         self.assertEqual(servers[0]['id'], 100)
 
     def test_get_servers_allows_status_v1_1(self):
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('vm_state' in search_opts)
             self.assertEqual(search_opts['vm_state'], vm_states.ACTIVE)
@@ -1275,7 +1293,7 @@ class ServersTest(test.TestCase):
         self.assertTrue(res.body.find('Invalid server status') > -1)
 
     def test_get_servers_allows_name_v1_1(self):
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('name' in search_opts)
             self.assertEqual(search_opts['name'], 'whee.*')
@@ -1294,7 +1312,7 @@ class ServersTest(test.TestCase):
         self.assertEqual(servers[0]['id'], 100)
 
     def test_get_servers_allows_changes_since_v1_1(self):
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('changes-since' in search_opts)
             changes_since = datetime.datetime(2011, 1, 24, 17, 8, 1)
@@ -1327,7 +1345,7 @@ class ServersTest(test.TestCase):
 
         self.flags(allow_admin_api=False)
 
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             # Allowed by user
             self.assertTrue('name' in search_opts)
@@ -1361,7 +1379,7 @@ class ServersTest(test.TestCase):
 
         self.flags(allow_admin_api=True)
 
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             # Allowed by user
             self.assertTrue('name' in search_opts)
@@ -1394,7 +1412,7 @@ class ServersTest(test.TestCase):
 
         self.flags(allow_admin_api=True)
 
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             # Allowed by user
             self.assertTrue('name' in search_opts)
@@ -1425,7 +1443,7 @@ class ServersTest(test.TestCase):
         """
         self.flags(allow_admin_api=True)
 
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('ip' in search_opts)
             self.assertEqual(search_opts['ip'], '10\..*')
@@ -1451,7 +1469,7 @@ class ServersTest(test.TestCase):
         """
         self.flags(allow_admin_api=True)
 
-        def fake_get_all(compute_self, context, search_opts=None):
+        def fake_get_all(compute_self, context, search_opts=None, **kwargs):
             self.assertNotEqual(search_opts, None)
             self.assertTrue('ip6' in search_opts)
             self.assertEqual(search_opts['ip6'], 'ffff.*')
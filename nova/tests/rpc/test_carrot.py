@@ -21,6 +21,7 @@ Unit Tests for remote procedure calls using carrot
 
 from nova import context
 from nova import log as logging
+from nova.rpc import common as rpc_common
 from nova.rpc import impl_carrot
 from nova.tests.rpc import common
 
@@ -43,3 +44,79 @@ class RpcCarrotTestCase(common._BaseRpcTestCase):
         conn2 = self.rpc.ConnectionPool.get()
         self.rpc.ConnectionPool.put(conn2)
         self.assertEqual(conn1, conn2)
+
+    def test_call_timeout(self):
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}})
+
+    def test_full_lane_requeues(self):
+        """Test that a message a full lane turns down is requeued."""
+        self.flags(rpc_lane_queue_size=1, rpc_thread_pool_size=1)
+        rpc_common.reset_lanes()
+
+        class FakeMessage(object):
+            state = None
+
+            def ack(self):
+                self.state = 'ack'
+
+            def requeue(self):
+                self.state = 'requeue'
+
+        try:
+            lane = rpc_common.get_lane('echo')
+            self.assertTrue(lane.spawn(lambda: None))
+            self.assertTrue(lane.spawn(lambda: None))
+            consumer = self.rpc.TopicAdapterConsumer(
+                    connection=self.rpc.Connection.instance(new=True),
+                    topic='full_lane', proxy=common.TestReceiver)
+            message = FakeMessage()
+            consumer.process_data({'method': 'echo',
+                                   'args': {'value': 42},
+                                   '_context_user_id': 'fake',
+                                   '_context_project_id': 'fake'}, message)
+            self.assertEqual('requeue', message.state)
+        finally:
+            rpc_common.reset_lanes()
+
+
+class RpcCarrotSharedReplyTestCase(RpcCarrotTestCase):
+    """Runs the carrot tests with replies on the shared reply queue."""
+    def setUp(self):
+        super(RpcCarrotSharedReplyTestCase, self).setUp()
+        self.flags(rpc_shared_reply_queue=True)
+
+    def tearDown(self):
+        self.rpc.cleanup()
+        super(RpcCarrotSharedReplyTestCase, self).tearDown()
+
+    def test_shared_reply_queue_reused(self):
+        value = 42
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": value}})
+        reply_q = self.rpc._get_reply_dispatcher().reply_q
+        result = self.rpc.call(self.context, 'test',
+                               {"method": "echo_three_times",
+                                "args": {"value": value}})
+        self.assertEqual(value + 2, result)
+        self.assertEqual(reply_q, self.rpc._get_reply_dispatcher().reply_q)
+        self.assertEqual({}, self.rpc._get_reply_dispatcher()._waiters)
+
+    def test_call_timeout(self):
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}})
+        self.assertEqual({}, self.rpc._get_reply_dispatcher()._waiters)
+
+
+class RpcCarrotCompressedTestCase(common._BaseRpcTestCase):
+    """Runs the shared rpc tests with compressed, binary messages."""
+    def setUp(self):
+        self.rpc = impl_carrot
+        super(RpcCarrotCompressedTestCase, self).setUp()
+        self.flags(rpc_compression_threshold=1)
+        if rpc_common.msgpack:
+            self.flags(rpc_serializer='msgpack')
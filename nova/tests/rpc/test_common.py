@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for rpc message serialization
+"""
+
+import datetime
+
+import eventlet
+from eventlet import event as eventlet_event
+
+from nova import exception
+from nova import test
+from nova.rpc import common as rpc_common
+
+
+MESSAGE = {'method': 'update_service_capabilities',
+           'args': {'service_name': 'compute',
+                    'host': 'host1',
+                    'capabilities': {'host_memory_free': 1024,
+                                     'hypervisor_type': u'qemu',
+                                     'cpu_info': ['vmx'] * 100}}}
+
+
+class FakeRegistry(object):
+    def __init__(self):
+        self.decoders = {}
+
+    def register(self, name, encoder, decoder, content_type,
+                 content_encoding='utf-8'):
+        self.decoders[content_type] = decoder
+
+
+class RpcSerializerTestCase(test.TestCase):
+    def setUp(self):
+        super(RpcSerializerTestCase, self).setUp()
+        self.registry = FakeRegistry()
+        rpc_common.register_decoders(self.registry)
+
+    def _round_trip(self, accept=None):
+        body, content_type, content_encoding = rpc_common.serialize(MESSAGE,
+                                                                    accept)
+        self.assertEqual(MESSAGE, self.registry.decoders[content_type](body))
+        return body, content_type
+
+    def test_json(self):
+        body, content_type = self._round_trip()
+        self.assertEqual('application/json', content_type)
+
+    def test_compressed_above_threshold(self):
+        body, content_type = self._round_trip()
+        self.flags(rpc_compression_threshold=len(body))
+        compressed, content_type = self._round_trip()
+        self.assertEqual('application/json+zlib', content_type)
+        self.assertTrue(len(compressed) < len(body))
+        self.flags(rpc_compression_threshold=len(body) + 1)
+        self.assertEqual('application/json', self._round_trip()[1])
+
+    def test_reply_follows_accept(self):
+        self.flags(rpc_compression_threshold=1)
+        self.assertEqual('application/json+zlib',
+                         self._round_trip(['application/json',
+                                           'application/json+zlib'])[1])
+        self.assertEqual('application/json',
+                         self._round_trip(['application/json'])[1])
+        self.assertEqual('application/json', self._round_trip([])[1])
+
+    def test_datetime_sent_as_string(self):
+        message = {'method': 'run_instance',
+                   'args': {'created_at': datetime.datetime(2011, 1, 1)}}
+        body, content_type, content_encoding = rpc_common.serialize(message)
+        self.assertEqual('2011-01-01 00:00:00',
+                         self.registry.decoders[content_type](body)
+                         ['args']['created_at'])
+
+    def test_unknown_serializer(self):
+        self.flags(rpc_serializer='no_such_serializer')
+        self.assertRaises(exception.Error, rpc_common.serialize, MESSAGE)
+
+    @test.skip_unless(rpc_common.msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        self.flags(rpc_serializer='msgpack', rpc_compression_threshold=1)
+        accept = rpc_common.accepted_content_types()
+        self.assertEqual('application/x-msgpack+zlib',
+                         self._round_trip(accept)[1])
+        self.assertEqual('application/json+zlib',
+                         self._round_trip(['application/json',
+                                           'application/json+zlib'])[1])
+
+
+class RpcLaneTestCase(test.TestCase):
+    def setUp(self):
+        super(RpcLaneTestCase, self).setUp()
+        self.flags(rpc_thread_pool_size=2, rpc_lanes=['priority:1'],
+                   rpc_lane_methods=['urgent:priority'],
+                   rpc_lane_queue_size=2)
+        rpc_common.reset_lanes()
+        self.handled = []
+
+    def tearDown(self):
+        rpc_common.reset_lanes()
+        super(RpcLaneTestCase, self).tearDown()
+
+    def _handle(self, event, value):
+        event.wait()
+        self.handled.append(value)
+
+    def test_lanes_routed_by_method(self):
+        self.assertEqual('priority', rpc_common.get_lane('urgent').name)
+        self.assertEqual('default', rpc_common.get_lane('slow').name)
+
+    def test_unknown_lane(self):
+        self.flags(rpc_lane_methods=['urgent:no_such_lane'])
+        rpc_common.reset_lanes()
+        self.assertRaises(exception.Error, rpc_common.get_lane, 'urgent')
+
+    def test_requests_wait_for_a_greenthread(self):
+        lane = rpc_common.get_lane('slow')
+        events = [eventlet_event.Event() for x in xrange(4)]
+        for x, event in enumerate(events):
+            self.assertTrue(lane.spawn(self._handle, event, x))
+        eventlet.sleep(0)
+
+        # A full lane turns requests down instead of blocking
+        self.assertFalse(lane.spawn(self._handle, events[0], 4))
+        self.assertEqual({'size': 2, 'running': 2, 'waiting': 2,
+                          'max_waiting': 2, 'rejected': 1},
+                         rpc_common.lane_stats()['default'])
+
+        # A full lane does not hold up the others
+        priority_event = eventlet_event.Event()
+        rpc_common.get_lane('urgent').spawn(self._handle, priority_event,
+                                            'urgent')
+        priority_event.send()
+        eventlet.sleep(0)
+        self.assertEqual(['urgent'], self.handled)
+
+        for event in events:
+            event.send()
+        eventlet.sleep(0)
+        eventlet.sleep(0)
+        self.assertEqual([0, 1, 2, 3], sorted(self.handled[1:]))
+        self.assertEqual(0, rpc_common.lane_stats()['default']['running'])
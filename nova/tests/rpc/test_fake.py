@@ -34,3 +34,19 @@ class RpcFakeTestCase(common._BaseRpcTestCase):
 
     def tearDown(self):
         super(RpcFakeTestCase, self).tearDown()
+
+    def test_fanout_cast_reaches_every_consumer(self):
+        received = []
+
+        class Receiver(object):
+            def echo(self, context, value):
+                received.append(value)
+
+        conns = [impl_fake.create_connection() for x in xrange(2)]
+        for conn in conns:
+            conn.create_consumer('fanout_test', Receiver(), True)
+        self.rpc.fanout_cast(self.context, 'fanout_test',
+                             {'method': 'echo', 'args': {'value': 42}})
+        for conn in conns:
+            conn.close()
+        self.assertEqual([42, 42], received)
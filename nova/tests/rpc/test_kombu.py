@@ -21,11 +21,14 @@
 Unit Tests for remote procedure calls using kombu
 """
 
+import time
+
 from nova import flags
 from nova import context
 from nova import exception
 from nova import log as logging
 from nova import test
+from nova.rpc import common as rpc_common
 from nova.rpc import impl_kombu
 from nose.plugins.attrib import attr
 from nova.tests.rpc import common
@@ -70,6 +73,23 @@ class RpcKombuTestCase(common._BaseRpcTestCase):
 
         self.assertEqual(self.received_message, message)
 
+    def test_topic_message_requeued(self):
+        """Test a message the callback turns down is delivered again"""
+
+        conn = self.rpc.create_connection()
+        self.received_messages = []
+
+        def _callback(message):
+            self.received_messages.append(message)
+            return len(self.received_messages) > 1
+
+        conn.declare_topic_consumer('a_topic', _callback)
+        conn.topic_send('a_topic', 'requeued message')
+        conn.consume(limit=2)
+        conn.close()
+
+        self.assertEqual(['requeued message'] * 2, self.received_messages)
+
     def test_direct_send_receive(self):
         """Test sending to a direct exchange/queue"""
         conn = self.rpc.create_connection()
@@ -332,3 +352,133 @@ class RpcKombuTestCase(common._BaseRpcTestCase):
         self._rpc_consumer_thread = 10
         result = self.rpc.Connection().cancel_consumer_thread()
         self.assertEqual(None, result)
+
+    def test_call_timeout(self):
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}})
+
+    def test_publishers_reused(self):
+        """Topic publishers are kept on the connection, direct ones not."""
+        self.flags(rpc_publisher_cache_size=2)
+        conn = self.rpc.Connection()
+        publisher = conn.get_publisher(self.rpc.TopicPublisher, 'a_topic')
+        self.assertEqual(publisher,
+                conn.get_publisher(self.rpc.TopicPublisher, 'a_topic'))
+        self.assertNotEqual(publisher,
+                conn.get_publisher(self.rpc.FanoutPublisher, 'a_topic'))
+        conn.get_publisher(self.rpc.DirectPublisher, 'a_msg_id')
+        self.assertEqual(2, len(conn.publishers))
+
+        # The least recently used publisher is dropped first
+        conn.get_publisher(self.rpc.TopicPublisher, 'a_topic')
+        conn.get_publisher(self.rpc.TopicPublisher, 'b_topic')
+        self.assertEqual([(self.rpc.TopicPublisher, 'a_topic'),
+                          (self.rpc.TopicPublisher, 'b_topic')],
+                         conn.publishers.keys())
+
+        # Resetting a connection without consumers keeps its channel
+        channel = conn.channel
+        conn.reset()
+        self.assertEqual(channel, conn.channel)
+        self.assertEqual(2, len(conn.publishers))
+        conn.declare_topic_consumer('a_topic', None)
+        conn.reset()
+        self.assertNotEqual(channel, conn.channel)
+        self.assertEqual(0, len(conn.publishers))
+        conn.close()
+
+    def test_pool_reaps_idle_connections(self):
+        self.flags(rpc_conn_idle_timeout=60)
+        pool = self.rpc.Pool(max_size=5, order_as_stack=True)
+        conn1 = pool.get()
+        conn2 = pool.get()
+        pool.put(conn1)
+        pool.put(conn2)
+        conn1.last_used -= 61
+        self.assertEqual(conn2, pool.get())
+        self.assertEqual(1, pool.current_size)
+        self.assertFalse(conn1.is_healthy())
+
+        # Closed connections are not handed out
+        pool.put(conn2)
+        conn2.close()
+        conn3 = pool.get()
+        self.assertNotEqual(conn2, conn3)
+        self.assertEqual(1, pool.current_size)
+        conn3.close()
+
+    def test_call_records_stats(self):
+        rpc_common.STATS.reset()
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": 42}})
+        stats = rpc_common.STATS.to_dict()['test.echo']
+        self.assertEqual(1, stats['call']['count'])
+        self.assertEqual(1, stats['queue_wait']['count'])
+        self.assertEqual(1, stats['handle']['count'])
+
+    def test_expired_call_dropped(self):
+        rpc_common.STATS.reset()
+        self.called = False
+
+        def fake_echo(context, value):
+            self.called = True
+
+        self.stubs.Set(common.TestReceiver, 'echo', staticmethod(fake_echo))
+        callback = impl_kombu.ProxyCallback(common.TestReceiver, 'test')
+        now = time.time()
+        ctxt = impl_kombu.RpcContext('fake', 'fake', sent_at=now - 2,
+                                     deadline=now - 1)
+        callback._process_data(ctxt, 'echo', {'value': 42})
+        self.assertFalse(self.called)
+        self.assertEqual(1,
+                rpc_common.STATS.to_dict()['test.echo']['expired'])
+
+    def test_deadline_inherited(self):
+        self.flags(rpc_response_timeout=60)
+        ctxt = impl_kombu.RpcContext('fake', 'fake',
+                                     deadline=time.time() + 1)
+        self.assertEqual(ctxt.deadline, rpc_common.get_deadline(ctxt))
+        self.assertTrue(rpc_common.get_deadline(self.context) >
+                        ctxt.deadline)
+
+
+class RpcKombuSharedReplyTestCase(RpcKombuTestCase):
+    """Runs the kombu tests with replies on the shared reply queue."""
+    def setUp(self):
+        super(RpcKombuSharedReplyTestCase, self).setUp()
+        self.flags(rpc_shared_reply_queue=True)
+
+    def tearDown(self):
+        self.rpc.cleanup()
+        super(RpcKombuSharedReplyTestCase, self).tearDown()
+
+    def test_shared_reply_queue_reused(self):
+        value = 42
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": value}})
+        reply_q = self.rpc._get_reply_dispatcher().reply_q
+        result = self.rpc.call(self.context, 'test',
+                               {"method": "echo_three_times",
+                                "args": {"value": value}})
+        self.assertEqual(value + 2, result)
+        self.assertEqual(reply_q, self.rpc._get_reply_dispatcher().reply_q)
+        self.assertEqual({}, self.rpc._get_reply_dispatcher()._waiters)
+
+    def test_call_timeout(self):
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}})
+        self.assertEqual({}, self.rpc._get_reply_dispatcher()._waiters)
+
+
+class RpcKombuCompressedTestCase(common._BaseRpcTestCase):
+    """Runs the shared rpc tests with compressed, binary messages."""
+    def setUp(self):
+        self.rpc = impl_kombu
+        super(RpcKombuCompressedTestCase, self).setUp()
+        self.flags(rpc_compression_threshold=1)
+        if rpc_common.msgpack:
+            self.flags(rpc_serializer='msgpack')
@@ -214,6 +214,64 @@ class AbstractSchedulerTestCase(test.TestCase):
         # 4 local hosts
         self.assertEqual(4, len(hostnames))
 
+    def test_plan_instances_tracks_free_memory(self):
+        """Make sure one build plan serves the whole reservation without
+        overcommitting the memory each local host reported.
+        """
+        sched = FakeAbstractScheduler()
+        mb = 1024 * 1024
+        build_plan = [
+            dict(weight=1, hostname='host1',
+                 capabilities={'host_memory_free': 1024 * mb}),
+            dict(weight=2, child_zone=1, child_blob='blob'),
+            dict(weight=3, hostname='host2',
+                 capabilities={'host_memory_free': 2048 * mb})]
+        plan = sched._plan_instances(build_plan,
+                {'instance_type': {'memory_mb': 512}}, 7)
+        self.assertEqual([item.get('hostname') for item in plan],
+                         ['host1', None, 'host2', 'host1', 'host2', 'host2',
+                          'host2'])
+
+        plan = sched._plan_instances(build_plan,
+                {'instance_type': {'memory_mb': 512}}, 10)
+        self.assertEqual(len(plan), 7)
+
+    def test_child_zone_select_cache(self):
+        """Make sure child zone build plans are reused for requests of the
+        same shape while they are fresh, expired ones are dropped, and
+        adjusted weights do not leak into the cache.
+        """
+        sched = FakeAbstractScheduler()
+        calls = []
+
+        def counting_call_zone_method(context, method, specs, zones):
+            calls.append(specs)
+            return fake_call_zone_method(context, method, specs, zones)
+
+        self.stubs.Set(sched, '_call_zone_method', counting_call_zone_method)
+        self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
+        sched.set_zone_manager(FakeZoneManager())
+
+        spec = {'instance_type': {'memory_mb': 512}, 'num_instances': 4,
+                'instance_properties': {'display_name': 'first'}}
+        first = sched.select({}, spec)
+        spec['instance_properties'] = {'display_name': 'second'}
+        self.assertEqual(first, sched.select({}, spec))
+        self.assertEqual(len(calls), 1)
+
+        sched._child_select_cache['expired'] = (0, [], [])
+        sched.select({}, {'instance_type': {'memory_mb': 1024},
+                          'num_instances': 4})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(sched._child_select_cache), 2)
+        self.assertFalse('expired' in sched._child_select_cache)
+
+        self.flags(child_zone_select_cache_ttl=0)
+        sched._child_select_cache.clear()
+        sched.select({}, spec)
+        sched.select({}, spec)
+        self.assertEqual(len(calls), 4)
+
     def test_adjust_child_weights(self):
         """Make sure the weights returned by child zones are
         properly adjusted based on the scale/offset in the zone
@@ -410,6 +468,32 @@ class AbstractSchedulerTestCase(test.TestCase):
         # 0 from local zones, 12 from remotes
         self.assertEqual(12, len(build_plan))
 
+    def test_child_zone_timeout(self):
+        """Make sure a child zone that did not answer is left out of the
+        build plan rather than failing the whole request.
+        """
+        sched = FakeAbstractScheduler()
+
+        def timeout_call_zone_method(context, method, specs, zones):
+            child_results = fake_call_zone_method(context, method, specs,
+                                                  zones)
+            child_results[1] = (2, None)
+            return child_results
+
+        self.stubs.Set(sched, '_call_zone_method', timeout_call_zone_method)
+        self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
+        sched.set_zone_manager(FakeZoneManager())
+
+        build_plan = sched.select({},
+                {'instance_type': {'memory_mb': 512},
+                    'num_instances': 4})
+
+        # 4 from local zones, 4 each from zones 1 and 3
+        self.assertEqual(12, len(build_plan))
+        self.assertEqual([1, 3], sorted(set(item['child_zone']
+                                            for item in build_plan
+                                            if 'child_zone' in item)))
+
     @attr(kind='small')
     def test_call_zone_method(self):
 
@@ -624,7 +708,8 @@ class AbstractSchedulerTestCase(test.TestCase):
     def test_schedule_run_instance_configuration(self):
 
         def mock_select(self, context, request_spec, *args, **kwargs):
-            return [False, True]
+            return [dict(weight=1, hostname='host1', capabilities={}),
+                    dict(weight=2, child_zone=1, child_blob='blob')]
 
         def mock_provision_resource(sself, context, build_plan_item,
                                     instance_id, request_spec, kwargs):
@@ -22,6 +22,7 @@ from nova import exception
 from nova import test
 from nova.scheduler import host_filter
 from nova.scheduler import filters
+from nova.scheduler import zone_manager
 
 
 class FakeZoneManager:
@@ -227,3 +228,47 @@ class HostFilterTestCase(test.TestCase):
 
         self.assertFalse(hf.filter_hosts(self.zone_manager,
                 json.dumps(['=', {}, ['>', '$missing....foo']])))
+
+    def test_json_filter_uses_capability_index(self):
+        hf = filters.JsonFilter()
+        zm = zone_manager.ZoneManager()
+        for host, services in self.zone_manager.service_states.iteritems():
+            zm.update_service_capabilities('compute', host,
+                                           dict(services['compute']))
+        evaluated = []
+        compiled = []
+        real_compile = hf._compile
+        real_get_plan = hf._get_plan
+
+        def fake_compile(query):
+            compiled.append(query)
+            return real_compile(query)
+
+        def fake_get_plan(query):
+            evaluate, lookups = real_get_plan(query)
+
+            def counting_evaluate(services):
+                evaluated.append(services)
+                return evaluate(services)
+            return counting_evaluate, lookups
+
+        self.stubs.Set(hf, '_compile', fake_compile)
+        self.stubs.Set(hf, '_get_plan', fake_get_plan)
+        raw = ['and',
+                  ['>=', '$compute.host_memory_free', 70],
+                  ['<', '$compute.disk_available', 1000],
+                  ['=', '$compute.xpu_arch', 'fermi'],
+              ]
+        cooked = json.dumps(raw)
+        hosts = hf.filter_hosts(zm, cooked)
+        self.assertEquals(sorted([host for host, caps in hosts]),
+                          ['host07', 'host09'])
+        # Only host07 to host09 pass both range predicates.
+        self.assertEquals(len(evaluated), 3)
+
+        # The compiled plan is reused and agrees with a full scan.
+        hosts = hf.filter_hosts(self.zone_manager, cooked)
+        self.assertEquals(sorted([host for host, caps in hosts]),
+                          ['host07', 'host09'])
+        self.assertEquals(len(evaluated), 13)
+        self.assertEquals(len(compiled), 4)
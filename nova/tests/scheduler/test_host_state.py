@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For Scheduler host state cache
+"""
+
+import datetime
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import test
+from nova import utils
+from nova.scheduler import driver
+from nova.scheduler import host_state
+
+FLAGS = flags.FLAGS
+
+
+def _service(host, up=True):
+    updated_at = utils.utcnow()
+    if not up:
+        updated_at -= datetime.timedelta(seconds=FLAGS.service_down_time * 2)
+    return {'host': host, 'updated_at': updated_at, 'created_at': updated_at}
+
+
+class HostStateCacheTestCase(test.TestCase):
+    """Test case for HostStateCache"""
+    def setUp(self):
+        super(HostStateCacheTestCase, self).setUp()
+        self.flags(max_cores=4)
+        self.context = context.get_admin_context()
+        self.rows = [(_service('host1'), 0),
+                     (_service('host2'), 1),
+                     (_service('host3'), 2)]
+        self.db_calls = 0
+
+        def fake_service_get_all_compute_sorted(context):
+            self.db_calls += 1
+            return self.rows
+
+        self.stubs.Set(db, 'service_get_all_compute_sorted',
+                       fake_service_get_all_compute_sorted)
+        self.cache = host_state.HostStateCache()
+
+    def test_select_host_spreads_claims(self):
+        hosts = [self.cache.select_host(self.context, 1) for i in xrange(6)]
+        self.assertEqual(hosts, ['host1', 'host1', 'host2', 'host1',
+                                 'host2', 'host3'])
+        self.assertEqual(self.db_calls, 1)
+
+    def test_select_host_too_many_cores(self):
+        self.rows = [(_service('host1'), 4)]
+        self.assertRaises(driver.NoValidHost,
+                          self.cache.select_host, self.context, 1)
+
+    def test_select_host_skips_down_hosts(self):
+        self.rows[0] = (_service('host1', up=False), 0)
+        self.assertEqual(self.cache.select_host(self.context, 1), 'host2')
+        # The skipped host stays in the heap for later requests.
+        self.cache.host_states['host1'].last_capabilities = utils.utcnow()
+        self.assertEqual(self.cache.select_host(self.context, 1), 'host1')
+
+    def test_select_host_no_live_host(self):
+        self.rows = [(_service('host1', up=False), 0)]
+        self.assertEqual(self.cache.select_host(self.context, 1), None)
+
+    def test_capabilities_limit_memory(self):
+        self.cache.reconcile(self.context)
+        self.cache.update_service_capabilities('host1',
+                {'host_memory_free': 512 * 1024 * 1024})
+        self.cache.update_service_capabilities('unknown', {})
+        self.assertEqual(self.cache.select_host(self.context, 1, 1024),
+                         'host2')
+        self.assertEqual(self.cache.select_host(self.context, 1, 512),
+                         'host1')
+        self.assertEqual(self.cache.host_states['host1'].memory_mb_free, 0)
+
+    def test_reconcile_when_stale(self):
+        self.flags(host_state_reconcile_interval=0)
+        self.assertEqual(self.cache.select_host(self.context, 1), 'host1')
+        # The database view replaces the local claim on host1.
+        self.assertEqual(self.cache.select_host(self.context, 1), 'host1')
+        self.assertEqual(self.db_calls, 2)
@@ -61,6 +61,39 @@ class WeightedSumTestCase(test.TestCase):
         expected = [1.5, 2.5, 1.5]
         self.assertEqual(expected, costs)
 
+    def test_vectorized_matches_per_host(self):
+        states = test_abstract_scheduler.fake_zone_manager_service_states(
+            num_hosts=10)
+        hosts = sorted(states.items())
+        calls = []
+
+        def io_cost_fn(host):
+            calls.append(host)
+            hostname, service = host
+            return int(hostname[-2:]) % 3
+
+        weighted_fns = [(1, least_cost.noop_cost_fn),
+                        (3, least_cost.compute_fill_first_cost_fn),
+                        (2, io_cost_fn)]
+        per_host = least_cost.weighted_sum(hosts, weighted_fns,
+                                           vectorize=False)
+        self.assertEqual(len(calls), 10)
+        vector = least_cost.weighted_sum(hosts, weighted_fns)
+        # Only the cost function without a vectorized form ran per host.
+        self.assertEqual(len(calls), 20)
+        self.assertEqual(per_host, vector)
+
+    def test_host_columns(self):
+        hosts = [('host1', {'compute': {'host_memory_free': 10}}),
+                 ('host2', {'compute': {}}),
+                 ('host3', {})]
+        columns = least_cost.HostColumns(hosts)
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(columns.get('compute', 'host_memory_free'),
+                         [10, 0, 0])
+        self.assertEqual(columns.get('compute', 'host_memory_free', None),
+                         [10, None, None])
+
 
 class LeastCostSchedulerTestCase(test.TestCase):
     def setUp(self):
@@ -22,6 +22,7 @@ Tests For Scheduler
 """
 
 import datetime
+import eventlet
 import mox
 import stubout
 
@@ -69,6 +70,12 @@ class TestDriver(driver.Scheduler):
         return 'named_host'
 
 
+class BatchTestDriver(TestDriver):
+    """Scheduler Driver placing whole reservations for Tests"""
+    def schedule_run_instances(self, context, instance_ids, *args, **kwargs):
+        return ['host%s' % instance_id for instance_id in instance_ids]
+
+
 class SchedulerTestCase(test.TestCase):
     """Test case for scheduler"""
     def setUp(self):
@@ -129,6 +136,31 @@ class SchedulerTestCase(test.TestCase):
         self.mox.ReplayAll()
         scheduler.named_method(ctxt, 'topic', num=7)
 
+    def test_run_instances(self):
+        driver = 'nova.tests.scheduler.test_scheduler.BatchTestDriver'
+        scheduler = manager.SchedulerManager(scheduler_driver=driver)
+        self.mox.StubOutWithMock(rpc, 'cast', use_mock_anything=True)
+        ctxt = context.get_admin_context()
+        for instance_id in (1, 2):
+            rpc.cast(ctxt,
+                     'topic.host%s' % instance_id,
+                     {'method': 'run_instance',
+                      'args': {'instance_id': instance_id, 'num': 7}})
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'topic', [1, 2], num=7)
+
+    def test_run_instances_fallback(self):
+        scheduler = manager.SchedulerManager()
+        self.mox.StubOutWithMock(rpc, 'cast', use_mock_anything=True)
+        ctxt = context.get_admin_context()
+        for instance_id in (1, 2):
+            rpc.cast(ctxt,
+                     'topic.fallback_host',
+                     {'method': 'run_instance',
+                      'args': {'instance_id': instance_id, 'num': 7}})
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'topic', [1, 2], num=7)
+
     def test_show_host_resources_host_not_exit(self):
         """A host given as an argument does not exists."""
 
@@ -1398,6 +1430,10 @@ class FakeZonesProxy(object):
     def raises_exception(self, *args, **kwargs):
         raise Exception('testing')
 
+    def sleeps(self, *args, **kwargs):
+        eventlet.sleep(1)
+        return 42
+
 
 class FakeNovaClientZones(object):
     def __init__(self, *args, **kwargs):
@@ -1436,3 +1472,19 @@ class CallZoneMethodTest(test.TestCase):
         context = {}
         method = 'raises_exception'
         self.assertRaises(Exception, api.call_zone_method, context, method)
+
+    def test_call_zone_method_timings(self):
+        timings = {}
+        results = api.call_zone_method({}, 'do_something', timings=timings)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(sorted(timings.keys()), [1, 2])
+        for seconds in timings.values():
+            self.assertTrue(seconds >= 0)
+
+    def test_call_zone_method_timeout(self):
+        self.flags(zone_call_timeout=0.01)
+        timings = {}
+        results = api.call_zone_method({}, 'sleeps', timings=timings)
+        self.assertIn((1, None), results)
+        self.assertIn((2, None), results)
+        self.assertEqual(timings, {1: None, 2: None})
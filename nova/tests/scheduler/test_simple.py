@@ -107,6 +107,62 @@ class SimpleSchedulerTestCase(test.TestCase):
         compute1.kill()
         compute2.kill()
 
+    @attr(kind='small')
+    def test_schedule_run_instance_host_cache(self):
+        """Ensure the host state cache picks the least loaded host"""
+        self.flags(simple_scheduler_host_cache=True)
+        compute1 = self.start_service('compute', host='host1')
+        compute2 = self.start_service('compute', host='host2')
+        instance_id1 = self._create_instance(host='host1', vcpus=2)
+        instance_ids = [self._create_instance() for i in xrange(3)]
+        hosts = [self.scheduler.driver.schedule_run_instance(self.context,
+                                                             instance_id)
+                 for instance_id in instance_ids]
+        self.assertEqual(hosts, ['host2', 'host2', 'host1'])
+        instance = db.instance_get(self.context, instance_ids[0])
+        self.assertEqual(instance['host'], 'host2')
+        for instance_id in [instance_id1] + instance_ids:
+            db.instance_destroy(self.context, instance_id)
+        compute1.kill()
+        compute2.kill()
+
+    @attr(kind='small')
+    def test_schedule_run_instances(self):
+        """Ensure a reservation is spread over hosts in one pass"""
+        compute1 = self.start_service('compute', host='host1')
+        compute2 = self.start_service('compute', host='host2')
+        instance_id1 = self._create_instance(host='host1', vcpus=2)
+        instance_ids = [self._create_instance() for i in xrange(3)]
+        self.mox.StubOutWithMock(db, 'service_get_all_compute_sorted')
+        db.service_get_all_compute_sorted(self.context).AndReturn(
+                db.IMPL.service_get_all_compute_sorted(self.context))
+        self.mox.ReplayAll()
+        hosts = self.scheduler.driver.schedule_run_instances(self.context,
+                                                             instance_ids)
+        self.assertEqual(hosts, ['host2', 'host2', 'host1'])
+        for instance_id, host in zip(instance_ids, hosts):
+            instance = db.instance_get(self.context, instance_id)
+            self.assertEqual(instance['host'], host)
+            self.assertNotEqual(instance['scheduled_at'], None)
+        for instance_id in [instance_id1] + instance_ids:
+            db.instance_destroy(self.context, instance_id)
+        compute1.kill()
+        compute2.kill()
+
+    @attr(kind='small')
+    def test_schedule_run_instances_too_many_cores(self):
+        """Ensure every instance of a failed reservation is in error"""
+        compute1 = self.start_service('compute', host='host1')
+        instance_ids = [self._create_instance(vcpus=2) for i in xrange(3)]
+        self.assertRaises(driver.NoValidHost,
+                          self.scheduler.driver.schedule_run_instances,
+                          self.context, instance_ids)
+        for instance_id in instance_ids:
+            instance = db.instance_get(self.context, instance_id)
+            self.assertEqual(vm_states.ERROR, instance['vm_state'])
+            db.instance_destroy(self.context, instance_id)
+        compute1.kill()
+
     @attr(kind='small')
     def test_schedule_run_instance_database_service_get(self):
         """Ensure raise exception when compute services can not be obtained"""
@@ -31,3 +31,40 @@ class ContextTestCase(test.TestCase):
                                       '222',
                                       roles=['Admin', 'weasel'])
         self.assertEquals(ctxt.is_admin, True)
+
+    def test_cached_loads_once_per_caching_context(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return len(loads)
+
+        ctxt = context.RequestContext('111', '222', cache=True)
+        self.assertEquals(ctxt.cached('instance', 1, load), 1)
+        self.assertEquals(ctxt.cached('instance', 1, load), 1)
+        self.assertEquals(ctxt.cached('instance', 2, load), 2)
+
+        ctxt = context.RequestContext('111', '222')
+        self.assertEquals(ctxt.cached('instance', 1, load), 3)
+        self.assertEquals(ctxt.cached('instance', 1, load), 4)
+
+    def test_invalidate_forgets_cached_values(self):
+        ctxt = context.RequestContext('111', '222', cache=True)
+        ctxt.cached('instance', 1, lambda: 'old')
+        ctxt.cached('project', '222', lambda: 'project')
+        ctxt.invalidate('instance')
+        self.assertEquals(ctxt.cached('instance', 1, lambda: 'new'), 'new')
+        self.assertEquals(ctxt.cached('project', '222', lambda: None),
+                          'project')
+        context.invalidate_cache(ctxt)
+        self.assertEquals(ctxt.cached('project', '222', lambda: None), None)
+        context.invalidate_cache(None)
+
+    def test_elevated_context_invalidates_origin(self):
+        ctxt = context.RequestContext('111', '222', cache=True)
+        ctxt.cached('instance', 1, lambda: 'old')
+        elevated = ctxt.elevated()
+        self.assertEquals(elevated.cached('instance', 1, lambda: 'admin'),
+                          'admin')
+        context.invalidate_cache(elevated, 'instance')
+        self.assertEquals(ctxt.cached('instance', 1, lambda: 'new'), 'new')
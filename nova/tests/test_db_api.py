@@ -29,6 +29,7 @@ from nova import context
 from nova import db
 from nova import exception
 from nova import flags
+from nova import utils
 
 
 from nova.compute import vm_states
@@ -192,6 +193,74 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(result[1].id, inst1.id)
         self.assertTrue(result[1].deleted)
 
+    def test_instance_update_hosts(self):
+        ids = [self.db.instance_create(self.context, {'image_ref': 1})['id']
+               for i in xrange(3)]
+        now = utils.utcnow()
+        self.db.instance_update_hosts(self.context,
+                                      {ids[0]: 'host1', ids[1]: 'host2',
+                                       ids[2]: 'host1'},
+                                      {'scheduled_at': now})
+        hosts = [self.db.instance_get(self.context, instance_id)['host']
+                 for instance_id in ids]
+        self.assertEqual(hosts, ['host1', 'host2', 'host1'])
+        instance = self.db.instance_get(self.context, ids[1])
+        self.assertEqual(instance['scheduled_at'], now)
+
+    def test_instance_get_all_by_filters_limit_and_marker(self):
+        ids = [self.db.instance_create(self.context, {'image_ref': 1})['id']
+               for i in xrange(5)]
+        ids.reverse()
+
+        result = self.db.instance_get_all_by_filters(self.context, {},
+                                                     limit=2)
+        self.assertEqual(ids[:2], [inst['id'] for inst in result])
+
+        result = self.db.instance_get_all_by_filters(self.context, {},
+                                                     marker=ids[1], limit=2)
+        self.assertEqual(ids[2:4], [inst['id'] for inst in result])
+
+        result = self.db.instance_get_all_by_filters(self.context, {},
+                                                     marker=ids[3])
+        self.assertEqual(ids[4:], [inst['id'] for inst in result])
+
+    def test_instance_get_all_by_filters_marker_not_found(self):
+        self.assertRaises(exception.MarkerNotFound,
+                          self.db.instance_get_all_by_filters,
+                          self.context, {}, marker=1234)
+
+    def test_instance_get_all_by_filters_regexp_limit_batches(self):
+        self.flags(instance_query_batch_size=2)
+        for i in xrange(6):
+            self.db.instance_create(self.context,
+                                    {'display_name': 'Server%d' % (i % 2)})
+
+        # LIKE is case insensitive on some backends, the regexp isn't.
+        filters = {'display_name': 'server.*'}
+        result = self.db.instance_get_all_by_filters(self.context, filters)
+        self.assertEqual(0, len(result))
+
+        filters = {'display_name': 'Server1$'}
+        result = self.db.instance_get_all_by_filters(self.context, filters,
+                                                     limit=2)
+        self.assertEqual(2, len(result))
+        for inst in result:
+            self.assertEqual('Server1', inst['display_name'])
+
+    def test_instance_get_all_by_filters_parameter_floating_ip(self):
+        inst1 = self.db.instance_create(self.context, {'image_ref': 1})
+        inst2 = self.db.instance_create(self.context, {'image_ref': 1})
+        _setup_networking(inst1['id'], ip='192.168.100.3',
+                          flo_addr='172.16.0.3')
+
+        filter = {'ip': '^172\\.16\\.0\\.3$'}
+        result = self.db.instance_get_all_by_filters(self.context, filter)
+        self.assertEqual([inst1['id']], [inst['id'] for inst in result])
+
+        filter = {'ip': '192.168.100.'}
+        result = self.db.instance_get_all_by_filters(self.context, filter)
+        self.assertEqual([inst1['id']], [inst['id'] for inst in result])
+
     @attr(kind='small')
     def test_service_destroy(self):
         """
@@ -1329,6 +1398,31 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(100, fixed_ip.network.id)
         self.assertEqual('host1', fixed_ip.host)
 
+    @attr(kind='small')
+    def test_fixed_ip_associate_pool_skips_taken_fixed_ips(self):
+        """
+        fixed_ip_associate_pool does not hand out a fixed ip
+        associated since it read the free ones
+        """
+        # setup
+        self.db.api.instance_create(self.context, {'id': 1})
+        self.db.api.network_create_safe(self.context, {'id': 100})
+        self.db.api.fixed_ip_create(self.context, {'address': '10.1.1.1'})
+        self.db.api.fixed_ip_create(self.context, {'address': '10.1.1.2'})
+        self.db.api.fixed_ip_create(self.context, {'address': '10.1.1.3'})
+        result = self.db.api.fixed_ip_associate_pool(
+                                            self.context, 100, 1, 'host1')
+        self.assertEqual('10.1.1.1', result)
+
+        # test and assert
+        self.db.api.fixed_ip_associate(self.context, '10.1.1.2', 1, 100)
+        result = self.db.api.fixed_ip_associate_pool(
+                                            self.context, 100, 1, 'host1')
+        self.assertEqual('10.1.1.3', result)
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.api.fixed_ip_associate_pool,
+                          self.context,  100, 1, 'host1')
+
     @attr(kind='small')
     def test_fixed_ip_associate_pool_db_not_found(self):
         # test and assert
@@ -1349,6 +1443,26 @@ class DbApiTestCase(test.TestCase):
         self.assertTrue(fixed_ip is not None)
         self.assertEqual('10.1.1.1', fixed_ip.address)
 
+    @attr(kind='small')
+    def test_fixed_ip_bulk_create(self):
+        """
+        fixed_ip_bulk_create
+        """
+        # test and assert
+        self.db.api.fixed_ip_bulk_create(self.context,
+                                         [{'address': '10.1.1.1',
+                                           'reserved': True},
+                                          {'address': '10.1.1.2',
+                                           'reserved': False}])
+
+        fixed_ip = self.db.api.fixed_ip_get_by_address(
+                                            self.context, '10.1.1.1')
+        self.assertTrue(fixed_ip.reserved)
+        self.assertFalse(fixed_ip.deleted)
+        fixed_ip = self.db.api.fixed_ip_get_by_address(
+                                            self.context, '10.1.1.2')
+        self.assertFalse(fixed_ip.reserved)
+
     @attr(kind='small')
     def test_fixed_ip_create_db_duplicate(self):
         # setup
@@ -9406,6 +9520,69 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual('fake', result[0].user_id)
         self.assertEqual('fake', result[0].tenant_id)
 
+    def test_eventlog_create_bulk(self):
+        rows = []
+        for i in xrange(3):
+            rows.append(dict(request_id='1',
+                             message_id=str(i),
+                             event_type='event_type',
+                             publisher_id='compute',
+                             priority='INFO',
+                             status='Success'))
+        rows[2]['user_id'] = 'fake'
+
+        db.api.eventlog_create_bulk(self.context, rows)
+        db.api.eventlog_create_bulk(self.context, [])
+
+        result = db.api.eventlog_get_all_by_request_id(self.context,
+                                                       '1',
+                                                       session=None)
+        self.assertEqual(['0', '1', '2'], [r.message_id for r in result])
+        self.assertEqual([None, None, 'fake'], [r.user_id for r in result])
+        self.assertFalse(result[0].deleted)
+        self.assertNotEqual(None, result[0].created_at)
+
+    def test_eventlog_get_all_marker_and_limit(self):
+        now = utils.utcnow()
+        rows = []
+        for i in xrange(5):
+            rows.append(dict(request_id='1',
+                             message_id=str(i),
+                             priority='INFO',
+                             created_at=now + datetime.timedelta(
+                                     seconds=i / 2)))
+        db.api.eventlog_create_bulk(self.context, rows)
+        all_logs = db.api.eventlog_get_all(self.context, {})
+        ids = [log.id for log in all_logs]
+        self.assertEqual(5, len(ids))
+
+        result = db.api.eventlog_get_all(self.context, {}, limit=2)
+        self.assertEqual(ids[:2], [log.id for log in result])
+        result = db.api.eventlog_get_all(self.context, {}, marker=ids[2],
+                                         limit=10)
+        self.assertEqual(ids[3:], [log.id for log in result])
+        self.assertRaises(exception.MarkerNotFound,
+                          db.api.eventlog_get_all, self.context, {},
+                          marker=ids[-1] + 100)
+
+    def test_eventlog_get_all_before_and_destroy(self):
+        now = utils.utcnow()
+        rows = []
+        for i in xrange(4):
+            rows.append(dict(request_id='1',
+                             message_id=str(i),
+                             created_at=now - datetime.timedelta(days=i)))
+        db.api.eventlog_create_bulk(self.context, rows)
+
+        before = now - datetime.timedelta(hours=12)
+        result = db.api.eventlog_get_all_before(self.context, before, 2)
+        self.assertEqual(['3', '2'], [log.message_id for log in result])
+        db.api.eventlog_destroy_all_by_ids(self.context,
+                                           [log.id for log in result])
+        result = db.api.eventlog_get_all_before(self.context, before, 2)
+        self.assertEqual(['1'], [log.message_id for log in result])
+        self.assertEqual(2, len(db.api.eventlog_get_all(self.context, {})))
+
     def test_eventlog_get_all_by_request_id_not_found(self):
         con = {}
         con['id'] = 1
@@ -0,0 +1,129 @@
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import eventlet
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import test
+from nova import utils
+from nova.ha import eventlog
+
+
+def _values(message_id):
+    return dict(request_id='1',
+                message_id=message_id,
+                event_type='event_type',
+                publisher_id='compute',
+                priority='INFO',
+                status='Success')
+
+
+class EventLogWriterTestCase(test.TestCase):
+    """Test case for the buffered EventLog writer"""
+    def setUp(self):
+        super(EventLogWriterTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.writer = eventlog.EventLogWriter()
+        self.batches = []
+        real_create_bulk = db.eventlog_create_bulk
+
+        def fake_create_bulk(context, values_list):
+            self.batches.append([v['message_id'] for v in values_list])
+            return real_create_bulk(context, values_list)
+
+        self.stubs.Set(db, 'eventlog_create_bulk', fake_create_bulk)
+
+    def test_write_batches(self):
+        self.flags(eventlog_batch_size=2, eventlog_flush_interval=60)
+        for i in xrange(5):
+            self.writer.write(_values(str(i)))
+        self.assertEqual([['0', '1'], ['2', '3']], self.batches)
+        self.assertEqual(1, len(self.writer))
+        self.writer.write(_values('5'), flush=True)
+        self.assertEqual(['4', '5'], self.batches[-1])
+        result = db.eventlog_get_all_by_request_id(self.context, '1')
+        self.assertEqual(6, len(result))
+
+    def test_write_flushes_after_interval(self):
+        self.flags(eventlog_flush_interval=0.01)
+        self.writer.write(_values('0'))
+        self.assertEqual([], self.batches)
+        eventlet.sleep(0.05)
+        self.assertEqual([['0']], self.batches)
+        self.assertEqual('0', db.eventlog_get(self.context, '0').message_id)
+
+    def test_failed_flush_keeps_rows(self):
+        self.flags(eventlog_flush_interval=60, eventlog_queue_size=2)
+
+        def fail_create_bulk(context, values_list):
+            raise exception.DBError()
+
+        self.writer.write(_values('0'))
+        self.writer.write(_values('1'))
+        self.stubs.Set(db, 'eventlog_create_bulk', fail_create_bulk)
+        self.assertRaises(exception.DBError,
+                          self.writer.write, _values('2'))
+        self.assertEqual(2, len(self.writer))
+        self.stubs.UnsetAll()
+        self.writer.write(_values('2'), flush=True)
+        self.assertEqual(0, len(self.writer))
+        result = db.eventlog_get_all_by_request_id(self.context, '1')
+        self.assertEqual(['0', '1', '2'], [r.message_id for r in result])
+
+
+class EventLogArchiveTestCase(test.TestCase):
+    """Test case for archiving aged EventLog rows"""
+    def setUp(self):
+        super(EventLogArchiveTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.path = tempfile.mkdtemp()
+        self.now = utils.utcnow()
+        rows = []
+        for i in xrange(5):
+            values = _values(str(i))
+            values['created_at'] = self.now - datetime.timedelta(days=i)
+            rows.append(values)
+        db.eventlog_create_bulk(self.context, rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(EventLogArchiveTestCase, self).tearDown()
+
+    def test_archive(self):
+        self.flags(eventlog_archive_batch_size=2)
+        before = self.now - datetime.timedelta(hours=12)
+        filename, count = eventlog.archive(self.context, before,
+                                           os.path.join(self.path, 'logs'))
+        self.assertEqual(4, count)
+
+        archived = [json.loads(line) for line in gzip.open(filename)]
+        self.assertEqual(['4', '3', '2', '1'],
+                         [row['message_id'] for row in archived])
+        self.assertEqual(sorted(eventlog.ARCHIVE_FIELDS),
+                         sorted(archived[0].keys()))
+        result = db.eventlog_get_all_by_request_id(self.context, '1')
+        self.assertEqual(['0'], [r.message_id for r in result])
+
+        self.assertEqual((None, 0),
+                         eventlog.archive(self.context, before, self.path))
@@ -19,10 +19,12 @@ import nova
 from nova import context
 from nova import flags
 from nova import log
+from nova.ha import eventlog
 from nova.ha import manager as notifier_manager
 from nova import rpc
 from nova import test
 from nova import db
+from nova import exception
 from nova import utils
 
 
@@ -45,6 +47,7 @@ class HaNotifierTestCase (test.TestCase):
         message['payload'] = {'context': {'request_id': '1'}}
 
         self.manager.notify(message, self.context)
+        eventlog.flush()
 
         result = db.api.eventlog_get(self.context,
                                      '1',
@@ -66,6 +69,7 @@ class HaNotifierTestCase (test.TestCase):
         message['payload'] = {'args': {'instance_id': '1'}}
 
         self.manager.notify(message, self.context)
+        eventlog.flush()
 
         result = db.api.eventlog_get(self.context,
                                      '1',
@@ -531,6 +535,83 @@ class HaNotifierTestCase (test.TestCase):
         self.assertEqual(False, self.mock_cast_flag)
 
 
+class CorrelationWindowTestCase (test.TestCase):
+    """Test case for the HA correlation window"""
+    def setUp(self):
+        super(CorrelationWindowTestCase, self).setUp()
+        self.context = context.RequestContext('fake', 'fake')
+        self.manager = utils.import_object(
+            'nova.ha.manager.NotificatinManager')
+        self.casts = []
+        self.stubs.Set(nova.rpc, 'cast',
+                       lambda context, topic, msg: self.casts.append(topic))
+        self.args1 = '{"args": {"instance_id": 1}, "method": "run_instance"}'
+        for id, event_type, publisher_id in (
+                (1, 'nova.compute.api.API.reboot', 'api'),
+                (2, 'reboot_instance', 'compute01')):
+            db.api.eventlog_create(self.context,
+                                   dict(id=id,
+                                        request_id='1',
+                                        message_id=str(id),
+                                        event_type=event_type,
+                                        publisher_id=publisher_id,
+                                        priority='INFO',
+                                        message=self.args1,
+                                        status='Success',
+                                        user_id='fake',
+                                        tenant_id='fake'))
+        self.lookups = []
+        real_get_all_by_request_id = db.eventlog_get_all_by_request_id
+
+        def fake_get_all_by_request_id(context, request_id, session=None):
+            self.lookups.append(request_id)
+            return real_get_all_by_request_id(context, request_id, session)
+
+        self.stubs.Set(db, 'eventlog_get_all_by_request_id',
+                       fake_get_all_by_request_id)
+
+    def _notify_error(self, message_id):
+        self.manager.notify(dict(message_id=message_id,
+                                 publisher_id='compute01',
+                                 event_type='reboot_instance',
+                                 priority='ERROR',
+                                 payload={'context': {'request_id': '1'}}),
+                            self.context)
+
+    def test_repeated_failures_use_window(self):
+        self._notify_error('3')
+        self._notify_error('4')
+        self.assertEqual(['1'], self.lookups)
+        self.assertEqual(['compute01', 'compute01'], self.casts)
+
+        msg = self.manager.window.get(self.context, '1')
+        self.assertEqual(['1', '2', '3', 'Cleanup', '4', 'Cleanup'],
+                         [log['status'] == 'Cleanup' and 'Cleanup' or
+                          log['message_id'] for log in msg.all()])
+        self.assertEqual(2, len(msg.cause()))
+        self.assertEqual(1, msg.get_instanceId())
+
+    def test_window_expires_and_evicts(self):
+        self.flags(ha_correlation_window_ttl=0)
+        self._notify_error('3')
+        self._notify_error('4')
+        self.assertEqual(['1', '1'], self.lookups)
+
+        self.flags(ha_correlation_window_size=1,
+                   ha_correlation_window_ttl=60)
+        self.assertRaises(exception.EventLogNotFound,
+                          self.manager.window.get, self.context, '2')
+        self.manager.window.get(self.context, '1')
+        self.assertEqual(['1', '1', '2'], self.lookups)
+        db.api.eventlog_create(self.context,
+                               dict(request_id='2', message_id='5',
+                                    message=self.args1))
+        self.manager.window.get(self.context, '2')
+        self.manager.window.get(self.context, '1')
+        self.assertEqual(1, len(self.manager.window))
+        self.assertEqual(['1', '1', '2', '2', '1'], self.lookups)
+
+
 class MessageTestCase (test.TestCase):
     """Test case for Ha Notifications"""
     def setUp(self):
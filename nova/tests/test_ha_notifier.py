@@ -60,6 +60,7 @@ class HaNotifiationTestCase(test.TestCase):
         self.stubs.Set(nova.rpc, 'cast', mock_cast)
 
         self.assertEqual(3, example_api('self_dummy', self.context, 1, 2))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -98,6 +99,7 @@ class HaNotifiationTestCase(test.TestCase):
 
         self.assertEqual(6,
             example_api('self_dummy', self.context, 1, 2, 3, fake=1, fake1=2))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -139,19 +141,22 @@ class HaNotifiationTestCase(test.TestCase):
                                            self.context,
                                            1,
                                            2)
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
-        self.assertEqual('notify', self.msg['method'])
-        self.assertEqual('ERROR',
-            self.msg['args']['message']['priority'])
+        # the call and its error are sent in one batch
+        self.assertEqual('notify_batch', self.msg['method'])
+        messages = self.msg['args']['messages']
+        self.assertEqual(['INFO', 'ERROR'],
+                         [message['priority'] for message in messages])
         self.assertEqual('Test Exception',
-            self.msg['args']['message']['payload']['error'])
+            messages[1]['payload']['error'])
         self.assertEqual([1, 2],
-            self.msg['args']['message']['payload']['args'])
+            messages[1]['payload']['args'])
         self.assertEqual({},
-            self.msg['args']['message']['payload']['kwarg'])
+            messages[1]['payload']['kwarg'])
         self.assertEqual(True,
-            'context' in self.msg['args']['message']['payload'])
+            'context' in messages[1]['payload'])
 
     def test_notification_by_api_decorator_error_param(self):
 
@@ -179,6 +184,7 @@ class HaNotifiationTestCase(test.TestCase):
 
         self.assertEqual(1,
             example_api('self_dummy'))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -248,6 +254,7 @@ class HaNotifiationTestCase(test.TestCase):
 
         self.assertEqual(1,
             example_api('self_dummy', 'self_dummy1', self.context))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -292,6 +299,7 @@ class HaNotifiationTestCase(test.TestCase):
             example_api('self_dummy', self.context, 1, 2, 3,
                                          fake=1,
                                          fake1=example_class()))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -336,6 +344,7 @@ class HaNotifiationTestCase(test.TestCase):
             example_api('self_dummy', self.context, example_class(), 2, 3,
                                          fake=1,
                                          fake1=example_class()))
+        notifier.NOTIFICATIONS.flush()
         self.assertEqual(True, self.mock_cast_flag)
         self.assertEqual('notifications', self.topic)
         self.assertEqual('notify', self.msg['method'])
@@ -348,6 +357,76 @@ class HaNotifiationTestCase(test.TestCase):
         self.assertEqual(True,
             'context' in self.msg['args']['message']['payload'])
 
+    def test_notification_sent_inline_without_queue(self):
+        self.flags(api_notification_queue_size=0,
+                   notification_driver='nova.ha.notifier')
+        self.msgs = []
+
+        def example_api(self_dummy, context, args1):
+            return args1
+
+        example_api = nova.ha.notifier.api_decorator('example_api',
+                                                     example_api)
+        self.stubs.Set(nova.rpc, 'cast',
+                       lambda context, topic, msg: self.msgs.append(msg))
+
+        self.assertEqual(1, example_api('self_dummy', self.context, 1))
+        self.assertEqual(1, len(self.msgs))
+        self.assertEqual([1],
+            self.msgs[0]['args']['message']['payload']['args'])
+
+    def test_notification_dropped_when_queue_full(self):
+        self.flags(api_notification_queue_size=2,
+                   notification_driver='nova.ha.notifier')
+        self.stubs.Set(notifier, 'NOTIFICATIONS',
+                       notifier.ApiNotifications())
+        self.msgs = []
+
+        def example_api(self_dummy, context, args1):
+            return args1
+
+        example_api = nova.ha.notifier.api_decorator('example_api',
+                                                     example_api)
+        self.stubs.Set(nova.rpc, 'cast',
+                       lambda context, topic, msg: self.msgs.append(msg))
+
+        for x in xrange(3):
+            example_api('self_dummy', self.context, x)
+        self.assertEqual([], self.msgs)
+        notifier.NOTIFICATIONS.flush()
+        self.assertEqual(1, notifier.NOTIFICATIONS.dropped)
+        self.assertEqual(1, len(self.msgs))
+        self.assertEqual('notify_batch', self.msgs[0]['method'])
+        self.assertEqual([[0], [1]],
+            [message['payload']['args']
+             for message in self.msgs[0]['args']['messages']])
+
+    def test_notification_has_arguments_before_the_call(self):
+        self.flags(notification_driver='nova.ha.notifier')
+        self.msgs = []
+
+        def example_api(self_dummy, context, names, metadata=None):
+            names.append('added')
+            metadata['added'] = True
+
+        example_api = nova.ha.notifier.api_decorator('example_api',
+                                                     example_api)
+        self.stubs.Set(nova.rpc, 'cast',
+                       lambda context, topic, msg: self.msgs.append(msg))
+
+        example_api('self_dummy', self.context, ['name'],
+                    metadata={'key': 'value'})
+        notifier.NOTIFICATIONS.flush()
+        payload = self.msgs[0]['args']['message']['payload']
+        self.assertEqual([['name']], payload['args'])
+        self.assertEqual({'metadata': {'key': 'value'}}, payload['kwarg'])
+
+    def test_unserializable_value_does_not_taint_its_type(self):
+        self.assertFalse(notifier._serializable('\xff'))
+        self.assertEqual({'args': ['instance-1'], 'kwarg': {'name': 'x'}},
+                         notifier._payload(None, ['instance-1'],
+                                           {'name': 'x'}, None))
+
 
 class PublishErrorsHandlerTestCase(test.TestCase):
     """Test for nova.log.PublishErrorsHandler. """
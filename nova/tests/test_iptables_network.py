@@ -162,3 +162,55 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('-A %s -j run_tests.py-%s' \
                             % (chain, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+    def _fake_execute(self, loaded):
+        self.commands = []
+
+        def fake_execute(*cmd, **kwargs):
+            self.commands.append(cmd[0])
+            if cmd[0].endswith('-save'):
+                self.saved = cmd[2]
+                return '\n'.join(loaded[self.saved]), ''
+            loaded[self.saved] = kwargs['process_input'].split('\n')
+            return '', ''
+
+        self.manager.execute = fake_execute
+
+    def test_deferred_apply_restores_once(self):
+        self.flags(use_ipv6=False)
+        self._fake_execute({'filter': self.sample_filter,
+                            'nat': self.sample_nat})
+        self.manager.defer_apply_on()
+        self.manager.defer_apply_on()
+        self.manager.apply()
+        self.manager.apply()
+        self.manager.defer_apply_off()
+        self.assertEqual([], self.commands)
+        self.manager.defer_apply_off()
+        self.assertEqual(['iptables-save', 'iptables-restore'] * 2,
+                         self.commands)
+
+        self.commands = []
+        self.manager.defer_apply_on()
+        self.manager.defer_apply_off()
+        self.assertEqual([], self.commands)
+
+    def test_apply_skips_restore_of_loaded_table(self):
+        self.flags(use_ipv6=False)
+        table = self.manager.ipv4['filter']
+        loaded = {'filter': self.manager._modify_rules(self.sample_filter,
+                                                       table),
+                  'nat': self.manager._modify_rules(self.sample_nat,
+                                                    self.manager.ipv4['nat'])}
+        # counters change all the time
+        loaded['filter'] = [line.replace('[2223527:305688874]', '[1:2]')
+                            for line in loaded['filter']]
+        self._fake_execute(loaded)
+        self.manager.apply()
+        self.assertEqual(['iptables-save'] * 2, self.commands)
+
+        table.add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.commands = []
+        self.manager.apply()
+        self.assertEqual(['iptables-restore', 'iptables-save',
+                          'iptables-save'], sorted(self.commands))
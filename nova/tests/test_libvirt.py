@@ -1234,6 +1234,74 @@ class IptablesFirewallTestCase(test.TestCase):
                         "TCP port 80/81 acceptance rule wasn't added")
         db.instance_destroy(admin_ctxt, instance_ref['id'])
 
+    def test_ipset_security_group_members(self):
+        self.flags(use_ipset=True)
+        instance_ref = self._create_instance_ref()
+        src_instance_ref = self._create_instance_ref()
+        _setup_networking(src_instance_ref['id'], '10.11.12.14')
+
+        admin_ctxt = context.get_admin_context()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 22,
+                                       'to_port': 22,
+                                       'group_id': src_secgroup['id']})
+        db.instance_add_security_group(admin_ctxt, instance_ref['id'],
+                                       secgroup['id'])
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['id'],
+                                       src_secgroup['id'])
+
+        ipset_input = []
+
+        def fake_ipset_execute(*cmd, **kwargs):
+            self.assertEqual(('ipset', '-exist', 'restore'), cmd)
+            ipset_input.append(kwargs['process_input'].split('\n'))
+            return '', ''
+
+        from nova.network import linux_net
+        self.fw.ipset = linux_net.IpsetManager(execute=fake_ipset_execute)
+
+        set_name = 'nova-sg-%s' % src_secgroup['id']
+        ipv4_rules, _ipv6_rules = self.fw.instance_rules(instance_ref,
+                                                  _create_network_info())
+        self.assertTrue('-j ACCEPT -p tcp --dport 22 -m set --match-set '
+                        '%s src' % set_name in ipv4_rules)
+        self.assertFalse([rule for rule in ipv4_rules
+                          if '10.11.12.14' in rule])
+        self.assertTrue('add %s-new 10.11.12.14' % set_name
+                        in ipset_input[0])
+        self.assertTrue('swap %s-new %s' % (set_name, set_name)
+                        in ipset_input[0])
+
+        # A new member only changes the set, no chain is rebuilt
+        new_instance_ref = self._create_instance_ref()
+        _setup_networking(new_instance_ref['id'], '10.11.12.15',
+                          '56:12:12:12:12:14')
+        db.instance_add_security_group(admin_ctxt, new_instance_ref['id'],
+                                       src_secgroup['id'])
+        self.mox.StubOutWithMock(self.fw,
+                                 'do_refresh_security_group_members')
+        self.mox.StubOutWithMock(self.fw.iptables, 'schedule_apply')
+        self.mox.ReplayAll()
+        self.fw.refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(['add %s 10.11.12.15' % set_name, ''],
+                         ipset_input[1])
+
+        # Groups no rule matches have no set to update
+        self.fw.refresh_security_group_members(secgroup['id'])
+        self.assertEqual(2, len(ipset_input))
+
     def test_filters_for_instance_with_ip_v6(self):
         self.flags(use_ipv6=True)
         network_info = _create_network_info()
@@ -1278,6 +1346,57 @@ class IptablesFirewallTestCase(test.TestCase):
         self.mox.ReplayAll()
         self.fw.do_refresh_security_group_rules("fake")
 
+    def _create_security_group(self, name):
+        admin_ctxt = context.get_admin_context()
+        return db.security_group_create(admin_ctxt,
+                                        {'user_id': 'fake',
+                                         'project_id': 'fake',
+                                         'name': name,
+                                         'description': name})
+
+    def test_refresh_security_group_rules_of_its_instances(self):
+        admin_ctxt = context.get_admin_context()
+        instance_ref = self._create_instance_ref()
+        other_instance_ref = self._create_instance_ref()
+        secgroup = self._create_security_group('testgroup')
+        other_secgroup = self._create_security_group('othergroup')
+        db.instance_add_security_group(admin_ctxt, instance_ref['id'],
+                                       secgroup['id'])
+        db.instance_add_security_group(admin_ctxt, other_instance_ref['id'],
+                                       other_secgroup['id'])
+        self.fw.prepare_instance_filter(instance_ref, _create_network_info())
+        self.fw.prepare_instance_filter(other_instance_ref,
+                                        _create_network_info())
+
+        self.mox.StubOutWithMock(self.fw, 'add_filters_for_instance')
+        self.fw.add_filters_for_instance(instance_ref)
+        self.mox.ReplayAll()
+        self.fw.do_refresh_security_group_rules(secgroup['id'])
+
+    def test_security_group_rules_cached_until_refresh(self):
+        admin_ctxt = context.get_admin_context()
+        instance_ref = self._create_instance_ref()
+        secgroup = self._create_security_group('testgroup')
+        db.instance_add_security_group(admin_ctxt, instance_ref['id'],
+                                       secgroup['id'])
+        self.fw.prepare_instance_filter(instance_ref, _create_network_info())
+
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 22,
+                                       'to_port': 22,
+                                       'cidr': '192.168.11.0/24'})
+        rule = '-j ACCEPT -p tcp --dport 22 -s 192.168.11.0/24'
+        ipv4_rules, _ipv6_rules = self.fw.instance_rules(
+                instance_ref, _create_network_info())
+        self.assertFalse(rule in ipv4_rules)
+
+        self.fw.do_refresh_security_group_rules(secgroup['id'])
+        ipv4_rules, _ipv6_rules = self.fw.instance_rules(
+                instance_ref, _create_network_info())
+        self.assertTrue(rule in ipv4_rules)
+
     def test_unfilter_instance_undefines_nwfilter(self):
         # Skip if non-libvirt environment
         if not self.lazy_load_library_exists():
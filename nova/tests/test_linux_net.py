@@ -198,6 +198,7 @@ class LinuxNetworkTestCase(test.TestCase):
         network_driver = FLAGS.network_driver
         self.driver = utils.import_object(network_driver)
         self.driver.db = db
+        self.stubs.Set(linux_net, 'dhcp_hosts', linux_net.DhcpHosts())
 
     def test_update_dhcp_for_nw00(self):
         self.flags(use_single_default_gateway=True)
@@ -285,6 +286,55 @@ class LinuxNetworkTestCase(test.TestCase):
 
         self.assertEquals(actual_hosts, expected)
 
+    def test_dhcp_hosts_update_reads_updated_fixed_ips(self):
+        self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
+        self.mox.StubOutWithMock(db, 'network_get_fixed_ips_updated_since')
+        db.network_get_associated_fixed_ips(mox.IgnoreArg(),
+                                            mox.IgnoreArg())\
+                                            .AndReturn([fixed_ips[0]])
+        db.network_get_fixed_ips_updated_since(mox.IgnoreArg(),
+                                               mox.IgnoreArg(),
+                                               mox.IgnoreArg())\
+                                               .AndReturn([])
+        released = dict(fixed_ips[0], deleted=False, instance_id=None)
+        allocated = dict(fixed_ips[3], deleted=False)
+        db.network_get_fixed_ips_updated_since(mox.IgnoreArg(),
+                                               mox.IgnoreArg(),
+                                               mox.IgnoreArg())\
+                                               .AndReturn([released,
+                                                           allocated])
+        self.mox.ReplayAll()
+
+        dhcp_hosts = linux_net.DhcpHosts()
+        self.assertTrue(dhcp_hosts.update(None, 'eth0', networks[0]))
+        self.assertFalse(dhcp_hosts.update(None, 'eth0', networks[0]))
+        self.assertTrue(dhcp_hosts.update(None, 'eth0', networks[0]))
+        self.assertEqual({'192.168.1.101':
+                              self.driver._host_dhcp(fixed_ips[3])},
+                         dhcp_hosts.hosts['eth0'])
+
+    def test_dhcp_hosts_reload_coalesces_hups(self):
+        self.flags(dnsmasq_hup_interval=10)
+        executes = []
+        scheduled = []
+
+        def fake_execute(*args, **kwargs):
+            executes.append(args)
+
+        def fake_spawn_after(seconds, func, *args):
+            scheduled.append((func, args))
+            return object()
+
+        self.stubs.Set(linux_net, '_execute', fake_execute)
+        self.stubs.Set(linux_net.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        dhcp_hosts = linux_net.DhcpHosts()
+        dhcp_hosts.reload('eth0', 42)
+        dhcp_hosts.reload('eth0', 42)
+        dhcp_hosts.reload('eth0', 42)
+        self.assertEqual([('kill', '-HUP', 42)], executes)
+        self.assertEqual(1, len(scheduled))
+
     def test_get_dhcp_opts_for_nw00(self):
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
         self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instance')
@@ -125,3 +125,37 @@ class SchedulerDependentManagerTestCase(test.TestCase):
         self.assertEqual('testhost', self._host)
         self.assertEqual(capabilities, self._capabilities)
         self.assertEqual(1, self._count)
+
+    @attr(kind='small')
+    def test_periodic_tasks_capability_deltas(self):
+        """Test for nova.manager.SchedulerDependentManager.periodic_tasks
+        with capabilities_full_update_interval. """
+        self.flags(capabilities_full_update_interval=3)
+        sent = []
+
+        def stub_update_service_capabilities(context, service_name, host,
+                                             capabilities, sequence):
+            sent.append(('full', dict(capabilities), sequence))
+
+        def stub_update_service_capabilities_delta(context, service_name,
+                                                   host, changed, removed,
+                                                   sequence):
+            sent.append(('delta', changed, removed, sequence))
+
+        self.stubs.Set(manager.api, "update_service_capabilities",
+                                    stub_update_service_capabilities)
+        self.stubs.Set(manager.api, "update_service_capabilities_delta",
+                                    stub_update_service_capabilities_delta)
+
+        capabilities = {'a': 1, 'b': 2}
+        self.manager.update_service_capabilities(capabilities)
+        self.manager.periodic_tasks()
+        capabilities['a'] = 5
+        del capabilities['b']
+        self.manager.periodic_tasks()
+        self.manager.periodic_tasks()
+        self.manager.periodic_tasks()
+        self.assertEqual([('full', {'a': 1, 'b': 2}, 1),
+                          ('delta', {'a': 5}, ['b'], 2),
+                          ('delta', {}, [], 3),
+                          ('full', {'a': 5}, 4)], sent)
@@ -38,7 +38,7 @@ USER_DATA_STRING = ("This is an encoded string")
 ENCODE_USER_DATA_STRING = base64.b64encode(USER_DATA_STRING)
 
 
-def return_non_existing_server_by_address(context, address):
+def return_non_existing_server_by_address(context, address, **kwargs):
     raise exception.NotFound()
 
 
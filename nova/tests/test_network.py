@@ -1786,7 +1786,7 @@ class FlatNetworkTestCase(test.TestCase):
         """
         following process continues even when network creation failed
         """
-        def stub_fixed_ip_create(context, values):
+        def stub_fixed_ip_bulk_create(context, ips):
             pass
 
         self._network_create_count = 0
@@ -1801,7 +1801,7 @@ class FlatNetworkTestCase(test.TestCase):
         self.mox.StubOutWithMock(db, 'network_get_all')
         self.mox.StubOutWithMock(db, 'network_get')
         self.stubs.Set(db, 'network_create_safe', stub_network_create_safe)
-        self.stubs.Set(db, 'fixed_ip_create', stub_fixed_ip_create)
+        self.stubs.Set(db, 'fixed_ip_bulk_create', stub_fixed_ip_bulk_create)
         db.network_get_all(mox.IgnoreArg()).AndReturn([])
         db.network_get(mox.IgnoreArg(),
                        mox.IgnoreArg()).AndReturn(networks[0])
@@ -1814,22 +1814,21 @@ class FlatNetworkTestCase(test.TestCase):
         self.assertEqual(2, self._network_create_count)
 
     @attr(kind='small')
-    def test_create_networks_ex_db_fixed_ip_create(self):
+    def test_create_networks_ex_db_fixed_ip_bulk_create(self):
         """
         NetworkCreateException is raised
-        when DBError occurred in db.fixed_ip_create()
+        when DBError occurred in db.fixed_ip_bulk_create()
         """
-        self._fixed_ip_create_count = 0
+        self._ips = None
 
-        def stub_fixed_ip_create(context, values):
-            self._fixed_ip_create_count += 1
-            if self._fixed_ip_create_count == 1:
-                raise exception.DBError('DBError occurred')
+        def stub_fixed_ip_bulk_create(context, ips):
+            self._ips = ips
+            raise exception.DBError('DBError occurred')
 
         self.mox.StubOutWithMock(db, 'network_get_all')
         self.mox.StubOutWithMock(db, 'network_create_safe')
         self.mox.StubOutWithMock(db, 'network_get')
-        self.stubs.Set(db, 'fixed_ip_create', stub_fixed_ip_create)
+        self.stubs.Set(db, 'fixed_ip_bulk_create', stub_fixed_ip_bulk_create)
         db.network_get_all(mox.IgnoreArg()).AndReturn([])
         db.network_create_safe(mox.IgnoreArg(),
                                mox.IgnoreArg()).AndReturn(networks[0])
@@ -1842,7 +1841,11 @@ class FlatNetworkTestCase(test.TestCase):
         self.assertRaises(exception.NetworkCreateException,
                           self.network.create_networks,
                           *args)
-        self.assertEqual(256, self._fixed_ip_create_count)
+        self.assertEqual(256, len(self._ips))
+        self.assertEqual({'network_id': networks[0]['id'],
+                          'address': '192.168.0.0',
+                          'reserved': True}, self._ips[0])
+        self.assertFalse(self._ips[10]['reserved'])
 
     @attr(kind='small')
     def test_delete_network_db_network_is_disassociated(self):
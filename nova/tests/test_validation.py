@@ -217,3 +217,33 @@ class ValidationFrameworkTestCase(test.TestCase):
 
         self.assertEqual(func('bar'), ('bar',))
         self.assertRaises(AssertionError, func, 'foo')
+
+    def test_conflict_found_on_apply(self):
+        class OtherFooCondition(validation.Validator):
+            def validate_foo(self, value):
+                pass
+
+        @validation.function(FooCondition, OtherFooCondition)
+        def func(foo):
+            return foo
+
+        self.assertRaises(validation.ConflictError, validation.apply)
+
+    def test_validations_collected_once(self):
+        calls = []
+
+        class ACondition(validation.Validator):
+            def validate_foo(self, value):
+                calls.append(value)
+
+        @validation.function(ACondition)
+        def func(foo):
+            return foo
+
+        validation.apply()
+
+        self.stubs.Set(validation.inspect, 'getmembers',
+                       lambda *args: self.fail('introspected per call'))
+        self.assertEqual(func('foo'), 'foo')
+        self.assertEqual(func(foo='bar'), 'bar')
+        self.assertEqual(calls, ['foo', 'bar'])
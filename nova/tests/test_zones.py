@@ -182,6 +182,27 @@ class ZoneManagerTestCase(test.TestCase):
         self.assertEquals(zone_state.attempt, 0)
         self.assertEquals(zone_state.name, 'zohan')
 
+    def test_poll_zone_records_latency(self):
+        self.stubs.Set(zone_manager, "_call_novaclient",
+                       lambda zone: dict(name='zohan'))
+        zm = zone_manager.ZoneManager()
+        zone_state = zone_manager.ZoneState()
+        zone_state.update_credentials(FakeZone(id=2,
+                       api_url='http://foo.com', username='user2',
+                       password='pass2'))
+        zm.zone_states[2] = zone_state
+
+        zone_manager._poll_zone(zone_state)
+        zm.record_zone_latencies({2: 0.5, 3: 0.1})
+        zm.record_zone_latencies({2: None})
+        zones = zm.get_zone_list()
+        self.assertEquals(len(zones), 1)
+        self.assertEquals(zones[0]['call_count'], 3)
+        self.assertEquals(zones[0]['timeout_count'], 1)
+        self.assertEquals(zones[0]['latency_last'], 0.5)
+        self.assertEquals(zones[0]['latency_max'], 0.5)
+        self.assertTrue(zones[0]['latency_average'] <= 0.5)
+
     def test_poll_zone_fails(self):
         self.stubs.Set(zone_manager, "_call_novaclient", exploding_novaclient)
 
@@ -265,6 +286,37 @@ class ZoneManagerTestCase(test.TestCase):
         self.assertFalse("host1" in zm.service_states)
         self.assertFalse("host2" in zm.service_states)
 
+    def test_capability_index(self):
+        zm = zone_manager.ZoneManager()
+        zm.update_service_capabilities("svc1", "host1", dict(a=1, b='x'))
+        zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
+        zm.update_service_capabilities("svc1", "host3", dict(a=5, b=6))
+        index = zm.capability_index
+        self.assertEquals(index.hosts_in_range("svc1", "a", lower=3),
+                          set(["host2", "host3"]))
+        self.assertEquals(index.hosts_in_range("svc1", "a", lower=3,
+                                               include_lower=False),
+                          set(["host3"]))
+        self.assertEquals(index.hosts_in_range("svc1", "a", upper=3),
+                          set(["host1", "host2"]))
+        self.assertEquals(index.hosts_in_range("svc1", "a", lower=2,
+                                               upper=4),
+                          set(["host2"]))
+        # Values that cannot be ordered always remain candidates.
+        self.assertEquals(index.hosts_in_range("svc1", "b", lower=5),
+                          set(["host1", "host3"]))
+        self.assertEquals(index.hosts_in_range("svc1", "c", lower=5),
+                          set())
+
+        zm.update_service_capabilities("svc1", "host3", dict(a=2))
+        self.assertEquals(index.hosts_in_range("svc1", "a", lower=3),
+                          set(["host2"]))
+        self.assertEquals(index.hosts_in_range("svc1", "b"),
+                          set(["host1", "host2"]))
+        zm.delete_expired_host_services({"host2": ["svc1"]})
+        self.assertEquals(index.hosts_in_range("svc1", "a"),
+                          set(["host1", "host3"]))
+
     def test_get_zone_capabilities_one_host(self):
         zm = zone_manager.ZoneManager()
 
@@ -299,11 +351,11 @@ class ZoneManagerTestCase(test.TestCase):
         expiry_time = (FLAGS.periodic_interval * 3) + 1
 
         # One host service capabilities become stale
+        past = utils.utcnow() - datetime.timedelta(seconds=expiry_time)
+        utils.set_time_override(past)
         zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2))
+        utils.clear_time_override()
         zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
-        serv_caps = zm.service_states["host1"]["svc1"]
-        serv_caps["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, dict(svc1_a=(3, 3), svc1_b=(4, 4)))
 
@@ -324,16 +376,13 @@ class ZoneManagerTestCase(test.TestCase):
         expiry_time = (FLAGS.periodic_interval * 3) + 1
 
         # Two host services among four become stale
+        past = utils.utcnow() - datetime.timedelta(seconds=expiry_time)
         zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2))
+        zm.update_service_capabilities("svc2", "host2", dict(a=7, b=8))
+        utils.set_time_override(past)
         zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
         zm.update_service_capabilities("svc2", "host1", dict(a=5, b=6))
-        zm.update_service_capabilities("svc2", "host2", dict(a=7, b=8))
-        serv_caps_1 = zm.service_states["host1"]["svc2"]
-        serv_caps_1["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
-        serv_caps_2 = zm.service_states["host2"]["svc1"]
-        serv_caps_2["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
+        utils.clear_time_override()
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, dict(svc1_a=(1, 1), svc1_b=(2, 2),
                                      svc2_a=(7, 7), svc2_b=(8, 8)))
@@ -343,19 +392,13 @@ class ZoneManagerTestCase(test.TestCase):
         expiry_time = (FLAGS.periodic_interval * 3) + 1
 
         # Three host services among four become stale
+        past = utils.utcnow() - datetime.timedelta(seconds=expiry_time)
         zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2))
+        utils.set_time_override(past)
         zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
         zm.update_service_capabilities("svc2", "host1", dict(a=5, b=6))
         zm.update_service_capabilities("svc2", "host2", dict(a=7, b=8))
-        serv_caps_1 = zm.service_states["host1"]["svc2"]
-        serv_caps_1["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
-        serv_caps_2 = zm.service_states["host2"]["svc1"]
-        serv_caps_2["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
-        serv_caps_3 = zm.service_states["host2"]["svc2"]
-        serv_caps_3["timestamp"] = utils.utcnow() - \
-                               datetime.timedelta(seconds=expiry_time)
+        utils.clear_time_override()
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, dict(svc1_a=(1, 1), svc1_b=(2, 2)))
 
@@ -372,3 +415,106 @@ class ZoneManagerTestCase(test.TestCase):
         utils.set_time_override(time_future)
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, {})
+
+    def test_service_capabilities_delta(self):
+        zm = zone_manager.ZoneManager()
+        zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2), 1)
+        zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
+        zm.update_service_capabilities_delta("svc1", "host1", dict(a=5, c=6),
+                                             ["b"], 2)
+        caps = zm.service_states["host1"]["svc1"]
+        self.assertEquals(dict(a=5, c=6),
+                          dict((k, v) for k, v in caps.iteritems()
+                               if k != "timestamp"))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(3, 5), svc1_b=(4, 4),
+                               svc1_c=(6, 6)))
+        self.assertEquals(set(["host1"]),
+                          zm.capability_index.hosts_in_range("svc1", "a",
+                                                             lower=4))
+        self.assertEquals(set(), zm.capability_index.hosts_in_range(
+                "svc1", "b", upper=2))
+
+        # Deltas that skip an update, or have no snapshot, are ignored
+        zm.update_service_capabilities_delta("svc1", "host1", dict(a=7),
+                                             [], 4)
+        zm.update_service_capabilities_delta("svc1", "host1", dict(a=8),
+                                             [], 5)
+        zm.update_service_capabilities_delta("svc1", "host2", dict(a=9),
+                                             [], 1)
+        self.assertEquals(zm.get_zone_capabilities(None)["svc1_a"], (3, 5))
+        zm.update_service_capabilities("svc1", "host1", dict(a=1), 6)
+        zm.update_service_capabilities_delta("svc1", "host1", dict(a=2),
+                                             [], 7)
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(2, 3), svc1_b=(4, 4)))
+
+    def test_service_capabilities_coalesced(self):
+        self.flags(capabilities_coalesce_window=60)
+        zm = zone_manager.ZoneManager()
+        zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2), 1)
+        zm.update_service_capabilities_delta("svc1", "host1", dict(a=3),
+                                             ["b"], 2)
+        zm.update_service_capabilities_delta("svc1", "host1", dict(b=4),
+                                             [], 3)
+        self.assertEquals({}, zm.service_states)
+        self.mox.StubOutWithMock(zm, '_set_service_capabilities')
+        zm._set_service_capabilities("host1", "svc1", dict(a=3, b=4))
+        self.mox.ReplayAll()
+        zm.flush_capability_updates()
+        self.mox.VerifyAll()
+        self.assertEquals(None, zm._flush_timer)
+
+    def test_get_zone_capabilities_rescans(self):
+        # Hosts reporting the same values again, or ties with a bound
+        # going away, don't make the bounds be rescanned
+        scans = []
+        scan = zone_manager.CapabilityRange._scan
+
+        def counting_scan(capability_range):
+            scans.append(capability_range)
+            scan(capability_range)
+
+        self.stubs.Set(zone_manager.CapabilityRange, '_scan', counting_scan)
+        zm = zone_manager.ZoneManager()
+        for x in xrange(3):
+            zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2))
+            zm.update_service_capabilities("svc1", "host2", dict(a=1, b=4))
+            self.assertEquals(zm.get_zone_capabilities(None),
+                              dict(svc1_a=(1, 1), svc1_b=(2, 4)))
+        self.assertEquals(2, len(scans))
+
+        zm.update_service_capabilities("svc1", "host1", dict(a=3, b=2))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(1, 3), svc1_b=(2, 4)))
+        self.assertEquals(2, len(scans))
+        zm.update_service_capabilities("svc1", "host2", dict(a=1, b=3))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(1, 3), svc1_b=(2, 3)))
+        self.assertEquals(3, len(scans))
+
+    def test_get_zone_capabilities_incremental(self):
+        zm = zone_manager.ZoneManager()
+
+        # The rollup follows updates, disabling and expiry of services
+        zm.update_service_capabilities("svc1", "host1", dict(a=1, b=2))
+        zm.update_service_capabilities("svc1", "host2", dict(a=3, b=4))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(1, 3), svc1_b=(2, 4)))
+        zm.update_service_capabilities("svc1", "host1", dict(a=5))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(3, 5), svc1_b=(4, 4)))
+        zm.update_service_capabilities("svc1", "host2",
+                                       dict(a=0, enabled=False))
+        self.assertEquals(zm.get_zone_capabilities(None),
+                          dict(svc1_a=(5, 5)))
+
+        expiry_time = (FLAGS.periodic_interval * 3) + 1
+        time_future = utils.utcnow() + datetime.timedelta(seconds=expiry_time)
+        utils.set_time_override(time_future)
+        zm.update_service_capabilities("svc2", "host2", dict(c=7))
+        self.assertEquals(zm.get_zone_capabilities(None), dict(svc2_c=(7, 7)))
+        utils.clear_time_override()
+        self.assertFalse("host1" in zm.service_states)
+        # Disabled services are never expired
+        self.assertTrue("svc1" in zm.service_states["host2"])
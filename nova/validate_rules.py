@@ -31,6 +31,7 @@ from nova import image
 from nova import utils
 from nova.context import RequestContext
 from nova.compute import power_state, vm_states, task_states
+from nova.compute.utils import instance_get_cached
 from nova import log as logger
 
 
@@ -81,7 +82,8 @@ class ProjectRequire(BaseValidator):
         driver = utils.import_class(FLAGS.auth_driver)
         if driver is not None:
             drv = driver()
-            project = drv.get_project(project_id)
+            project = self.context.cached('project', project_id,
+                    lambda: drv.get_project(project_id))
             if project is None:
                 raise exception.ProjectNotFound(project_id=project_id)
 
@@ -94,10 +96,7 @@ class InstanceRequire(BaseValidator):
     Require the 'instance_id' parameter.
     """
     def validate_instance_id(self, instance_id):
-        if utils.is_uuid_like(instance_id):
-            db.instance_get_by_uuid(self.context, instance_id)
-        else:
-            db.instance_get(self.context, instance_id)
+        instance_get_cached(db, self.context, instance_id)
 
 
 class InstanceRequireAPI(BaseValidator):
@@ -121,10 +120,7 @@ class InstanceRequireAPI(BaseValidator):
                 raise webob.exc.HTTPBadRequest(
                                     explanation='Instance id is not integer')
         try:
-            if utils.is_uuid_like(instance_id):
-                db.instance_get_by_uuid(self.context, instance_id)
-            else:
-                db.instance_get(self.context, instance_id)
+            instance_get_cached(db, self.context, instance_id)
         except exception.InstanceNotFound as e:
             LOG.info(e)
             raise webob.exc.HTTPNotFound(explanation=str(e))
@@ -139,10 +135,7 @@ class InstanceCanSnapshot(BaseValidator):
     """
     def validate_instance_id(self, instance_id):
         try:
-            if utils.is_uuid_like(instance_id):
-                instance = db.instance_get_by_uuid(self.context, instance_id)
-            else:
-                instance = db.instance_get(self.context, instance_id)
+            instance = instance_get_cached(db, self.context, instance_id)
             vm = instance["vm_state"]
             task = instance["task_state"]
             if vm == vm_states.ACTIVE and task is None:
@@ -206,7 +199,7 @@ class InstanceRunningRequire(BaseValidator):
     Require the 'instance_id' parameter.
     """
     def validate_instance_id(self, instance_id):
-        instance = db.instance_get(self.context, instance_id)
+        instance = instance_get_cached(db, self.context, instance_id)
         if instance["power_state"] != power_state.RUNNING:
             raise exception.InstanceNotRunning(instance_id=instance_id)
 
@@ -220,10 +213,7 @@ class InstanceCanReboot(BaseValidator):
     """
     def validate_instance_id(self, instance_id):
         try:
-            if utils.is_uuid_like(instance_id):
-                instance = db.instance_get_by_uuid(self.context, instance_id)
-            else:
-                instance = db.instance_get(self.context, instance_id)
+            instance = instance_get_cached(db, self.context, instance_id)
             # ACTIVE/NONE or ACTIVE/REBOOTING only allow.
             if instance["vm_state"] == vm_states.ACTIVE:
                 if instance["task_state"] is None or\
@@ -248,10 +238,7 @@ class InstanceCanDestroy(BaseValidator):
     """
     def validate_instance_id(self, instance_id):
         try:
-            if utils.is_uuid_like(instance_id):
-                instance = db.instance_get_by_uuid(self.context, instance_id)
-            else:
-                instance = db.instance_get(self.context, instance_id)
+            instance = instance_get_cached(db, self.context, instance_id)
             # ACTIVE/REBOOTING, BUILDING/DELETING, ACTIVE/IMAGE_SNAPSHOT,
             # ACTIVE/DELETING or DELETED/None -> Forbidden
             if (instance["vm_state"], instance["task_state"]) in\
@@ -45,6 +45,14 @@ def apply():
         filter.apply()
 
 
+def _is_validation(method):
+    """
+    True when a method which the name starts with 'validate_'.
+    """
+    return (inspect.ismethod(method) \
+            and method.im_func.func_name.startswith('validate_'))
+
+
 class Validator(object):
     """
     Validator.
@@ -75,12 +83,13 @@ class Validator(object):
         """
         True when a method which the name starts with 'validate_'.
         """
-        return (inspect.ismethod(method) \
-                and method.im_func.func_name.startswith('validate_'))
+        return _is_validation(method)
 
     def validations(self):
         """
         Returns validation which is method prefixed with 'validation_'.
+
+        Filter finds these once when applied, unless this is overridden.
         """
         validation_map = {}
         for (method_name, method) in inspect.getmembers(self,
@@ -158,72 +167,67 @@ class Filter(object):
 
         def _f(*args, **kwargs):
             # Do not do anything if apply() is not called yet.
-            if getattr(self, 'args', None) is not None:
-                v_args = list(args)
-                v_kwargs = dict(kwargs)
-                # Unshift first as self.
-                if self.method:
-                    v_args = v_args[1:]
-
-                # the name value mapper for validator.
-                params = {}
-                # weave runtime parameter names and values.
-                if not (len(self.args) == len(v_args) or
-                        len(self.args) + len(self.defaults) > len(v_args)):
-                    raise TypeError("Number of arguments is different.")
-                for (i, name) in enumerate(self.args):
-                    if len(v_args) > 0:
-                        params[name] = v_args.pop(0)
-
-                defaults = list(self.defaults)
-                # weave defaults
-                while v_args and defaults:
-                    (key, _value) = defaults.pop(0)
-                    v_kwargs[key] = v_args.pop(0)
-                # set rest defaults
-                for key, value in defaults:
-                    v_kwargs.setdefault(key, value)
-                params.update(v_kwargs)
-
-                # apply resolver
-                params = self.resolver.resolve_parameter(params)
-                # make valiation map at each calling.
-                validators = []
-                validate_map = {}
-                exception_handlers = {}
-                for validator_class in self.validators:
-                    validator = validator_class(self.target, *args, **kwargs)
-                    validator._config(self._config)
-                    validators.append(validator)
-                    for names, validation in validator.validations().items():
-                        if names in validate_map:
-                            raise ConflictError(
-                                "Validation exists for '%s'" % names)
-                        validate_map[names] = validation
-                        exception_handlers[names] = validator.handle_exception
-
-                # publish params
-                for validator in validators:
-                    validator.params = params
-                # do validation
-                validated_names = set()
-                for names, validation in validate_map.items():
-                    target_params = []
-                    for name in names:
-                        if name in params:
-                            target_params.append(params[name])
-                        validated_names.add(name)
-                    try:
-                        validation(*target_params)
-                    except Exception as ex:
-                        exception_handlers[names](ex)
-
-                for name in set(params) - validated_names:
-                    LOG.debug("No validator for '%s'" % name)
-
+            if self.args is not None:
+                self.validate(args, kwargs)
             return self.target(*args, **kwargs)
         return _f
 
+    def validate(self, args, kwargs):
+        """Run the validations compiled by apply() for one call."""
+        v_args = args[1:] if self.method else args
+        if not (len(self.args) == len(v_args) or
+                len(self._names) > len(v_args)):
+            raise TypeError("Number of arguments is different.")
+        # the name value mapper for validator.
+        params = dict(self.defaults)
+        params.update(zip(self._names, v_args))
+        params.update(kwargs)
+
+        # apply resolver
+        params = self.resolver.resolve_parameter(params)
+
+        validators = []
+        for validator_class in self.validators:
+            validator = validator_class(self.target, *args, **kwargs)
+            validator._config(self._config)
+            validator.params = params
+            validators.append(validator)
+
+        plan = self._plan
+        validated_names = self._validated_names
+        if self._dynamic:
+            plan = list(plan)
+            validated_names = set(validated_names)
+            self._plan_dynamic(validators, plan, validated_names)
+
+        # do validation
+        for index, names, validation, bound in plan:
+            validator = validators[index]
+            target_params = [params[name] for name in names
+                             if name in params]
+            try:
+                if bound:
+                    validation(*target_params)
+                else:
+                    validation(validator, *target_params)
+            except Exception as ex:
+                validator.handle_exception(ex)
+
+        if LOG.isEnabledFor(logging.DEBUG):
+            for name in set(params) - validated_names:
+                LOG.debug("No validator for '%s'" % name)
+
+    def _plan_dynamic(self, validators, plan, validated_names):
+        """Add the validations of validators overriding validations()."""
+        keys = set(self._keys)
+        for index in self._dynamic:
+            for names, validation in validators[index].validations().items():
+                if names in keys:
+                    raise ConflictError("Validation exists for '%s'" % names)
+                keys.add(names)
+                validated_names.update(names)
+                plan.append((index, names, validation, True))
+
     def apply(self):
         for validator in self.validators:
             if not inspect.isclass(validator):
@@ -243,4 +247,37 @@ class Filter(object):
             # Unshift first as self.
             args = args[1:]
 
+        # positional values are for the arguments, then the defaults.
+        self._names = args + [key for key, _value in self.defaults]
+        self._compile()
         self.args = args
+
+    def _compile(self):
+        """
+        Collect the validations of every validator class once.
+
+        The plan is a list of (validator index, param names, function,
+        bound). Validators which override validations() are asked for
+        theirs at each call.
+        """
+        self._plan = []
+        self._dynamic = []
+        self._keys = set()
+        self._validated_names = set()
+        for index, validator_class in enumerate(self.validators):
+            if (validator_class.validations.im_func is not
+                    Validator.validations.im_func):
+                self._dynamic.append(index)
+                continue
+            for method_name, method in inspect.getmembers(validator_class,
+                                                          _is_validation):
+                names = (method_name.replace('validate_', ''),)
+                if names in self._keys:
+                    raise ConflictError("Validation exists for '%s'" % names)
+                self._keys.add(names)
+                self._validated_names.update(names)
+                if method.im_self is None:
+                    self._plan.append((index, names, method.im_func, False))
+                else:
+                    # classmethod
+                    self._plan.append((index, names, method, True))
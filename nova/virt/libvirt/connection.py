@@ -102,6 +102,10 @@ flags.DEFINE_string('libvirt_uri',
 flags.DEFINE_bool('allow_same_net_traffic',
                   True,
                   'Whether to allow network traffic from same network')
+flags.DEFINE_bool('use_ipset',
+                  False,
+                  'Whether IptablesFirewallDriver matches the members of '
+                  'source security groups with one ipset per group')
 flags.DEFINE_bool('use_cow_images',
                   True,
                   'Whether to use cow images')
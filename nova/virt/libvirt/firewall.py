@@ -22,6 +22,7 @@ from eventlet import tpool
 
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
@@ -507,8 +508,20 @@ class IptablesFirewallDriver(FirewallDriver):
     def __init__(self, execute=None, **kwargs):
         from nova.network import linux_net
         self.iptables = linux_net.iptables_manager
+        self.ipset = linux_net.ipset_manager
         self.instances = {}
         self.network_infos = {}
+        # { instance id : ids of its security groups }
+        self.instance_security_groups = {}
+        # { instance id : ids of the security groups its rules grant }
+        self.instance_grantee_groups = {}
+        # The same two indexes, from security group id to instance ids
+        self.security_group_instances = {}
+        self.grantee_group_instances = {}
+        # { security group id : its rules }, until a refresh of the group
+        self.security_group_rules = {}
+        # { instance id : fixed addresses }, during a refresh only
+        self._fixed_addresses = None
         self.nwfilter = NWFilterFirewall(kwargs['get_connection'])
         self.basicly_filtered = False
 
@@ -534,6 +547,7 @@ class IptablesFirewallDriver(FirewallDriver):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
             self.remove_filters_for_instance(instance)
+            self._unindex_instance(instance['id'])
             self.iptables.apply()
             self.nwfilter.unfilter_instance(instance, network_info)
         else:
@@ -591,6 +605,8 @@ class IptablesFirewallDriver(FirewallDriver):
 
     def instance_rules(self, instance, network_info):
         ctxt = context.get_admin_context()
+        instance_id = instance['id']
+        grantee_groups = set()
 
         ipv4_rules = []
         ipv6_rules = []
@@ -638,15 +654,15 @@ class IptablesFirewallDriver(FirewallDriver):
                 for cidrv6 in cidrv6s:
                     ipv6_rules.append('-s %s -j ACCEPT' % (cidrv6,))
 
-        security_groups = db.security_group_get_by_instance(ctxt,
-                                                            instance['id'])
+        security_group_ids = self.instance_security_groups.get(instance_id)
+        if security_group_ids is None:
+            security_group_ids = [security_group['id'] for security_group in
+                    db.security_group_get_by_instance(ctxt, instance_id)]
+        rules_by_group = self._security_group_rules(ctxt, security_group_ids)
 
         # then, security group chains and rules
-        for security_group in security_groups:
-            rules = db.security_group_rule_get_by_security_group(ctxt,
-                                                          security_group['id'])
-
-            for rule in rules:
+        for security_group_id in security_group_ids:
+            for rule in rules_by_group[security_group_id]:
                 LOG.debug(_('Adding security group rule: %r'), rule)
 
                 if not rule.cidr:
@@ -699,9 +715,19 @@ class IptablesFirewallDriver(FirewallDriver):
                     fw_rules += [' '.join(args)]
                 else:
                     if rule['grantee_group']:
+                        grantee_groups.add(rule['grantee_group']['id'])
+                    if rule['grantee_group'] and FLAGS.use_ipset:
+                        grantee_group = rule['grantee_group']
+                        self._update_security_group_set(ctxt, grantee_group)
+                        set_name = self._security_group_set_name(
+                                grantee_group['id'])
+                        subrule = args + ['-m set --match-set %s src' %
+                                          (set_name,)]
+                        fw_rules += [' '.join(subrule)]
+                    elif rule['grantee_group']:
                         for instance in rule['grantee_group']['instances']:
                             LOG.info('instance: %r', instance)
-                            ips = db.instance_get_fixed_addresses(ctxt,
+                            ips = self._instance_fixed_addresses(ctxt,
                                                                 instance['id'])
                             LOG.info('ips: %r', ips)
                             for ip in ips:
@@ -712,30 +738,169 @@ class IptablesFirewallDriver(FirewallDriver):
         ipv4_rules += ['-j $sg-fallback']
         ipv6_rules += ['-j $sg-fallback']
 
+        self._index_instance(instance_id, security_group_ids, grantee_groups)
         return ipv4_rules, ipv6_rules
 
+    def _security_group_rules(self, ctxt, security_group_ids):
+        """Rules of each security group, loading the uncached ones at once."""
+        missing = [security_group_id
+                   for security_group_id in security_group_ids
+                   if security_group_id not in self.security_group_rules]
+        if missing:
+            loaded = dict((security_group_id, [])
+                          for security_group_id in missing)
+            for rule in db.security_group_rule_get_by_security_groups(ctxt,
+                                                                  missing):
+                loaded[rule['parent_group_id']].append(rule)
+            self.security_group_rules.update(loaded)
+        return dict((security_group_id,
+                     self.security_group_rules[security_group_id])
+                    for security_group_id in security_group_ids)
+
+    def _instance_fixed_addresses(self, ctxt, instance_id):
+        """Fixed addresses of an instance, looked up once per refresh."""
+        if self._fixed_addresses is None:
+            return db.instance_get_fixed_addresses(ctxt, instance_id)
+        if instance_id not in self._fixed_addresses:
+            self._fixed_addresses[instance_id] = \
+                    db.instance_get_fixed_addresses(ctxt, instance_id)
+        return self._fixed_addresses[instance_id]
+
+    def _index_instance(self, instance_id, security_group_ids,
+                        grantee_group_ids):
+        self._index(self.instance_security_groups,
+                    self.security_group_instances,
+                    instance_id, security_group_ids)
+        self._index(self.instance_grantee_groups,
+                    self.grantee_group_instances,
+                    instance_id, grantee_group_ids)
+
+    def _unindex_instance(self, instance_id):
+        self._index(self.instance_security_groups,
+                    self.security_group_instances, instance_id, ())
+        self._index(self.instance_grantee_groups,
+                    self.grantee_group_instances, instance_id, ())
+        self.instance_security_groups.pop(instance_id)
+        self.instance_grantee_groups.pop(instance_id)
+
+    def _index(self, groups_by_instance, instances_by_group, instance_id,
+               group_ids):
+        """Record group_ids as the groups of instance_id, both ways.
+
+        Cached rules of groups no instance is in any more are dropped.
+
+        """
+        old_group_ids = groups_by_instance.get(instance_id, ())
+        groups_by_instance[instance_id] = group_ids
+        for group_id in set(old_group_ids) - set(group_ids):
+            instance_ids = instances_by_group[group_id]
+            instance_ids.discard(instance_id)
+            if not instance_ids:
+                del instances_by_group[group_id]
+                if group_id not in self.security_group_instances:
+                    self.security_group_rules.pop(group_id, None)
+        for group_id in group_ids:
+            instances_by_group.setdefault(group_id, set()).add(instance_id)
+
+    def _update_security_group_set(self, ctxt, security_group):
+        """Make the ipset of security_group hold its members' addresses."""
+        addresses = []
+        for instance in security_group['instances']:
+            addresses += self._instance_fixed_addresses(ctxt, instance['id'])
+        self.ipset.set_members(
+                self._security_group_set_name(security_group['id']),
+                addresses)
+
     def instance_filter_exists(self, instance, network_info):
         """Check nova-instance-instance-xxx exists"""
         return self.nwfilter.instance_filter_exists(instance, network_info)
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        # The cached rules granting the group carry its old members
+        for security_group_id, rules in self.security_group_rules.items():
+            for rule in rules:
+                if rule['group_id'] == security_group:
+                    del self.security_group_rules[security_group_id]
+                    break
+        if FLAGS.use_ipset:
+            self.refresh_security_group_set(security_group)
+            return
+        self.do_refresh_security_group_members(security_group)
+        self.iptables.schedule_apply()
+
+    def refresh_security_group_set(self, security_group_id):
+        """Update the ipset of a security group in place.
+
+        The rules matching the set stay as they are, and groups none of
+        our instances match do not have a set to update.
+
+        """
+        if security_group_id not in self.grantee_group_instances:
+            return
+        ctxt = context.get_admin_context()
+        try:
+            security_group = db.security_group_get(ctxt, security_group_id)
+        except exception.SecurityGroupNotFound:
+            security_group = {'id': security_group_id, 'instances': []}
+        self._update_security_group_set(ctxt, security_group)
 
     def refresh_security_group_rules(self, security_group):
         self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        self.iptables.schedule_apply()
 
     @utils.synchronized('iptables', external=True)
     def do_refresh_security_group_rules(self, security_group):
-        for instance in self.instances.values():
-            self.remove_filters_for_instance(instance)
-            self.add_filters_for_instance(instance)
+        """Rebuild the chains of the instances in security_group.
+
+        Instances may also have just joined or left the group, so its
+        members are looked up again.
+
+        """
+        self.security_group_rules.pop(security_group, None)
+        instance_ids = set(self.security_group_instances.get(security_group,
+                                                             ()))
+        ctxt = context.get_admin_context()
+        try:
+            members = db.security_group_get(ctxt, security_group)['instances']
+        except exception.SecurityGroupNotFound:
+            members = []
+        member_ids = set(instance['id'] for instance in members)
+        instance_ids.update(member_ids)
+        for instance_id in instance_ids:
+            if instance_id not in self.instance_security_groups:
+                continue
+            security_group_ids = [security_group_id for security_group_id
+                                  in self.instance_security_groups[instance_id]
+                                  if security_group_id != security_group]
+            if instance_id in member_ids:
+                security_group_ids.append(security_group)
+            self._index(self.instance_security_groups,
+                        self.security_group_instances,
+                        instance_id, security_group_ids)
+        self._refresh_instances(instance_ids)
+
+    @utils.synchronized('iptables', external=True)
+    def do_refresh_security_group_members(self, security_group):
+        """Rebuild the chains of the instances granting security_group."""
+        self._refresh_instances(self.grantee_group_instances.get(
+                security_group, ()))
+
+    def _refresh_instances(self, instance_ids):
+        """Rebuild the chains of instance_ids and of unindexed instances."""
+        self._fixed_addresses = {}
+        try:
+            for instance_id, instance in self.instances.items():
+                if (instance_id in instance_ids or
+                    instance_id not in self.instance_security_groups):
+                    self.remove_filters_for_instance(instance)
+                    self.add_filters_for_instance(instance)
+        finally:
+            self._fixed_addresses = None
 
     def refresh_provider_fw_rules(self):
         """See class:FirewallDriver: docs."""
         self._do_refresh_provider_fw_rules()
-        self.iptables.apply()
+        self.iptables.schedule_apply()
 
     @utils.synchronized('iptables', external=True)
     def _do_refresh_provider_fw_rules(self):
@@ -814,5 +979,8 @@ class IptablesFirewallDriver(FirewallDriver):
     def _security_group_chain_name(self, security_group_id):
         return 'nova-sg-%s' % (security_group_id,)
 
+    def _security_group_set_name(self, security_group_id):
+        return 'nova-sg-%s' % (security_group_id,)
+
     def _instance_chain_name(self, instance):
         return 'inst-%s' % (instance['id'],)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare the per-host and vectorized weighted_sum() paths of the
+LeastCostScheduler.
+
+    python tools/benchmarks/least_cost.py [--repeat N] [hosts ...]
+"""
+
+import gettext
+from optparse import OptionParser
+import os
+import random
+import sys
+import timeit
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.scheduler import least_cost
+
+
+def make_hosts(num_hosts):
+    """Fake ZoneManager host list in weigh_hosts() form."""
+    hosts = []
+    for x in xrange(num_hosts):
+        caps = {'host_memory_free': random.randint(1, 64) * 1024 ** 3,
+                'host_memory_total': 64 * 1024 ** 3,
+                'disk_available': random.randint(1, 2000) * 1024 ** 3}
+        hosts.append(('host%05d' % x, {'compute': caps}))
+    return hosts
+
+
+@least_cost.vectorized(
+        lambda columns: columns.get('compute', 'disk_available'))
+def compute_fill_first_disk_cost_fn(host):
+    hostname, service = host
+    return service.get('compute', {}).get('disk_available', 0)
+
+
+WEIGHTED_FNS = [(1, least_cost.noop_cost_fn),
+                (2, least_cost.compute_fill_first_cost_fn),
+                (1, compute_fill_first_disk_cost_fn)]
+
+
+def main():
+    parser = OptionParser(usage='%prog [--repeat N] [hosts ...]')
+    parser.add_option('--repeat', type='int', default=20,
+                      help='weighings per measurement (default: %default)')
+    options, args = parser.parse_args()
+    sizes = [int(arg) for arg in args] or [100, 1000, 10000]
+
+    print '%8s %14s %14s %8s' % ('hosts', 'per-host (ms)', 'vector (ms)',
+                                 'speedup')
+    for num_hosts in sizes:
+        hosts = make_hosts(num_hosts)
+        results = []
+        for vectorize in (False, True):
+            timer = timeit.Timer(lambda: least_cost.weighted_sum(
+                    hosts, WEIGHTED_FNS, vectorize=vectorize))
+            best = min(timer.repeat(3, options.repeat)) / options.repeat
+            results.append(best * 1000)
+        print '%8d %14.3f %14.3f %7.1fx' % (num_hosts, results[0],
+                                            results[1],
+                                            results[0] / results[1])
+
+
+if __name__ == '__main__':
+    main()
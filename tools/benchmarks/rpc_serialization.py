@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare encode/decode time and bytes on the wire of the rpc serializers,
+with and without compression, on representative nova messages.
+
+    python tools/benchmarks/rpc_serialization.py [--repeat N] [--nics N]
+"""
+
+import gettext
+from optparse import OptionParser
+import os
+import sys
+import timeit
+import uuid
+import zlib
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.rpc import common as rpc_common
+
+
+def with_context(msg):
+    """Add the _context_* keys every rpc message carries."""
+    msg.update({'_context_request_id': str(uuid.uuid4()),
+                '_context_user_id': 'fake_user',
+                '_context_project_id': 'fake_project',
+                '_context_is_admin': False,
+                '_context_read_deleted': False,
+                '_context_remote_address': '10.0.0.1',
+                '_context_roles': ['projectmanager', 'netadmin'],
+                '_context_timestamp': '2011-09-01T12:00:00.000000',
+                '_context_strategy': 'noauth',
+                '_msg_id': uuid.uuid4().hex})
+    return msg
+
+
+def nw_info_reply(nics):
+    """get_instance_nw_info result for an instance with several nics."""
+    result = []
+    for x in xrange(nics):
+        network = {'bridge': 'br%d' % (100 + x),
+                   'id': x + 1,
+                   'cidr': '10.%d.0.0/24' % x,
+                   'cidr_v6': 'fd00:%x::/64' % x,
+                   'injected': False,
+                   'multi_host': True,
+                   'vlan': 100 + x}
+        info = {'label': 'project_net_%d' % x,
+                'gateway': '10.%d.0.1' % x,
+                'broadcast': '10.%d.0.255' % x,
+                'mac': '02:16:3e:00:00:%02x' % x,
+                'rxtx_cap': 0,
+                'dns': ['8.8.8.8', '8.8.4.4'],
+                'ips': [{'ip': '10.%d.0.%d' % (x, y + 2),
+                         'netmask': '255.255.255.0',
+                         'enabled': '1'} for y in xrange(2)],
+                'ip6s': [{'ip': 'fd00:%x::216:3eff:fe00:%x' % (x, x),
+                          'netmask': 64,
+                          'enabled': '1'}],
+                'gateway6': 'fd00:%x::1' % x,
+                'dhcp_server': '10.%d.0.1' % x,
+                'should_create_bridge': True,
+                'should_create_vlan': True}
+        result.append((network, info))
+    return {'result': result, 'failure': None}
+
+
+def capabilities_cast():
+    """update_service_capabilities cast from a libvirt compute node."""
+    cpu_info = {'arch': 'x86_64', 'model': 'Nehalem', 'vendor': 'Intel',
+                'topology': {'sockets': 2, 'cores': 6, 'threads': 2},
+                'features': ['rdtscp', 'dca', 'xtpr', 'tm2', 'est', 'vmx',
+                             'ds_cpl', 'monitor', 'pbe', 'tm', 'ht', 'ss',
+                             'acpi', 'ds', 'vme', 'pdcm', 'popcnt', 'sse4.2',
+                             'sse4.1', 'cx16', 'ssse3', 'lahf_lm']}
+    capabilities = {'vcpus': 24, 'vcpus_used': 7,
+                    'memory_mb': 96 * 1024, 'memory_mb_used': 30 * 1024,
+                    'host_memory_total': 96 * 1024 ** 3,
+                    'host_memory_free': 66 * 1024 ** 3,
+                    'local_gb': 2000, 'local_gb_used': 300,
+                    'disk_available': 1700 * 1024 ** 3,
+                    'hypervisor_type': 'QEMU', 'hypervisor_version': 12001,
+                    'cpu_info': rpc_common.SERIALIZERS['json'].dumps(
+                            cpu_info)}
+    return with_context({'method': 'update_service_capabilities',
+                         'args': {'service_name': 'compute',
+                                  'host': 'compute-0042',
+                                  'capabilities': capabilities}})
+
+
+def run_instance_cast():
+    """run_instance cast from the scheduler to a compute node."""
+    instance = {'id': 4242, 'uuid': str(uuid.uuid4()),
+                'image_ref': '2', 'kernel_id': '3', 'ramdisk_id': '4',
+                'instance_type_id': 5, 'vcpus': 2, 'memory_mb': 4096,
+                'local_gb': 40, 'user_id': 'fake_user',
+                'project_id': 'fake_project', 'display_name': u'web-01',
+                'display_description': u'web server',
+                'key_data': 'ssh-rsa ' + 'A' * 372 + ' user@host',
+                'metadata': {'role': 'web', 'tier': 'front'},
+                'availability_zone': 'nova', 'launch_index': 0,
+                'reservation_id': 'r-abcdef12'}
+    return with_context({'method': 'run_instance',
+                         'args': {'instance_id': 4242,
+                                  'request_spec': {
+                                      'instance_properties': instance,
+                                      'instance_type': {'name': 'm1.medium',
+                                                        'memory_mb': 4096,
+                                                        'vcpus': 2,
+                                                        'local_gb': 40},
+                                      'num_instances': 1},
+                                  'injected_files': [],
+                                  'admin_password': 'secret'}})
+
+
+def security_group_cast():
+    """One of the refresh_security_group_rules fan-out casts."""
+    return with_context({'method': 'refresh_security_group_rules',
+                         'args': {'security_group_id': 17}})
+
+
+def codecs():
+    """(name, encode, decode) of every serializer, plain and compressed."""
+    def _compressed(serializer):
+        return (serializer.name + rpc_common.COMPRESSED_SUFFIX,
+                lambda data: zlib.compress(serializer.dumps(data)),
+                lambda body: serializer.loads(zlib.decompress(body)))
+
+    for name in sorted(rpc_common.SERIALIZERS):
+        serializer = rpc_common.SERIALIZERS[name]
+        yield serializer.name, serializer.dumps, serializer.loads
+        yield _compressed(serializer)
+
+
+def main():
+    parser = OptionParser(usage='%prog [--repeat N] [--nics N]')
+    parser.add_option('--repeat', type='int', default=2000,
+                      help='encodings per measurement (default: %default)')
+    parser.add_option('--nics', type='int', default=4,
+                      help='nics in the nw_info reply (default: %default)')
+    options, args = parser.parse_args()
+    if rpc_common.msgpack is None:
+        print 'msgpack is not installed, comparing json only\n'
+
+    messages = [('nw_info reply', nw_info_reply(options.nics)),
+                ('capabilities', capabilities_cast()),
+                ('run_instance', run_instance_cast()),
+                ('sg refresh', security_group_cast())]
+    print '%-14s %-14s %8s %12s %12s' % ('message', 'codec', 'bytes',
+                                         'encode (us)', 'decode (us)')
+    for label, msg in messages:
+        for name, encode, decode in codecs():
+            body = encode(msg)
+            results = []
+            for timer in (timeit.Timer(lambda: encode(msg)),
+                          timeit.Timer(lambda: decode(body))):
+                best = min(timer.repeat(3, options.repeat)) / options.repeat
+                results.append(best * 1000000)
+            print '%-14s %-14s %8d %12.1f %12.1f' % (label, name, len(body),
+                                                     results[0], results[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure rpc throughput, latency and memory per in-flight call of the rpc
+backends, using the fake backend and kombu's (or carrot's) in-memory
+transport, so it runs offline on one box.
+
+    python tools/benchmarks/rpc_throughput.py [--messages N]
+        [--concurrency N] [--nics N] [backend ...]
+
+Backends are fake, kombu and carrot (default: fake kombu).  For every
+backend cast, call, multicall and fanout_cast are sent with representative
+nova payloads, and messages per second and p50/p99 latency are reported.
+Casts are timed until they are sent, and counted as done once handled.
+Memory per in-flight call is counted from the python objects that appear
+while --concurrency calls are being handled at once, so it includes the
+consumer side.
+"""
+
+import gc
+import gettext
+from optparse import OptionParser
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+import eventlet
+from eventlet import event
+from eventlet import greenpool
+
+from nova import context
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+# The directory of this script is on sys.path, so the payloads of the
+# serialization benchmark can be shared.
+import rpc_serialization
+
+FLAGS = flags.FLAGS
+TOPIC = 'rpc_benchmark'
+
+
+class BenchmarkReceiver(object):
+    """Handles the benchmark messages the way a nova manager would."""
+
+    def __init__(self, nw_info):
+        self.nw_info = nw_info
+        self.handled = 0
+        self.expected = None
+        self.done = None
+        self.in_flight = 0
+        self.hold = None
+
+    def expect(self, count):
+        self.handled = 0
+        self.expected = count
+        self.done = event.Event()
+
+    def _handled(self):
+        self.handled += 1
+        if self.handled == self.expected:
+            self.done.send()
+
+    def run_instance(self, context, **kwargs):
+        self._handled()
+
+    def update_service_capabilities(self, context, **kwargs):
+        self._handled()
+
+    def get_instance_nw_info(self, context, instance_id):
+        if self.hold is not None:
+            self.in_flight += 1
+            self.hold.wait()
+            self.in_flight -= 1
+        self._handled()
+        return self.nw_info
+
+    def get_instance_nw_info_by_nic(self, context, instance_id):
+        """multicall flavour of get_instance_nw_info."""
+        for nic in self.nw_info:
+            yield nic
+        self._handled()
+
+
+def objects_size(objects):
+    """Bytes used by objects and by the strings and numbers they refer to."""
+    seen = set()
+    size = 0
+    for obj in objects:
+        size += sys.getsizeof(obj)
+        for referent in gc.get_referents(obj):
+            if not gc.is_tracked(referent) and id(referent) not in seen:
+                seen.add(id(referent))
+                size += sys.getsizeof(referent)
+    return size
+
+
+def percentile(latencies, percent):
+    return latencies[int(round((len(latencies) - 1) * percent / 100.0))]
+
+
+def messages():
+    """(operation, method, args) of each benchmarked operation."""
+    run_instance = rpc_serialization.run_instance_cast()['args']
+    capabilities = rpc_serialization.capabilities_cast()['args']
+    return [('cast', 'run_instance', run_instance),
+            ('call', 'get_instance_nw_info', {'instance_id': 4242}),
+            ('multicall', 'get_instance_nw_info_by_nic',
+             {'instance_id': 4242}),
+            ('fanout_cast', 'update_service_capabilities', capabilities)]
+
+
+def send(rpc, ctxt, operation, method, args):
+    msg = {'method': method, 'args': args}
+    if operation == 'multicall':
+        return list(rpc.multicall(ctxt, TOPIC, msg))
+    return getattr(rpc, operation)(ctxt, TOPIC, msg)
+
+
+def run_operation(rpc, receiver, ctxt, operation, method, args, options):
+    """Return (messages per second, latencies in ms) of one operation."""
+    latencies = []
+
+    def _send():
+        start = time.time()
+        send(rpc, ctxt, operation, method, args)
+        latencies.append((time.time() - start) * 1000)
+
+    receiver.expect(options.messages)
+    pool = greenpool.GreenPool(options.concurrency)
+    start = time.time()
+    for x in xrange(options.messages):
+        pool.spawn_n(_send)
+    pool.waitall()
+    with eventlet.Timeout(60):
+        receiver.done.wait()
+    elapsed = time.time() - start
+    latencies.sort()
+    return options.messages / elapsed, latencies
+
+
+def memory_per_call(rpc, receiver, ctxt, options):
+    """(objects, bytes) per call while --concurrency calls are held.
+
+    These are the objects tracked by the garbage collector that appear
+    while the calls are in flight, with the strings and numbers they refer
+    to.  Unlike the resident set this is not rounded to whole pages, but
+    memory outside python objects, such as greenlet stacks and socket
+    buffers, is left out.
+    """
+    receiver.expect(options.concurrency)
+    receiver.hold = event.Event()
+    gc.collect()
+    before = set(id(obj) for obj in gc.get_objects())
+    before.add(id(before))
+    pool = greenpool.GreenPool(options.concurrency)
+    for x in xrange(options.concurrency):
+        pool.spawn_n(send, rpc, ctxt, 'call', 'get_instance_nw_info',
+                     {'instance_id': 4242})
+    with eventlet.Timeout(60):
+        while receiver.in_flight < options.concurrency:
+            eventlet.sleep(0.01)
+    gc.collect()
+    held = [obj for obj in gc.get_objects() if id(obj) not in before]
+    count, size = len(held), objects_size(held)
+    del held
+    receiver.hold.send()
+    pool.waitall()
+    receiver.hold = None
+    return (float(count) / options.concurrency,
+            float(size) / options.concurrency)
+
+
+def run_backend(backend, options):
+    rpc = utils.import_object('nova.rpc.impl_%s' % backend)
+    receiver = BenchmarkReceiver(
+            rpc_serialization.nw_info_reply(options.nics)['result'])
+    conn = rpc.create_connection(new=True)
+    conn.create_consumer(TOPIC, receiver, fanout=False)
+    if backend != 'fake':
+        # impl_fake fans out to every consumer of the topic already
+        conn.create_consumer(TOPIC, receiver, fanout=True)
+    conn.consume_in_thread()
+    ctxt = context.get_admin_context()
+    try:
+        # Warm up connection pools and queue declarations
+        send(rpc, ctxt, 'call', 'get_instance_nw_info', {'instance_id': 1})
+        for operation, method, args in messages():
+            rate, latencies = run_operation(rpc, receiver, ctxt, operation,
+                                            method, args, options)
+            print '%-8s %-12s %10.0f %10.3f %10.3f' % (
+                    backend, operation, rate, percentile(latencies, 50),
+                    percentile(latencies, 99))
+        return memory_per_call(rpc, receiver, ctxt, options)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = OptionParser(usage='%prog [--messages N] [--concurrency N] '
+                                '[--nics N] [backend ...]')
+    parser.add_option('--messages', type='int', default=2000,
+                      help='messages per operation (default: %default)')
+    parser.add_option('--concurrency', type='int', default=50,
+                      help='messages in flight at once (default: %default)')
+    parser.add_option('--nics', type='int', default=4,
+                      help='nics in the nw_info replies (default: %default)')
+    options, args = parser.parse_args()
+    backends = args or ['fake', 'kombu']
+
+    FLAGS.fake_rabbit = True
+    # Callers and consumers share one connection pool here, so calls
+    # waiting for their replies must leave connections to send them.
+    FLAGS.rpc_conn_pool_size = max(FLAGS.rpc_conn_pool_size,
+                                   2 * options.concurrency)
+    logging.setup()
+    memory = []
+    print '%-8s %-12s %10s %10s %10s' % ('backend', 'operation', 'msgs/s',
+                                         'p50 (ms)', 'p99 (ms)')
+    for backend in backends:
+        memory.append((backend, run_backend(backend, options)))
+    print
+    print '%-8s %18s %18s' % ('backend', 'objects per call',
+                              'KB per call')
+    for backend, (objects, size) in memory:
+        print '%-8s %18.1f %18.2f' % (backend, objects, size / 1024.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the overhead nova.validation adds to each call of a decorated
+method, with validators that do no work of their own.
+
+    python tools/benchmarks/validation_overhead.py [--calls N] [validators ...]
+
+Run it before and after a change to nova/validation.py to compare.
+"""
+
+import gettext
+from optparse import OptionParser
+import os
+import sys
+import timeit
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import validation
+
+PARAMS = ['context', 'instance_id', 'name', 'flavor_id', 'image_id',
+          'network_id', 'zone', 'key_name']
+
+
+def make_validator(param):
+    """Validator of one param, like the ones in nova.validate_rules."""
+    def validate(self, value):
+        pass
+    validate.func_name = 'validate_%s' % param
+    return type('%sValidator' % param, (validation.Validator,),
+                {validate.func_name: validate})
+
+
+class Target(object):
+    def create(self, context, instance_id, name, flavor_id=None,
+               image_id=None, network_id=None, zone=None, key_name=None):
+        pass
+
+
+def main():
+    parser = OptionParser(usage='%prog [--calls N] [validators ...]')
+    parser.add_option('--calls', type='int', default=20000,
+                      help='calls per measurement (default: %default)')
+    options, args = parser.parse_args()
+    counts = [int(arg) for arg in args] or [1, 3, len(PARAMS)]
+
+    create = Target.__dict__['create']
+    target = Target()
+    call = lambda: target.create(None, 1, 'name', flavor_id=1, image_id=2)
+    timer = timeit.Timer(call)
+    plain = min(timer.repeat(3, options.calls)) / options.calls
+
+    print '%10s %14s %14s' % ('validators', 'call (us)', 'overhead (us)')
+    print '%10s %14.2f %14s' % ('none', plain * 10 ** 6, '-')
+    for count in counts:
+        validators = [make_validator(param) for param in PARAMS[:count]]
+        Target.create = validation.method(*validators)(create)
+        validation.apply()
+        best = min(timer.repeat(3, options.calls)) / options.calls
+        print '%10d %14.2f %14.2f' % (count, best * 10 ** 6,
+                                      (best - plain) * 10 ** 6)
+
+
+if __name__ == '__main__':
+    main()